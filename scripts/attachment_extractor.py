@@ -0,0 +1,253 @@
+"""첨부파일 텍스트 추출 (mbox_converter.py의 파싱 워커에서 실행)
+
+첨부파일 이름만 저장하면 "견적서 PDF에 적힌 납기"처럼 파일 내용을 묻는 질문에 답할 수 없다.
+메시지 파싱과 같은 프로세스 풀에서 첨부파일 본문을 텍스트로 뽑아 이메일 레코드의 attachment_texts에 넣고,
+chunk_emailwise.py가 이를 부모 이메일에 연결된 자식 청크로 만든다.
+
+  - 지원 형식: PDF(pypdf, 선택), XLSX(openpyxl), DOCX/PPTX(zip 안의 XML), HTML, TXT/CSV/JSON 등 텍스트
+  - 파일당 상한: 크기 ATTACHMENT_MAX_BYTES, 추출 시간 ATTACHMENT_TIMEOUT초(SIGALRM), 텍스트 ATTACHMENT_MAX_CHARS자
+  - 같은 내용의 첨부파일(전달/재전송)은 내용 해시로 data/attachment_cache/에 캐시해 한 번만 추출
+    (시간 초과/오류 결과도 캐시하므로 문제 파일이 전달될 때마다 시간을 쓰지 않음)
+"""
+import io
+import json
+import os
+import re
+import signal
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+
+from bs4 import BeautifulSoup
+from checkpoint import content_hash
+
+ATTACHMENT_CACHE_DIR = "/home/eunjo/Desktop/Outlook_LLM_v3/data/attachment_cache"
+
+# EXTRACT_ATTACHMENTS=0 이면 예전처럼 첨부파일 이름만 저장
+EXTRACT_ATTACHMENTS = os.getenv("EXTRACT_ATTACHMENTS", "1") == "1"
+ATTACHMENT_MAX_BYTES = 20 * 1024 * 1024   # 이보다 큰 첨부파일은 읽지 않음
+ATTACHMENT_MAX_UNZIPPED = 100 * 1024 * 1024  # DOCX/PPTX/XLSX 압축 해제 크기 상한 (zip bomb 방지)
+ATTACHMENT_TIMEOUT = 30                    # 파일 하나의 추출 시간 상한 (초)
+ATTACHMENT_MAX_CHARS = 200_000             # 파일 하나에서 저장할 최대 글자 수
+EXTRACTOR_VERSION = 1                      # 추출 방식이 바뀌면 올림 (캐시 무효화)
+
+TEXT_EXTENSIONS = {".txt", ".csv", ".tsv", ".md", ".log", ".json", ".xml"}
+HTML_EXTENSIONS = {".html", ".htm"}
+
+WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+DRAWING_NS = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+
+SPACES = re.compile(r"[ \t\r\f\v\xa0]+")
+BLANK_LINES = re.compile(r"\n\s*\n+")
+
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+class UnsupportedFormat(Exception):
+    pass
+
+
+def params():
+    """추출 결과에 영향을 주는 설정 (바뀌면 mbox_converter가 전체 재생성)"""
+    return {
+        "extract_attachments": EXTRACT_ATTACHMENTS,
+        "attachment_max_bytes": ATTACHMENT_MAX_BYTES,
+        "attachment_timeout": ATTACHMENT_TIMEOUT,
+        "attachment_max_chars": ATTACHMENT_MAX_CHARS,
+        "extractor_version": EXTRACTOR_VERSION,
+    }
+
+
+@contextmanager
+def time_limit(seconds):
+    """seconds초가 지나면 ExtractionTimeout (SIGALRM이라 Unix 메인 스레드에서만 동작, 그 외에는 제한 없음)"""
+    if not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def on_alarm(signum, frame):
+        raise ExtractionTimeout(f"{seconds}초 초과")
+
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def normalize_text(text):
+    """공백 정리 (줄바꿈은 청크 분할의 문장 경계로 쓰이므로 유지)"""
+    lines = (SPACES.sub(" ", line).strip() for line in text.split("\n"))
+    return BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+
+def decode_text(data):
+    for encoding in ("utf-8-sig", "cp949"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("latin-1")
+
+
+def read_zip_member(archive, name):
+    """zip 항목 읽기 (압축 해제 크기가 상한을 넘으면 UnsupportedFormat)"""
+    if archive.getinfo(name).file_size > ATTACHMENT_MAX_UNZIPPED:
+        raise UnsupportedFormat(f"{name} 압축 해제 크기 초과")
+    return archive.read(name)
+
+
+def xml_paragraphs(data, paragraph_tag, text_tag):
+    """Office XML에서 문단별 텍스트"""
+    for paragraph in ET.fromstring(data).iter(paragraph_tag):
+        text = "".join(node.text or "" for node in paragraph.iter(text_tag))
+        if text.strip():
+            yield text
+
+
+def extract_pdf(data):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise UnsupportedFormat("pypdf 미설치")
+    for page in PdfReader(io.BytesIO(data)).pages:
+        yield page.extract_text() or ""
+
+
+def extract_docx(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        yield from xml_paragraphs(read_zip_member(archive, "word/document.xml"), WORD_NS + "p", WORD_NS + "t")
+
+
+def extract_pptx(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        slides = [name for name in archive.namelist() if re.fullmatch(r"ppt/slides/slide\d+\.xml", name)]
+        for name in sorted(slides, key=lambda n: int(re.search(r"\d+", n.rsplit("/", 1)[1]).group())):
+            yield from xml_paragraphs(read_zip_member(archive, name), DRAWING_NS + "p", DRAWING_NS + "t")
+
+
+def extract_xlsx(data):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise UnsupportedFormat("openpyxl 미설치")
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        if sum(info.file_size for info in archive.infolist()) > ATTACHMENT_MAX_UNZIPPED:
+            raise UnsupportedFormat("압축 해제 크기 초과")
+    workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield f"## {sheet.title}"
+            for row in sheet.iter_rows(values_only=True):
+                cells = [str(value) for value in row if value is not None and str(value).strip()]
+                if cells:
+                    yield " | ".join(cells)
+    finally:
+        workbook.close()
+
+
+def extract_html(data):
+    yield BeautifulSoup(decode_text(data), "html.parser").get_text("\n", strip=True)
+
+
+def extract_plain(data):
+    yield decode_text(data)
+
+
+EXTRACTORS = {
+    ".pdf": extract_pdf,
+    ".docx": extract_docx,
+    ".pptx": extract_pptx,
+    ".xlsx": extract_xlsx,
+    ".xlsm": extract_xlsx,
+    **{ext: extract_html for ext in HTML_EXTENSIONS},
+    **{ext: extract_plain for ext in TEXT_EXTENSIONS},
+}
+
+CONTENT_TYPES = {
+    "application/pdf": ".pdf",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": ".docx",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation": ".pptx",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": ".xlsx",
+    "text/html": ".html",
+    "text/plain": ".txt",
+    "text/csv": ".csv",
+}
+
+
+def pick_extractor(filename, content_type):
+    """확장자 우선, 없으면 MIME 형식으로 추출 함수 선택 (지원하지 않으면 None)"""
+    extension = os.path.splitext(filename)[1].lower()
+    return EXTRACTORS.get(extension) or EXTRACTORS.get(CONTENT_TYPES.get(content_type, ""))
+
+
+def extract_text(extractor, data):
+    """조각을 이어 붙이다가 ATTACHMENT_MAX_CHARS를 넘으면 중단 (큰 파일도 앞부분만 처리)"""
+    pieces, size = [], 0
+    with time_limit(ATTACHMENT_TIMEOUT):
+        for piece in extractor(data):
+            pieces.append(piece)
+            size += len(piece) + 1
+            if size >= ATTACHMENT_MAX_CHARS:
+                break
+    return normalize_text("\n".join(pieces))[:ATTACHMENT_MAX_CHARS]
+
+
+def cache_path(digest):
+    return os.path.join(ATTACHMENT_CACHE_DIR, digest[:2], f"{digest}.json")
+
+
+def load_cached(digest):
+    try:
+        with open(cache_path(digest), 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return entry if entry.get("params") == params() else None
+
+
+def save_cached(digest, entry):
+    """임시 파일 → os.replace (여러 워커가 같은 파일을 동시에 써도 항상 완전한 항목만 보임)"""
+    path = cache_path(digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(dict(entry, params=params()), f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def extract_attachment(filename, content_type, data):
+    """첨부파일 하나 → {"filename", "content_hash", "status", "text"}
+
+    status: ok | cached | empty | unsupported | too_large | timeout | error (텍스트는 ok/cached일 때만)
+    """
+    result = {"filename": filename, "content_hash": None, "status": "unsupported", "text": ""}
+    extractor = pick_extractor(filename, content_type)
+    if extractor is None or data is None:
+        return result
+    if len(data) > ATTACHMENT_MAX_BYTES:
+        return dict(result, status="too_large")
+
+    digest = result["content_hash"] = content_hash(data)
+    cached = load_cached(digest)
+    if cached is not None:
+        status = "cached" if cached["status"] == "ok" else cached["status"]
+        return dict(result, status=status, text=cached["text"])
+
+    try:
+        text = extract_text(extractor, data)
+        entry = {"status": "ok" if text else "empty", "text": text}
+    except ExtractionTimeout:
+        entry = {"status": "timeout", "text": ""}
+    except UnsupportedFormat:
+        # 라이브러리 미설치 등 환경 문제는 설치 후 다시 시도할 수 있도록 캐시하지 않음
+        return result
+    except Exception:
+        entry = {"status": "error", "text": ""}
+    save_cached(digest, entry)
+    return dict(result, **entry)
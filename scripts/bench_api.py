@@ -0,0 +1,183 @@
+"""src/rag_api.py 부하 테스트 (동시 클라이언트 수별 처리량/지연)
+
+클라이언트 N개가 각자 질문을 순서대로 보내는 닫힌 루프(closed loop)로 duration초 동안 /search 또는 /ask를 호출하고
+동시 클라이언트 수마다 req/s, p50/p95/p99 지연, (/ask) 첫 토큰까지 시간, 서버의 평균 임베딩 배치 크기를 출력한다.
+표준 라이브러리만 사용한다.
+
+사용법:
+  cd src && python rag_api.py --port 8000          # 서버 (다른 터미널)
+  python bench_api.py --endpoint search --clients 1 8 32 --duration 20
+  python bench_api.py --endpoint ask --queries queries.txt --output ask.json
+
+/ask는 같은 질문을 반복하면 답변 캐시에서 응답하므로, 캐시 적중 수를 함께 출력한다
+(LLM 경로를 재려면 --queries로 서로 다른 질문을 충분히 준다).
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_QUERIES = [
+    "What are the VV transportation challenges?",
+    "ANB inspection reports for sector 6",
+    "Who sent the welding procedure update?",
+    "Summarize the discussion about the shipment schedule",
+    "Emails from 2021-03 about customs clearance",
+    "What was decided in the last design review meeting?",
+    "Status of the VV-S6-101 nonconformity",
+    "Which documents were attached to the quality plan revision?",
+]
+
+
+def post(base_url, path, query, timeout):
+    request = urllib.request.Request(
+        base_url + path, data=json.dumps({"query": query}).encode("utf-8"),
+        headers={"Content-Type": "application/json"}, method="POST",
+    )
+    return urllib.request.urlopen(request, timeout=timeout)
+
+
+def call_search(base_url, query, timeout):
+    """→ (지연 초, 첫 토큰 초 또는 None, 캐시 적중 여부)"""
+    started = time.perf_counter()
+    with post(base_url, "/search", query, timeout) as response:
+        json.loads(response.read())
+    return time.perf_counter() - started, None, False
+
+
+def call_ask(base_url, query, timeout):
+    """SSE 스트림을 done까지 읽음 → (지연 초, 첫 토큰 초, 캐시 적중 여부)"""
+    started = time.perf_counter()
+    first_token, cached, event = None, False, None
+    with post(base_url, "/ask", query, timeout) as response:
+        for raw in response:
+            line = raw.decode("utf-8").rstrip("\n")
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                if event == "token" and first_token is None:
+                    first_token = time.perf_counter() - started
+                elif event == "done":
+                    cached = json.loads(line[len("data: "):]).get("cached", False)
+                elif event == "error":
+                    raise RuntimeError(json.loads(line[len("data: "):])["message"])
+    return time.perf_counter() - started, first_token, cached
+
+
+def get_health(base_url):
+    with urllib.request.urlopen(base_url + "/health", timeout=10) as response:
+        return json.loads(response.read())
+
+
+def run_level(base_url, call, queries, clients, duration, timeout):
+    """클라이언트 clients개로 duration초 동안 호출 → 결과 요약"""
+    latencies, first_tokens, errors = [], [], []
+    cache_hits = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        nonlocal cache_hits
+        i = index
+        while time.perf_counter() < deadline:
+            query = queries[i % len(queries)]
+            i += clients
+            try:
+                latency, first_token, cached = call(base_url, query, timeout)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                latencies.append(latency)
+                if first_token is not None:
+                    first_tokens.append(first_token)
+                cache_hits += cached
+
+    before = get_health(base_url)["embedding_batcher"]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(client, range(clients)))
+    elapsed = time.perf_counter() - started
+    after = get_health(base_url)["embedding_batcher"]
+
+    batches = after["batches"] - before["batches"]
+    result = {
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_rps": len(latencies) / elapsed,
+        "mean_embed_batch": (after["queries"] - before["queries"]) / batches if batches else 0.0,
+        "cache_hits": cache_hits,
+    }
+    if latencies:
+        result["latency_ms"] = dict(zip(("p50", "p95", "p99"), np.percentile(latencies, [50, 95, 99]) * 1000))
+    if first_tokens:
+        result["first_token_ms"] = dict(zip(("p50", "p95", "p99"), np.percentile(first_tokens, [50, 95, 99]) * 1000))
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+
+def print_result(result):
+    latency = result.get("latency_ms", {})
+    line = (f"{result['clients']:>4} clients  {result['throughput_rps']:>7.1f} req/s  "
+            f"p50 {latency.get('p50', 0):>7.0f}ms  p95 {latency.get('p95', 0):>7.0f}ms  "
+            f"p99 {latency.get('p99', 0):>7.0f}ms  embed batch {result['mean_embed_batch']:>4.1f}")
+    if "first_token_ms" in result:
+        line += f"  ttft p50 {result['first_token_ms']['p50']:.0f}ms  cache hits {result['cache_hits']}"
+    if result["errors"]:
+        line += f"  ❌ {result['errors']} errors ({result['first_error']})"
+    print(line)
+
+
+def load_queries(path):
+    """한 줄에 질문 하나 (JSONL이면 "query" 필드)"""
+    queries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                queries.append(json.loads(line)["query"] if line.startswith("{") else line)
+    return queries
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--url", default="http://127.0.0.1:8000")
+    arg_parser.add_argument("--endpoint", choices=["search", "ask"], default="search")
+    arg_parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    arg_parser.add_argument("--duration", type=float, default=20.0, help="동시 클라이언트 수마다 실행할 시간 (초)")
+    arg_parser.add_argument("--timeout", type=float, default=120.0)
+    arg_parser.add_argument("--queries", help="질문 파일 (기본: 내장 질문 8개)")
+    arg_parser.add_argument("--output", help="결과 JSON 경로")
+    args = arg_parser.parse_args()
+
+    base_url = args.url.rstrip("/")
+    queries = load_queries(args.queries) if args.queries else DEFAULT_QUERIES
+    call = call_ask if args.endpoint == "ask" else call_search
+    health = get_health(base_url)
+    print(f"/{args.endpoint} · 질문 {len(queries)}개 · LLM 동시 실행 {health['llm']['concurrency']}")
+
+    # 연결/모델 워밍업
+    call(base_url, queries[0], args.timeout)
+
+    results = []
+    for clients in args.clients:
+        result = run_level(base_url, call, queries, clients, args.duration, args.timeout)
+        print_result(result)
+        results.append(result)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"endpoint": args.endpoint, "url": base_url, "results": results}, f, indent=2,
+                      ensure_ascii=False)
+        print(f"결과가 '{args.output}'에 저장되었습니다.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""data_cleaner.py 처리량 벤치마크 (합성 코퍼스)
+
+일반 텍스트 / HTML / 인용 이력 / 서명이 섞인 이메일을 만들어
+  1. 예전 clean_body (매번 BeautifulSoup + 패턴별 finditer/split, 단일 프로세스)
+  2. 새 clean_body (HTML일 때만 파서 + 컴파일된 단일 패턴, 단일 프로세스)
+  3. 새 파이프라인 (열 기반 저장소 읽기 + 프로세스 풀 + 순서 유지 출력)
+의 emails/sec와 1번 대비 본문 일치율을 출력한다.
+
+사용법: python bench_data_cleaner.py [--emails 20000] [--workers 1 4 8]
+"""
+import argparse
+import os
+import random
+import re
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bs4 import BeautifulSoup
+
+import data_cleaner
+from data_cleaner import clean_body, iter_cleaned
+from record_store import EMAIL_SCHEMA, RecordStoreWriter
+
+LEGACY_SIGNATURE_PATTERNS = [
+    r"(?i)(--\s*|\nThanks[^\n]*|Best regards[^\n]*|Sent from [^\n]*|Regards[^\n]*)"
+]
+LEGACY_HISTORY_PATTERNS = [
+    r"(?i)^[-\s]*Original Message[-\s]*$",
+    r"(?i)^From: .+",
+    r"(?i)^Sent: .+",
+    r"(?i)^To: .+",
+    r"(?i)^Subject: .+",
+    r"(?i)^On .+ wrote:",
+    r"(?i)^> .+",
+]
+
+
+def legacy_clean_body(text):
+    """변경 전 data_cleaner.clean_body"""
+    if not text:
+        return ""
+    soup = BeautifulSoup(text, "html.parser")
+    text = soup.get_text()
+
+    for pattern in LEGACY_HISTORY_PATTERNS:
+        matches = list(re.finditer(pattern, text, flags=re.MULTILINE))
+        if matches:
+            text = text[:matches[0].start()]
+            break
+
+    for pattern in LEGACY_SIGNATURE_PATTERNS:
+        text = re.split(pattern, text)[0]
+
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+WORDS = ("shipment invoice sector transport schedule meeting approval budget contract delivery "
+         "report update pipeline container customs vendor quote revision site inspection").split()
+
+
+def sentence(rng):
+    words = rng.choices(WORDS, k=rng.randint(6, 16))
+    return " ".join(words).capitalize() + "."
+
+
+def synthetic_body(rng):
+    paragraphs = ["\n".join(sentence(rng) for _ in range(rng.randint(2, 6))) for _ in range(rng.randint(1, 8))]
+    body = "\n\n".join(paragraphs)
+    kind = rng.random()
+    if kind < 0.25:
+        body = "<html><body>" + "".join(f"<p>{p.replace(chr(10), '<br>')}</p>" for p in paragraphs) + "</body></html>"
+    elif kind < 0.4:
+        # 문서 태그 없이 강조/인용 태그만 있는 HTML 조각
+        tags = ["strong", "em", "center", "blockquote", "sup", "code", "o:p"]
+        body = "\n\n".join(
+            f"<{tag}>{p}</{tag}>" if rng.random() < 0.5 else p.replace(" ", f" <{tag}>", 1) + f"</{tag}>"
+            for p, tag in ((p, rng.choice(tags)) for p in paragraphs)
+        )
+    if rng.random() < 0.5:
+        history = "\n".join(sentence(rng) for _ in range(rng.randint(5, 40)))
+        body += f"\n\n-----Original Message-----\nFrom: Kim <kim@example.com>\nSent: Monday\nSubject: RE: update\n\n{history}"
+    if rng.random() < 0.4:
+        body += "\n\nBest regards,\nEunjo\nSent from my iPhone"
+    return body
+
+
+def synthetic_corpus(n, seed=0):
+    rng = random.Random(seed)
+    return [
+        {
+            "message_id": f"<bench-{i}@example.com>",
+            "content_hash": f"{i:016x}",
+            "subject": f"Sector {rng.randint(1, 9)} {rng.choice(WORDS)}",
+            "body": synthetic_body(rng),
+            "from_list": ["Kim <kim@example.com>"],
+            "to_list": ["Lee <lee@example.com>"],
+            "cc_list": [],
+            "name_email_map": {"Kim": "kim@example.com"},
+            "date_iso": "2024-03-01T09:00:00+09:00",
+            "attachments": [],
+        }
+        for i in range(n)
+    ]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--emails", type=int, default=20000)
+    arg_parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, os.cpu_count() or 1}))
+    args = arg_parser.parse_args()
+
+    corpus = synthetic_corpus(args.emails)
+    bodies = [email["body"] for email in corpus]
+    print(f"합성 이메일 {len(corpus)}개 (평균 본문 {sum(map(len, bodies)) / len(bodies):.0f}자)")
+
+    legacy, legacy_secs = timed(lambda: [legacy_clean_body(b) for b in bodies])
+    new, new_secs = timed(lambda: [clean_body(b) for b in bodies])
+    same = sum(a == b for a, b in zip(legacy, new))
+    print(f"{'legacy clean_body':<28}{len(bodies) / legacy_secs:>10.0f} emails/s")
+    print(f"{'new clean_body':<28}{len(bodies) / new_secs:>10.0f} emails/s "
+          f"(x{legacy_secs / new_secs:.1f}, 본문 일치 {same / len(bodies):.1%})")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = os.path.join(tmp, "raw.store")
+        with RecordStoreWriter(input_path, EMAIL_SCHEMA, key="message_id") as store:
+            for email in corpus:
+                store.append(email)
+
+        for workers in args.workers:
+            data_cleaner.MAX_INFLIGHT = workers * 2
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                outputs, secs = timed(lambda: [out for _, out in iter_cleaned(executor, input_path, 0, {})])
+            written = sum(out is not None for out in outputs)
+            print(f"{f'pipeline ({workers} workers)':<28}{len(corpus) / secs:>10.0f} emails/s "
+                  f"(x{legacy_secs / secs:.1f}, {written}개 기록)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""질문 임베딩 마이크로 배처 벤치마크 (flush deadline별 처리량 vs 추가 지연)
+
+동시 클라이언트 N개가 서로 다른 질문을 닫힌 루프로 duration초 동안 임베딩하면서
+  - direct: 배처 없이 각 스레드가 embed_query를 직접 호출 (기존 방식)
+  - wait=W ms: EmbeddingBatcher (첫 질문 이후 W ms까지 모아 한 번에 인코딩, LRU 캐시 끔)
+의 queries/s, p50/p95/p99 지연, 평균 배치 크기를 출력한다. "added"는 같은 클라이언트 수에서 direct 대비 p50 지연 차이.
+마지막으로 질문의 일부가 반복될 때 LRU 캐시 적중률과 처리량을 측정한다.
+
+사용법: python bench_query_embedder.py [--model BAAI/bge-m3] [--clients 1 8 32] [--waits 0 2 5 10 20] [--duration 10]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import rag_resources
+from embedding_batcher import EmbeddingBatcher
+from langchain_community.embeddings import HuggingFaceEmbeddings
+
+WORDS = ("VV transportation schedule sector ANB inspection report welding procedure shipment customs "
+         "meeting approval nonconformity revision quality plan vendor delivery status decision").split()
+
+
+def make_queries(n, seed=0):
+    """서로 다른 질문 n개 (캐시/배치 내 중복 제거가 결과에 섞이지 않도록 번호를 붙임)"""
+    rng = random.Random(seed)
+    return [f"{' '.join(rng.choices(WORDS, k=rng.randint(4, 12)))} #{i}" for i in range(n)]
+
+
+def run_clients(embed, queries, clients, duration):
+    """clients개 스레드가 duration초 동안 embed(질문) 반복 → (queries/s, 지연 초 목록)"""
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        i, local = index, []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            embed(queries[i % len(queries)])
+            local.append(time.perf_counter() - started)
+            i += clients
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(client, range(clients)))
+    return len(latencies) / (time.perf_counter() - started), latencies
+
+
+def summarize(mode, clients, qps, latencies, batcher=None):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    row = {"mode": mode, "clients": clients, "qps": qps, "p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+    if batcher is not None:
+        row["mean_batch"] = batcher.mean_batch()
+        row["cache_hit_rate"] = batcher.cache_hit_rate()
+    return row
+
+
+def print_row(row, direct_p50=None):
+    line = (f"{row['mode']:<14}{row['clients']:>4} clients {row['qps']:>8.1f} q/s  "
+            f"p50 {row['p50_ms']:>7.1f}ms  p95 {row['p95_ms']:>7.1f}ms  p99 {row['p99_ms']:>7.1f}ms")
+    if "mean_batch" in row:
+        line += f"  batch {row['mean_batch']:>5.1f}"
+    if direct_p50 is not None:
+        line += f"  added {row['p50_ms'] - direct_p50:>+7.1f}ms"
+    if row.get("cache_hit_rate"):
+        line += f"  cache {row['cache_hit_rate']:.0%}"
+    print(line)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--model", default=rag_resources.EMBEDDING_MODEL)
+    arg_parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32])
+    arg_parser.add_argument("--waits", type=float, nargs="+", default=[0, 2, 5, 10, 20], help="flush deadline (ms)")
+    arg_parser.add_argument("--duration", type=float, default=10.0, help="설정마다 실행할 시간 (초)")
+    arg_parser.add_argument("--repeat-ratio", type=float, default=0.5, help="캐시 측정에서 반복 질문 비율")
+    arg_parser.add_argument("--output", help="결과 JSON 경로")
+    args = arg_parser.parse_args()
+
+    model = HuggingFaceEmbeddings(model_name=args.model, model_kwargs={"device": rag_resources.pick_device()})
+    model.embed_query("warmup")
+    queries = make_queries(200000)
+    print(f"{args.model} · 최대 배치 {rag_resources.QUERY_EMBED_BATCH_SIZE}")
+
+    rows = []
+    for clients in args.clients:
+        qps, latencies = run_clients(model.embed_query, queries, clients, args.duration)
+        direct = summarize("direct", clients, qps, latencies)
+        print_row(direct)
+        rows.append(direct)
+        for wait in args.waits:
+            batcher = EmbeddingBatcher(model, rag_resources.QUERY_EMBED_BATCH_SIZE, wait / 1000)
+            try:
+                qps, latencies = run_clients(batcher.embed_query, queries, clients, args.duration)
+            finally:
+                batcher.close()
+            row = dict(summarize(f"wait={wait:g}ms", clients, qps, latencies, batcher), wait_ms=wait)
+            print_row(row, direct["p50_ms"])
+            rows.append(row)
+        print()
+
+    # 반복 질문이 섞일 때 LRU 캐시 효과 (가장 많은 클라이언트 수, 기본 wait)
+    clients = max(args.clients)
+    rng = random.Random(1)
+    popular = queries[:50]
+    mixed = [rng.choice(popular) if rng.random() < args.repeat_ratio else q for q in queries[50:]]
+    batcher = EmbeddingBatcher(model, rag_resources.QUERY_EMBED_BATCH_SIZE, rag_resources.QUERY_EMBED_WAIT,
+                               rag_resources.QUERY_EMBED_CACHE_SIZE)
+    try:
+        qps, latencies = run_clients(batcher.embed_query, mixed, clients, args.duration)
+    finally:
+        batcher.close()
+    row = dict(summarize("lru cache", clients, qps, latencies, batcher), repeat_ratio=args.repeat_ratio)
+    print_row(row)
+    rows.append(row)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"model": args.model, "results": rows}, f, indent=2)
+        print(f"결과가 '{args.output}'에 저장되었습니다.")
+
+
+if __name__ == "__main__":
+    main()
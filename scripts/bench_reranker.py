@@ -0,0 +1,135 @@
+"""cross-encoder 재정렬 비용 벤치마크 (후보 수별 지연, 배치 크기, 점수 캐시, 지연 예산)
+
+질문 N개 각각에 대해 후보 청크 pool개를 CrossEncoderReranker로 정렬하면서
+  - cold: 캐시 없이 모든 쌍을 계산할 때 p50/p95 지연과 쌍 하나당 비용 (batch 크기별)
+  - warm: 같은 질문/후보를 다시 정렬할 때 (점수 캐시 적중) 지연
+  - budget: RERANK_BUDGET 예산 안에 모든 후보를 정렬한 비율과 정렬된 후보 비율
+를 출력한다. 후보는 청크 저장소(--store)가 있으면 실제 청크, 없으면 합성 문단을 사용한다.
+
+사용법: python bench_reranker.py [--model cross-encoder/mmarco-mMiniLMv2-L12-H384-v1] [--pools 10 25 50 100 200]
+                                [--batch-sizes 8 16 32] [--queries 20] [--store ../data/outlook_chunk_emailwise.store]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import build_chromaDB
+import rag_resources
+from langchain_core.documents import Document
+from record_store import RecordStore
+from reranker import CrossEncoderReranker
+
+WORDS = ("VV transportation schedule sector ANB inspection report welding procedure shipment customs "
+         "meeting approval nonconformity revision quality plan vendor delivery status decision").split()
+
+
+def load_passages(store_path, count, seed=0):
+    """청크 저장소에서 무작위 청크 내용 count개 (저장소가 없으면 합성 문단)"""
+    rng = random.Random(seed)
+    store = RecordStore.load(store_path) if store_path else None
+    if store is not None and len(store):
+        rows = rng.sample(range(len(store)), min(count, len(store)))
+        return [store.value("content", row) for row in rows], f"{store_path} ({len(store)} chunks)"
+    passages = [" ".join(rng.choices(WORDS, k=rng.randint(60, 300))) for _ in range(count)]
+    return passages, "synthetic"
+
+
+def make_queries(n, seed=0):
+    rng = random.Random(seed)
+    return [f"{' '.join(rng.choices(WORDS, k=rng.randint(4, 10)))} #{i}" for i in range(n)]
+
+
+def candidate_sets(queries, passages, pool, seed=0):
+    """질문마다 후보 pool개 (Document는 rerank가 metadata를 바꾸므로 매번 새로 만듦)"""
+    rng = random.Random(seed)
+    return [(query, rng.sample(passages, min(pool, len(passages)))) for query in queries]
+
+
+def run(reranker, sets, budget):
+    """질문별 rerank 지연 (초)과 완료 여부"""
+    latencies, complete = [], []
+    for query, texts in sets:
+        docs = [Document(page_content=text, metadata={}) for text in texts]
+        started = time.perf_counter()
+        _, done = reranker.rerank(query, docs, budget)
+        latencies.append(time.perf_counter() - started)
+        complete.append(done)
+    return latencies, complete
+
+
+def summarize(latencies, pool):
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+    return {"p50_ms": round(float(p50), 1), "p95_ms": round(float(p95), 1),
+            "ms_per_pair": round(float(np.mean(latencies)) * 1000 / pool, 2)}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--model", default=rag_resources.RERANK_MODEL)
+    arg_parser.add_argument("--pools", type=int, nargs="+", default=[10, 25, 50, 100, 200], help="후보 수")
+    arg_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 16, 32])
+    arg_parser.add_argument("--queries", type=int, default=20, help="후보 수/배치 크기마다 정렬할 질문 수")
+    arg_parser.add_argument("--budget", type=float, default=rag_resources.RERANK_BUDGET, help="예산 측정의 지연 상한 (초)")
+    arg_parser.add_argument("--store", default=build_chromaDB.CHUNK_STORE_PATH, help="후보로 쓸 청크 저장소")
+    arg_parser.add_argument("--output", help="결과 JSON 경로")
+    args = arg_parser.parse_args()
+
+    model = rag_resources.load_rerank_model(args.model)
+    if model is None:
+        sys.exit(1)
+    model.predict([("warmup", "warmup")], show_progress_bar=False)
+    passages, source = load_passages(args.store, max(args.pools) * 4)
+    queries = make_queries(args.queries)
+    print(f"{args.model} · device {rag_resources.pick_device()} · max_length {rag_resources.RERANK_MAX_LENGTH} · "
+          f"후보: {source}")
+
+    rows = []
+    for pool in args.pools:
+        sets = candidate_sets(queries, passages, pool)
+        for batch_size in args.batch_sizes:
+            latencies, _ = run(CrossEncoderReranker(model, batch_size, float("inf")), sets, None)
+            row = dict(summarize(latencies, pool), mode="cold", pool=pool, batch_size=batch_size)
+            rows.append(row)
+            print(f"pool {pool:>4}  batch {batch_size:>3}  cold  p50 {row['p50_ms']:>8.1f}ms  "
+                  f"p95 {row['p95_ms']:>8.1f}ms  {row['ms_per_pair']:>6.2f}ms/pair")
+
+        # 같은 질문/후보 재정렬 (점수 캐시) - 기본 배치 크기
+        reranker = CrossEncoderReranker(model, rag_resources.RERANK_BATCH_SIZE, float("inf"),
+                                        rag_resources.RERANK_CACHE_SIZE)
+        run(reranker, sets, None)
+        hits, pairs = reranker.stats["cache_hits"], reranker.stats["pairs"]
+        latencies, _ = run(reranker, sets, None)
+        hit_rate = (reranker.stats["cache_hits"] - hits) / (reranker.stats["pairs"] - pairs)
+        row = dict(summarize(latencies, pool), mode="warm", pool=pool, batch_size=rag_resources.RERANK_BATCH_SIZE,
+                   cache_hit_rate=round(hit_rate, 3))
+        rows.append(row)
+        print(f"pool {pool:>4}  batch {row['batch_size']:>3}  warm  p50 {row['p50_ms']:>8.1f}ms  "
+              f"p95 {row['p95_ms']:>8.1f}ms  cache {row['cache_hit_rate']:.0%}")
+
+        # 예산 안에 끝나는 비율 (캐시 없음)
+        reranker = CrossEncoderReranker(model, rag_resources.RERANK_BATCH_SIZE, args.budget)
+        latencies, complete = run(reranker, sets, None)
+        stats = reranker.stats
+        row = dict(summarize(latencies, pool), mode="budget", pool=pool, batch_size=rag_resources.RERANK_BATCH_SIZE,
+                   budget_ms=args.budget * 1000, complete_rate=round(float(np.mean(complete)), 3),
+                   scored_rate=round(stats["scored"] / stats["pairs"], 3))
+        rows.append(row)
+        print(f"pool {pool:>4}  budget {args.budget * 1000:.0f}ms  p95 {row['p95_ms']:>8.1f}ms  "
+              f"complete {row['complete_rate']:.0%}  scored {row['scored_rate']:.0%}")
+        print()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"model": args.model, "candidates": source, "results": rows}, f, indent=2)
+        print(f"결과가 '{args.output}'에 저장되었습니다.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,569 @@
+"""오프라인 검색 벤치마크 (품질 + 지연 + 인덱스 빌드)
+
+합성 mbox 코퍼스와 라벨 질의 세트(질문 → 정답 message_id)를 만들고, 임시 작업 디렉터리에서
+mbox_converter → data_cleaner → near_dedup → thread_builder → chunk_emailwise → build_chromaDB 전체를 실행한 뒤,
+LLM을 결정적인 로컬 스텁으로 바꾼 검색 파이프라인(hybrid = 재정렬 없는 smart_retrieve, vector, keyword,
+rerank = cross-encoder 재정렬을 포함한 smart_retrieve)별로
+  - recall@1/5/10, MRR (질의 유형별 포함)
+  - 단계별 지연 p50/p95/p99
+  - 단계별 빌드 시간, 인덱스 크기
+를 측정해 JSON으로 저장한다. --baseline으로 이전 결과와 비교하면 품질이 떨어진 지표를 표시하고 종료 코드 1을 반환한다.
+
+사용법:
+  python bench_retrieval.py --threads 200 --output bench_retrieval.json
+  python bench_retrieval.py --embedding-model sentence-transformers/all-MiniLM-L6-v2 --baseline bench_retrieval.json
+  CHUNK_MAX_CHARS=0 python bench_retrieval.py ...                 # 청크 설정 비교
+  python bench_retrieval.py --pipelines hybrid rerank              # 재정렬 전후 비교 (RERANK_BUDGET으로 예산 조절)
+  python bench_retrieval.py --mbox-dir <"2021 MM.mbox" 폴더> --queries labeled.jsonl   # 실제 코퍼스
+
+라벨 질의 파일은 한 줄에 {"query": ..., "expected": [message_id, ...], "type": ...} 형식의 JSONL.
+"""
+import argparse
+import json
+import mailbox
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import build_chromaDB
+import checkpoint
+import chunk_emailwise
+import data_cleaner
+import mbox_converter
+import near_dedup
+import rag_pipeline
+import rag_resources
+import thread_builder
+from bm25_index import BM25Index
+from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_community.vectorstores import Chroma
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+from query_filters import QueryFilterExtractor, SenderMatcher, load_known_senders, parse_query_filters
+from record_store import RecordStore
+from thread_index import ThreadIndex
+from tracing import RequestTrace
+
+RECALL_AT = (1, 5, 10)
+QUALITY_METRICS = tuple(f"recall@{k}" for k in RECALL_AT) + ("mrr",)
+
+# =====================
+# 합성 코퍼스
+# =====================
+PEOPLE = [
+    ("Alex Martin", "alex.martin@iter.org"), ("Jiwoo Park", "jiwoo.park@iter.org"),
+    ("Elena Rossi", "elena.rossi@f4e.europa.eu"), ("Marc Dubois", "marc.dubois@iter.org"),
+    ("Sunhee Kim", "sunhee.kim@nfri.re.kr"), ("Tom Becker", "tom.becker@ansaldo.it"),
+    ("Priya Nair", "priya.nair@iter.org"), ("Kenji Sato", "kenji.sato@qst.go.jp"),
+    ("Laura Garcia", "laura.garcia@iter.org"), ("Daniel Cho", "daniel.cho@hhi.co.kr"),
+]
+COMPONENTS = ["sector 6", "sector 7", "lower port", "upper port", "equatorial port", "cryostat base",
+              "thermal shield", "in-wall shielding", "port stub extension", "gravity support"]
+TOPICS = [
+    {
+        "subject": "Transport schedule for the {c}",
+        "question": "When is the {c} going to be shipped to the site?",
+        "sentences": [
+            "The barge for the {c} is booked for the second week of the month.",
+            "Road convoy permits for the {c} are still pending with the prefecture.",
+            "We need the final lifting plan for the {c} before the shipment leaves the port.",
+            "The heavy haul route was surveyed and the bridge reinforcement is complete.",
+            "Customs clearance documents for the {c} delivery were submitted yesterday.",
+        ],
+    },
+    {
+        "subject": "Non-conformity report on {c} welds",
+        "question": "What weld defects were found on the {c}?",
+        "sentences": [
+            "Ultrasonic testing found lack of fusion in two welds of the {c}.",
+            "The repair procedure for the {c} weld defect needs approval from the ANB.",
+            "Phased array results show porosity above the acceptance limit.",
+            "The weld map of the {c} was updated with the rejected joints.",
+            "A root cause analysis points to contamination of the filler wire.",
+        ],
+    },
+    {
+        "subject": "ANB inspection visit for the {c}",
+        "question": "When does the notified body inspect the {c}?",
+        "sentences": [
+            "The ANB inspector will witness the pressure test of the {c}.",
+            "The inspection hold point for the {c} is scheduled after the final machining.",
+            "Please prepare the manufacturing dossier of the {c} for the notified body review.",
+            "The agenda of the inspection visit covers dimensional checks and material certificates.",
+            "The inspector asked for the calibration records of the leak test equipment.",
+        ],
+    },
+    {
+        "subject": "Dimensional survey of the {c}",
+        "question": "What did the laser tracker survey of the {c} show?",
+        "sentences": [
+            "The laser tracker survey of the {c} shows a deviation of 3 mm at the flange.",
+            "Metrology data for the {c} were uploaded to the document management system.",
+            "The flatness of the {c} interface is within tolerance after the second machining pass.",
+            "A reference network was installed around the {c} before the measurement campaign.",
+            "The as-built model must be compared against the nominal CAD geometry.",
+        ],
+    },
+    {
+        "subject": "Vacuum leak test of the {c}",
+        "question": "Did the {c} pass the helium leak test?",
+        "sentences": [
+            "The helium leak test of the {c} reached a background of 1e-10 mbar l/s.",
+            "A leak was localized at the bellows of the {c} during the sniffer test.",
+            "The bake-out of the {c} must be completed before the final leak test.",
+            "The test report of the {c} vacuum campaign is attached for review.",
+            "We will repeat the global leak test after the gasket replacement.",
+        ],
+    },
+    {
+        "subject": "Design change request for the {c}",
+        "question": "Why was a design change proposed for the {c}?",
+        "sentences": [
+            "The design change request for the {c} modifies the bolt pattern of the support.",
+            "The change control board will review the impact on the {c} interfaces.",
+            "Stress analysis of the modified {c} shows margins above the code limits.",
+            "The drawing revision of the {c} needs to be released before procurement.",
+            "The supplier estimated six weeks of delay due to the design change.",
+        ],
+    },
+]
+FILLER = [
+    "The action list from the weekly meeting is in the shared folder.",
+    "Please let me know if anything is unclear.",
+    "The minutes will be circulated after the review.",
+    "I have copied the procurement team for information.",
+    "The planning team will update the integrated schedule accordingly.",
+    "This item is also on the agenda of the next progress meeting.",
+    "The quality plan requires a formal record of this decision.",
+    "We should align with the site team before committing to a date.",
+]
+MONTH_NAMES = ["January", "February", "March", "April", "May", "June", "July", "August", "September",
+               "October", "November", "December"]
+
+
+def make_body(rng, topic, component, part=None, long_email=False):
+    sentences = [s.format(c=component) for s in rng.sample(topic["sentences"], rng.randint(2, 4))]
+    sentences += rng.sample(FILLER, rng.randint(1, 3))
+    if long_email:
+        sentences += [rng.choice(FILLER + [s.format(c=component) for s in topic["sentences"]])
+                      for _ in range(rng.randint(20, 40))]
+    rng.shuffle(sentences)
+    if part:
+        sentences.append(f"Please check item {part} against the latest revision before release.")
+    paragraphs = [" ".join(sentences[i:i + 4]) for i in range(0, len(sentences), 4)]
+    return "\n\n".join(paragraphs)
+
+
+def synthetic_corpus(num_threads, seed=0):
+    """→ (메시지 리스트, 라벨 질의 리스트). 메시지는 {"message_id", "subject", "from", "to", "date", "body", ...}"""
+    rng = random.Random(seed)
+    messages, queries = [], []
+    for t in range(num_threads):
+        topic = TOPICS[t % len(TOPICS)]
+        component = COMPONENTS[(t // len(TOPICS)) % len(COMPONENTS)]
+        subject = topic["subject"].format(c=component)
+        if t >= len(TOPICS) * len(COMPONENTS):
+            subject += f" (batch {t // (len(TOPICS) * len(COMPONENTS)) + 1})"
+        date = datetime(2021, 1, 1, 9, tzinfo=timezone.utc) + timedelta(days=rng.randint(0, 330),
+                                                                         minutes=rng.randint(0, 480))
+        participants = rng.sample(PEOPLE, 3)
+        thread, references = [], []
+        for n in range(rng.randint(1, 5)):
+            sender = participants[n % len(participants)]
+            part = f"VV-{t:03d}-{n}{rng.randint(10, 99)}" if rng.random() < 0.5 else None
+            message = {
+                "message_id": f"<bench-{t}-{n}@iter.org>",
+                "subject": subject if n == 0 else f"RE: {subject}",
+                "from": sender,
+                "to": [p for p in participants if p != sender],
+                "date": date,
+                "references": list(references),
+                "body": make_body(rng, topic, component, part, long_email=rng.random() < 0.15),
+                "part": part,
+            }
+            thread.append(message)
+            references.append(message["message_id"])
+            date += timedelta(days=rng.randint(0, 3), hours=rng.randint(1, 8))
+        messages.extend(thread)
+
+        # 같은 공지를 다른 폴더로 다시 보낸 사본 (근접 중복)
+        if rng.random() < 0.1:
+            original = thread[0]
+            messages.append(dict(original, message_id=f"<bench-{t}-fw@iter.org>", subject=f"FW: {subject}",
+                                 date=original["date"] + timedelta(days=1), references=[],
+                                 body="FYI, forwarding for the site team.\n\n" + original["body"], part=None))
+
+        thread_ids = [m["message_id"] for m in thread]
+        queries.append({"query": topic["question"].format(c=component), "expected": thread_ids, "type": "topic"})
+        queries.append({"query": f"Summarize the conversation about {subject.lower()}", "expected": thread_ids,
+                        "type": "thread"})
+        for message in thread:
+            if message["part"]:
+                queries.append({"query": f"Which email mentions {message['part']}?",
+                                "expected": [message["message_id"]], "type": "keyword"})
+
+    # 발신자 + 날짜 질의 (같은 날 같은 사람이 보낸 메일은 모두 정답)
+    by_sender_day = {}
+    for message in messages:
+        by_sender_day.setdefault((message["from"], message["date"].date()), []).append(message["message_id"])
+    for (sender, day), ids in sorted(by_sender_day.items(), key=lambda item: item[1][0]):
+        if rng.random() < 0.3:
+            queries.append({"query": f"What did {sender[0]} send on {MONTH_NAMES[day.month - 1]} {day.day}, {day.year}?",
+                            "expected": ids, "type": "filter"})
+    return messages, queries
+
+
+def write_mboxes(messages, mbox_dir):
+    """mbox_converter.py가 읽는 '2021 MM.mbox' 파일로 기록"""
+    os.makedirs(mbox_dir, exist_ok=True)
+    boxes = {}
+    for message in sorted(messages, key=lambda m: m["date"]):
+        msg = EmailMessage()
+        msg["Message-ID"] = message["message_id"]
+        msg["Date"] = format_datetime(message["date"])
+        msg["From"] = f"{message['from'][0]} <{message['from'][1]}>"
+        msg["To"] = ", ".join(f"{name} <{address}>" for name, address in message["to"])
+        msg["Subject"] = message["subject"]
+        if message["references"]:
+            msg["References"] = " ".join(message["references"])
+            msg["In-Reply-To"] = message["references"][-1]
+        msg.set_content(f"{message['body']}\n\nBest regards,\n{message['from'][0]}\n")
+        name = f"2021 {message['date'].month:02d}.mbox"
+        if name not in boxes:
+            boxes[name] = mailbox.mbox(os.path.join(mbox_dir, name))
+        boxes[name].add(msg)
+    for box in boxes.values():
+        box.flush()
+        box.close()
+
+
+# =====================
+# 인덱스 빌드
+# =====================
+def configure_paths(workdir, mbox_dir, embedding_model):
+    """각 단계 모듈의 경로 설정을 작업 디렉터리로 돌림"""
+    data = os.path.join(workdir, "data")
+    paths = {
+        "raw": os.path.join(data, "outlook_raw.store"),
+        "clean": os.path.join(data, "outlook_clean.store"),
+        "dedup": os.path.join(data, "outlook_dedup.store"),
+        "chunks": os.path.join(data, "outlook_chunk_emailwise.store"),
+        "thread_index": os.path.join(data, "thread_index.json"),
+        "duplicates": os.path.join(data, "near_duplicates.json"),
+        "known_senders": os.path.join(data, "known_senders.json"),
+        "chroma": os.path.join(data, "vectorstore", "chroma_outlook"),
+        "bm25": os.path.join(data, "bm25_index"),
+        "checkpoints": os.path.join(data, "checkpoints"),
+    }
+    mbox_converter.mbox_dir, mbox_converter.output_path = mbox_dir, paths["raw"]
+    mbox_converter.attachment_extractor.ATTACHMENT_CACHE_DIR = os.path.join(data, "attachment_cache")
+    checkpoint.CHECKPOINT_DIR = paths["checkpoints"]
+    data_cleaner.INPUT_FILE, data_cleaner.OUTPUT_FILE = paths["raw"], paths["clean"]
+    near_dedup.INPUT_FILE, near_dedup.OUTPUT_FILE = paths["clean"], paths["dedup"]
+    near_dedup.SIGNATURE_FILE = os.path.join(data, "near_dedup_signatures.bin")
+    near_dedup.DUPLICATES_PATH = paths["duplicates"]
+    thread_builder.INPUT_FILE, thread_builder.THREAD_INDEX_PATH = paths["clean"], paths["thread_index"]
+    chunk_emailwise.input_path = chunk_emailwise.Path(paths["dedup"])
+    chunk_emailwise.output_path = chunk_emailwise.Path(paths["chunks"])
+    build_chromaDB.CHUNK_STORE_PATH, build_chromaDB.CHROMA_DB_PATH = paths["chunks"], paths["chroma"]
+    build_chromaDB.KNOWN_SENDERS_PATH = paths["known_senders"]
+    build_chromaDB.BM25_INDEX_DIR = paths["bm25"]
+    build_chromaDB.EMBEDDING_CACHE_DIR = os.path.join(data, "embedding_cache")
+    build_chromaDB.EMBEDDING_MODEL = embedding_model
+    rag_resources.ANSWER_CACHE_DIR = os.path.join(data, "answer_cache")
+    rag_resources.INDEX_MANIFEST_PATH = os.path.join(paths["checkpoints"], "build_chromaDB.json")
+    return paths
+
+
+BUILD_STAGES = [
+    ("mbox_converter", mbox_converter.convert_mboxes),
+    ("data_cleaner", data_cleaner.clean_file),
+    ("near_dedup", near_dedup.dedup_file),
+    ("thread_builder", thread_builder.build_thread_index),
+    ("chunk_emailwise", chunk_emailwise.chunk_file),
+    ("build_chromaDB", build_chromaDB.build_chroma_db),
+]
+
+
+def file_size(path):
+    if os.path.isdir(path):
+        return build_chromaDB.directory_size(path)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def build_index(paths):
+    seconds = {}
+    for name, run in BUILD_STAGES:
+        print(f"\n=== {name} ===")
+        started = time.perf_counter()
+        run()
+        seconds[name] = round(time.perf_counter() - started, 3)
+    manifests = {name: checkpoint.load_manifest(name) or {} for name in ("near_dedup", "build_chromaDB")}
+    return {
+        "seconds": seconds,
+        "total_seconds": round(sum(seconds.values()), 3),
+        "chunks": manifests["build_chromaDB"].get("report", {}).get("chunks"),
+        "near_dedup": manifests["near_dedup"].get("report"),
+        "sizes_bytes": {name: file_size(paths[name]) for name in ("raw", "clean", "dedup", "chunks", "chroma", "bm25")},
+    }
+
+
+# =====================
+# 검색 실행
+# =====================
+STUB_QUESTION = re.compile(r"Question: (.*?)\n\nReturn JSON only", re.DOTALL)
+STUB_ANSWER = "Stub answer for the offline benchmark."
+
+
+def stub_llm(prompt_value):
+    """결정적 LLM 스텁: 필터 추출 프롬프트에는 규칙 기반 추출 결과를 JSON으로, 그 외에는 고정 답변"""
+    text = prompt_value.to_string()
+    match = STUB_QUESTION.search(text)
+    if match:
+        filters, _ = parse_query_filters(match.group(1), SenderMatcher({}))
+        return AIMessage(content=json.dumps(filters))
+    return AIMessage(content=STUB_ANSWER)
+
+
+def load_bench_resources(paths, embedding_model, rerank_model=None):
+    embeddings = HuggingFaceEmbeddings(model_name=embedding_model,
+                                       model_kwargs={"device": rag_resources.pick_device()})
+    vectorstore = Chroma(persist_directory=paths["chroma"], collection_name=rag_resources.COLLECTION_NAME,
+                         embedding_function=embeddings)
+    resources = rag_resources.RagResources(
+        embeddings, vectorstore, RunnableLambda(stub_llm),
+        BM25Index.load(paths["bm25"]), ThreadIndex.load(paths["thread_index"]), RecordStore.load(paths["dedup"]),
+        rerank_model,
+    )
+    resources.filter_extractor = QueryFilterExtractor(resources.llm, load_known_senders(paths["known_senders"]))
+    return resources
+
+
+def embed(query, resources, trace):
+    with trace.stage("embed_query"):
+        return resources.embedding_model.embed_query(query)
+
+
+def run_hybrid(query, resources, trace):
+    return rag_pipeline.smart_retrieve(query, resources, trace, embed(query, resources, trace), rerank=False)
+
+
+def run_rerank(query, resources, trace):
+    return rag_pipeline.smart_retrieve(query, resources, trace, embed(query, resources, trace))
+
+
+def run_vector(query, resources, trace):
+    embedding = embed(query, resources, trace)
+    filters = rag_pipeline.extract_filters(query, resources, trace)
+    where = rag_pipeline.build_where_filter(filters, resources.filter_extractor.resolve_sender)
+    with trace.stage("vector_search"):
+        ranking = rag_pipeline.vector_search(resources, query, rag_pipeline.HYBRID_CANDIDATES, where, embedding)
+    with trace.stage("collapse_parents"):
+        return rag_pipeline.collapse_to_parents(resources, [doc for _, doc in ranking], rag_pipeline.SEARCH_K)
+
+
+def run_keyword(query, resources, trace):
+    filters = rag_pipeline.extract_filters(query, resources, trace)
+    where = rag_pipeline.build_where_filter(filters, resources.filter_extractor.resolve_sender)
+    with trace.stage("keyword_search"):
+        ranking = rag_pipeline.keyword_search(resources, query, filters, rag_pipeline.HYBRID_CANDIDATES, where)
+    with trace.stage("collapse_parents"):
+        return rag_pipeline.collapse_to_parents(resources, [doc for _, doc in ranking], rag_pipeline.SEARCH_K)
+
+
+PIPELINES = {"hybrid": run_hybrid, "vector": run_vector, "keyword": run_keyword, "rerank": run_rerank}
+
+
+def ranked_message_ids(docs):
+    ids = []
+    for doc in docs:
+        parent_id = doc.metadata.get("parent_id") or doc.id or ""
+        message_id = parent_id[len("email_"):] if parent_id.startswith("email_") else parent_id
+        if message_id not in ids:
+            ids.append(message_id)
+    return ids
+
+
+def score(ranked, expected):
+    """→ {"recall@k": 정답 중 상위 k개에 든 비율, "mrr": 첫 정답 순위의 역수}"""
+    scores = {f"recall@{k}": len(expected.intersection(ranked[:k])) / len(expected) for k in RECALL_AT}
+    first = next((rank for rank, message_id in enumerate(ranked, 1) if message_id in expected), None)
+    scores["mrr"] = 1.0 / first if first else 0.0
+    return scores
+
+
+def mean_scores(rows):
+    return {metric: round(float(np.mean([row[metric] for row in rows])), 4) for metric in QUALITY_METRICS} if rows else {}
+
+
+def percentiles(values):
+    p50, p95, p99 = np.percentile(np.asarray(values) * 1000, [50, 95, 99])
+    return {"p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2),
+            "mean": round(float(np.mean(values) * 1000), 2), "n": len(values)}
+
+
+def evaluate(resources, queries, canonical, pipeline, repeat):
+    run = PIPELINES[pipeline]
+    resources.filter_extractor.memo.clear()
+    run(queries[0]["query"], resources, RequestTrace("warmup"))
+    resources.filter_extractor.memo.clear()
+
+    rows, latencies = [], {}
+    for attempt in range(repeat):
+        for item in queries:
+            trace = RequestTrace(item["query"])
+            docs = run(item["query"], resources, trace)
+            latencies.setdefault("total", []).append(trace.elapsed())
+            for name, seconds in trace.timings.items():
+                latencies.setdefault(name, []).append(seconds)
+            if attempt == 0:
+                expected = {canonical.get(message_id, message_id) for message_id in item["expected"]}
+                rows.append(dict(score(ranked_message_ids(docs), expected), type=item.get("type", "query")))
+
+    by_type = {}
+    for row in rows:
+        by_type.setdefault(row["type"], []).append(row)
+    return {
+        "overall": mean_scores(rows),
+        "by_type": {name: dict(mean_scores(group), queries=len(group)) for name, group in sorted(by_type.items())},
+        "latency_ms": {name: percentiles(values) for name, values in latencies.items()},
+    }
+
+
+# =====================
+# 결과 비교
+# =====================
+def compare(results, baseline, tolerance):
+    """품질 지표가 tolerance 이상 떨어지면 회귀로 표시 (지연/빌드 시간은 참고용으로 변화만 출력) → 회귀 수"""
+    regressions = 0
+    print(f"\n=== baseline 대비 ({baseline.get('created', '?')}) ===")
+    for pipeline, current in results["retrieval"].items():
+        previous = baseline.get("retrieval", {}).get(pipeline)
+        if not previous:
+            continue
+        for metric in QUALITY_METRICS:
+            new, old = current["overall"].get(metric), previous["overall"].get(metric)
+            if new is None or old is None:
+                continue
+            regressed = new < old - tolerance
+            regressions += regressed
+            print(f"{pipeline:<8} {metric:<10} {old:.4f} → {new:.4f} ({new - old:+.4f}){'  ▼ 회귀' if regressed else ''}")
+        new = current["latency_ms"].get("total", {}).get("p95")
+        old = previous.get("latency_ms", {}).get("total", {}).get("p95")
+        if new is not None and old:
+            print(f"{pipeline:<8} {'p95 ms':<10} {old:.1f} → {new:.1f} ({(new - old) / old:+.0%})")
+    old_build = baseline.get("build", {}).get("total_seconds")
+    if old_build:
+        new_build = results["build"]["total_seconds"]
+        print(f"{'build':<8} {'seconds':<10} {old_build:.1f} → {new_build:.1f} ({(new_build - old_build) / old_build:+.0%})")
+    return regressions
+
+
+def print_results(results):
+    print("\n=== 검색 품질 / 지연 ===")
+    for pipeline, result in results["retrieval"].items():
+        overall, total = result["overall"], result["latency_ms"]["total"]
+        print(f"{pipeline:<8} " + " ".join(f"{m} {overall[m]:.3f}" for m in QUALITY_METRICS)
+              + f" | p50 {total['p50']:.0f}ms p95 {total['p95']:.0f}ms p99 {total['p99']:.0f}ms")
+        for name, scores in result["by_type"].items():
+            print(f"  {name:<8} ({scores['queries']}) " + " ".join(f"{m} {scores[m]:.3f}" for m in QUALITY_METRICS))
+    build = results["build"]
+    print(f"빌드 {build['total_seconds']:.1f}초 ({', '.join(f'{k} {v:.1f}s' for k, v in build['seconds'].items())}) · "
+          f"청크 {build['chunks']}개 · Chroma {build['sizes_bytes']['chroma'] / 1e6:.1f}MB · "
+          f"BM25 {build['sizes_bytes']['bm25'] / 1e6:.1f}MB")
+
+
+def load_queries(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--threads", type=int, default=200, help="합성 코퍼스의 스레드 수")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--mbox-dir", help="합성 코퍼스 대신 사용할 mbox 폴더 (--queries 필요)")
+    arg_parser.add_argument("--queries", help="라벨 질의 JSONL (기본: 합성 코퍼스와 함께 생성)")
+    arg_parser.add_argument("--workdir", help="작업 디렉터리 (기본: 임시 디렉터리, 실행 후 삭제)")
+    arg_parser.add_argument("--embedding-model", default=rag_resources.EMBEDDING_MODEL)
+    arg_parser.add_argument("--pipelines", nargs="+", default=["hybrid", "vector", "keyword"], choices=list(PIPELINES))
+    arg_parser.add_argument("--rerank-model", default=rag_resources.RERANK_MODEL, help="rerank 파이프라인의 cross-encoder")
+    arg_parser.add_argument("--repeat", type=int, default=1, help="지연 측정용 반복 횟수 (품질은 첫 회만)")
+    arg_parser.add_argument("--output", default="bench_retrieval.json")
+    arg_parser.add_argument("--baseline", help="비교할 이전 결과 JSON")
+    arg_parser.add_argument("--tolerance", type=float, default=0.01, help="품질 지표 회귀 판정 허용치")
+    args = arg_parser.parse_args()
+    if args.mbox_dir and not args.queries:
+        arg_parser.error("--mbox-dir를 쓰면 --queries로 라벨 질의를 지정해야 합니다.")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        mbox_dir = args.mbox_dir or os.path.join(workdir, "mbox")
+        queries = load_queries(args.queries) if args.queries else None
+        if not args.mbox_dir:
+            messages, generated = synthetic_corpus(args.threads, args.seed)
+            write_mboxes(messages, mbox_dir)
+            queries = queries or generated
+            print(f"합성 코퍼스: 스레드 {args.threads}개, 메일 {len(messages)}개, 질의 {len(queries)}개")
+
+        paths = configure_paths(workdir, mbox_dir, args.embedding_model)
+        build = build_index(paths)
+        duplicates = near_dedup.load_duplicates(paths["duplicates"])
+        canonical = {dup: original for original, dups in duplicates.items() for dup in dups}
+
+        rerank_model = None
+        if "rerank" in args.pipelines:
+            rerank_model = rag_resources.load_rerank_model(args.rerank_model)
+            if rerank_model is None:
+                arg_parser.error(f"재정렬 모델을 불러올 수 없습니다: {args.rerank_model}")
+        resources = load_bench_resources(paths, args.embedding_model, rerank_model)
+        try:
+            retrieval = {name: evaluate(resources, queries, canonical, name, args.repeat) for name in args.pipelines}
+        finally:
+            resources.close()
+
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "embedding_model": args.embedding_model,
+            "chunk_max_chars": chunk_emailwise.CHUNK_MAX_CHARS,
+            "chunk_overlap_chars": chunk_emailwise.CHUNK_OVERLAP_CHARS,
+            "near_dup_threshold": near_dedup.NEAR_DUP_THRESHOLD,
+            "search_k": rag_pipeline.SEARCH_K,
+            "hybrid_candidates": rag_pipeline.HYBRID_CANDIDATES,
+            "rrf_k": rag_pipeline.RRF_K,
+            "rerank_model": args.rerank_model if "rerank" in args.pipelines else None,
+            "rerank_candidates": rag_pipeline.RERANK_CANDIDATES,
+            "rerank_k": rag_pipeline.RERANK_K,
+            "rerank_budget": rag_resources.RERANK_BUDGET,
+            "corpus": args.mbox_dir or f"synthetic(threads={args.threads}, seed={args.seed})",
+            "queries": len(queries),
+            "repeat": args.repeat,
+        },
+        "build": build,
+        "retrieval": retrieval,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print_results(results)
+    print(f"\n결과 저장: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""단계별 체크포인트(manifest) 관리 - 증분 처리 및 중단 지점 재개용 공용 유틸리티"""
+import hashlib
+import json
+import os
+import sys
+import uuid
+
+# 단계 사이 데이터는 src/record_store.py의 열 기반 저장소 (인덱서/앱과 같은 모듈 사용)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from record_store import RecordStore, RecordStoreWriter, store_rows  # noqa: E402
+
+CHECKPOINT_DIR = "/home/eunjo/Desktop/Outlook_LLM_v3/data/checkpoints"
+
+# FULL_REBUILD=1 이면 기존 manifest를 무시하고 처음부터 다시 처리
+FULL_REBUILD = os.getenv("FULL_REBUILD", "0") == "1"
+CHECKPOINT_EVERY = 2000  # 레코드 N개마다 체크포인트 커밋
+
+
+def manifest_path(stage):
+    return os.path.join(CHECKPOINT_DIR, f"{stage}.json")
+
+
+def load_manifest(stage):
+    path = manifest_path(stage)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(stage, manifest):
+    """임시 파일에 쓴 뒤 os.replace로 교체 (중간에 죽어도 이전 manifest 유지)"""
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    path = manifest_path(stage)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class AppendLog:
+    """코퍼스와 함께 커지는 기록(처리한 해시, message_id 등)을 manifest 대신 담는 append-only JSONL
+
+    manifest에는 커밋된 바이트 길이(manifest["logs"][name])만 저장하고, 열 때 그 뒤(미커밋 부분)를 잘라낸다.
+    체크포인트마다 새로 추가된 항목만 쓰므로 manifest를 다시 쓰는 비용이 기록 크기와 무관하다.
+    """
+
+    def __init__(self, stage, name, manifest, full_rebuild=False):
+        self.name = name
+        self.path = os.path.join(CHECKPOINT_DIR, f"{stage}.{name}.jsonl")
+        length = 0 if full_rebuild else manifest.setdefault("logs", {}).get(name, 0)
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size < length:
+            raise ValueError(f"'{self.path}' 기록이 manifest보다 짧음 - FULL_REBUILD=1로 다시 만드세요")
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        self.file = open(self.path, 'ab')
+        self.file.truncate(length)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.file.close()
+        return False
+
+    def entries(self):
+        """커밋된 항목 (append 전에 읽음)"""
+        self.file.flush()
+        with open(self.path, 'rb') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def append(self, entry):
+        self.file.write(json.dumps(entry, ensure_ascii=False).encode("utf-8") + b"\n")
+
+    def commit(self, manifest):
+        """기록을 디스크에 확정하고 길이를 manifest에 적음 (save_manifest 전에 호출)"""
+        manifest.setdefault("logs", {})[self.name] = commit_output(self.file)
+
+
+def content_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def new_generation():
+    return uuid.uuid4().hex
+
+
+def open_store_output(path, schema, rows, full_rebuild, key=None):
+    """열 기반 저장소를 마지막 커밋 행(rows)까지 잘라내고 이어 쓰기 (커밋은 writer.commit() → 행 수)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return RecordStoreWriter(path, schema, rows, full_rebuild, key)
+
+
+def commit_output(f):
+    """출력을 디스크에 확정하고 현재 바이트 크기를 반환"""
+    f.flush()
+    os.fsync(f.fileno())
+    return os.fstat(f.fileno()).st_size
+
+
+def input_length(path):
+    """입력의 커밋된 길이 (열 기반 저장소는 행 수, 파일은 바이트 크기)"""
+    if os.path.isdir(path):
+        return store_rows(path)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def resume_state(stage, upstream_stage, input_path, params=None):
+    """이전 manifest와 상위 단계 generation을 비교해 (manifest, full_rebuild) 결정
+
+    input_offset은 입력이 열 기반 저장소면 행 번호, JSONL이면 바이트 offset.
+    상위 단계가 전체 재생성되었거나, 입력이 manifest보다 짧아졌거나,
+    출력 형식을 결정하는 설정(params)이 바뀌었으면 처음부터 다시 처리한다.
+    """
+    upstream = load_manifest(upstream_stage) if upstream_stage else None
+    upstream_generation = upstream.get("generation") if upstream else None
+    manifest = None if FULL_REBUILD else load_manifest(stage)
+    input_size = input_length(input_path)
+
+    if (manifest is None
+            or manifest.get("upstream_generation") != upstream_generation
+            or manifest.get("input_offset", 0) > input_size
+            or manifest.get("params") != params):
+        return {
+            "generation": new_generation(),
+            "upstream_generation": upstream_generation,
+            "params": params,
+            "input_offset": 0,
+            "output_offset": 0,
+        }, True
+    return manifest, False
+
+
+def iter_records_from(path, row):
+    """열 기반 저장소를 row행부터 읽어 (다음 행 번호, 레코드) 반환 (커밋된 행까지만)"""
+    store = RecordStore.load(path)
+    if store is not None:
+        yield from store.iter_records(row)
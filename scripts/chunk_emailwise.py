@@ -1,41 +1,143 @@
-import json
+import os
+import re
 from pathlib import Path
 from tqdm import tqdm
+from checkpoint import CHECKPOINT_EVERY, iter_records_from, open_store_output, resume_state, save_manifest
+from record_store import CHUNK_SCHEMA
+from thread_builder import load_message_roots
 
-input_path = Path("/home/eunjo/Desktop/Outlook_LLM_v3/data/outlook_clean.jsonl")
-output_path = Path("/home/eunjo/Desktop/Outlook_LLM_v3/data/outlook_chunk_emailwise.jsonl")
-
-def load_jsonl(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return [json.loads(line) for line in f]
-
-def save_jsonl(path, data):
-    with open(path, "w", encoding="utf-8") as f:
-        for item in data:
-            f.write(json.dumps(item, ensure_ascii=False) + "\n")
-
-def chunk_emailwise(emails):
-    chunks = []
-    for email in tqdm(emails, desc="Chunking emails"):
-        chunk = {
-            "content": f"{email.get('subject', '')}\n\n{email.get('body', '')}",
-            "metadata": {
-                "from": email["from_list"],
-                "to": email["to_list"],
-                "date": email["date_iso"],
-                "message_id": email["message_id"],
-                "in_reply_to": email.get("in_reply_to"),
-                "references": email.get("references"),
-                "thread_id": email.get("thread_id"),
-                "attachments": email.get("attachments"),
-                "name_email_map": email.get("name_email_map"),
-            }
+# 열 기반 저장소 (src/record_store.py)
+input_path = Path("/home/eunjo/Desktop/Outlook_LLM_v3/data/outlook_dedup.store")
+output_path = Path("/home/eunjo/Desktop/Outlook_LLM_v3/data/outlook_chunk_emailwise.store")
+STAGE = "chunk_emailwise"
+UPSTREAM_STAGE = "near_dedup"
+
+# 긴 본문은 문장 경계에서 겹치는 윈도우로 분할 (0이면 예전처럼 이메일당 청크 1개)
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", "2000"))
+CHUNK_OVERLAP_CHARS = 300  # 이전 윈도우 끝에서 다음 윈도우로 이어지는 문장 분량
+
+SENTENCE_END = re.compile(r"(?<=[.!?。])\s+|\n+")
+
+
+def split_sentences(body):
+    """문장(또는 줄) 단위 구간 [(start, end)] - 원문 위치를 유지해 윈도우 offset을 기록"""
+    spans, start = [], 0
+    for match in SENTENCE_END.finditer(body):
+        if match.start() > start:
+            spans.append((start, match.start()))
+        start = match.end()
+    if start < len(body):
+        spans.append((start, len(body)))
+    return spans
+
+
+def split_windows(body, max_chars=CHUNK_MAX_CHARS, overlap_chars=CHUNK_OVERLAP_CHARS):
+    """본문 → 문장 경계를 지키며 겹치는 윈도우 [(start, end)] (한 문장이 max_chars보다 길면 강제로 자름)"""
+    if max_chars <= 0 or len(body) <= max_chars:
+        return [(0, len(body))]
+
+    spans = []
+    for start, end in split_sentences(body):
+        while end - start > max_chars:
+            spans.append((start, start + max_chars))
+            start += max_chars
+        spans.append((start, end))
+
+    windows, first = [], 0
+    while first < len(spans):
+        last = first
+        while last + 1 < len(spans) and spans[last + 1][1] - spans[first][0] <= max_chars:
+            last += 1
+        windows.append((spans[first][0], spans[last][1]))
+        if last == len(spans) - 1:
+            break
+        # 끝에서부터 overlap_chars 이내에 들어가는 문장들을 다음 윈도우에 다시 포함 (항상 한 문장 이상 전진)
+        next_first = last + 1
+        while next_first - 1 > first and spans[last][1] - spans[next_first - 1][0] <= overlap_chars:
+            next_first -= 1
+        first = next_first
+    return windows
+
+
+def chunk_email(email, message_roots=None):
+    """이메일 → 청크 리스트 (본문 윈도우 청크 + 첨부파일 자식 청크, 모두 부모 message_id와 위치를 메타데이터로 가짐)
+
+    본문 윈도우는 subject + 본문 구간으로 chunk_index 0..chunk_count-1, 첨부파일 텍스트의 윈도우는 그 뒤 번호를 쓰고
+    metadata.attachment에 파일명을 둔다. 첨부파일 청크는 "📎 파일명" + 텍스트 구간만 담아, 같은 파일이 전달된
+    여러 메일에서 내용이 같으므로 임베딩 캐시를 공유한다.
+
+    message_roots: thread_builder.py의 message_id → 루트 ID (있으면 thread_id로 사용)
+    """
+    subject = email.get('subject', '')
+    body = email.get('body', '')
+    windows = split_windows(body)
+    base_metadata = {
+        "from": email["from_list"],
+        "to": email["to_list"],
+        "date": email["date_iso"],
+        "message_id": email["message_id"],
+        "content_hash": email.get("content_hash"),
+        "in_reply_to": email.get("in_reply_to"),
+        "references": email.get("references"),
+        "thread_id": (message_roots or {}).get(email["message_id"]) or email.get("thread_id"),
+        "attachments": email.get("attachments"),
+        "name_email_map": email.get("name_email_map"),
+        "subject": subject,
+        "parent_id": email["message_id"],
+        "chunk_count": len(windows),
+    }
+    chunks = [
+        {
+            "content": f"{subject}\n\n{body[start:end]}",
+            "metadata": dict(base_metadata, chunk_index=i, body_start=start, attachment=None),
         }
-        chunks.append(chunk)
+        for i, (start, end) in enumerate(windows)
+    ]
+    for attachment in email.get("attachment_texts") or []:
+        text = attachment.get("text")
+        if not text:
+            continue
+        for start, end in split_windows(text):
+            chunks.append({
+                "content": f"📎 {attachment['filename']}\n{text[start:end]}",
+                "metadata": dict(base_metadata, chunk_index=len(chunks), body_start=start,
+                                 attachment=attachment["filename"]),
+            })
     return chunks
 
+def chunk_file():
+    """input_path 중 이전 체크포인트 이후에 추가된 이메일만 청크로 만들어 output_path에 이어 씀"""
+    params = {"chunk_max_chars": CHUNK_MAX_CHARS, "chunk_overlap_chars": CHUNK_OVERLAP_CHARS}
+    manifest, full_rebuild = resume_state(STAGE, UPSTREAM_STAGE, str(input_path), params)
+    count = emails = 0
+    message_roots = load_message_roots()
+    if not message_roots:
+        print("[WARN] 스레드 인덱스 없음 - thread_builder.py를 먼저 실행하면 루트 스레드 ID를 사용합니다.")
+
+    with open_store_output(str(output_path), CHUNK_SCHEMA, manifest["output_offset"], full_rebuild) as out_store:
+        def checkpoint(input_offset):
+            manifest["input_offset"] = input_offset
+            manifest["output_offset"] = out_store.commit()
+            save_manifest(STAGE, manifest)
+
+        pending = 0
+        input_offset = manifest["input_offset"]
+        for input_offset, email in tqdm(iter_records_from(str(input_path), input_offset), desc="Chunking emails"):
+            # 한 이메일의 윈도우는 연속으로 기록 (인덱서가 부모 단위로 교체할 수 있도록)
+            for chunk in chunk_email(email, message_roots):
+                out_store.append(chunk)
+                count += 1
+            emails += 1
+
+            pending += 1
+            if pending >= CHECKPOINT_EVERY:
+                checkpoint(input_offset)
+                pending = 0
+        checkpoint(input_offset)
+
+    print(f"{emails}개 이메일 → {count}개 청크가 '{output_path}'로 저장되었습니다. "
+          f"(이메일당 평균 {count / emails if emails else 0:.2f}개, CHUNK_MAX_CHARS={CHUNK_MAX_CHARS})")
+
 # 실행
-emails = load_jsonl(input_path)
-chunks = chunk_emailwise(emails)
-save_jsonl(output_path, chunks)
-print(f"{len(chunks)}개 청크가 '{output_path}'로 저장되었습니다.")
\ No newline at end of file
+if __name__ == "__main__":
+    chunk_file()
@@ -1,32 +1,52 @@
-import json
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from bs4 import BeautifulSoup
 from dateutil import parser
 from dateutil.tz import tzutc
 from tqdm import tqdm
+from checkpoint import CHECKPOINT_EVERY, AppendLog, new_generation, open_store_output, resume_state, save_manifest
+from parallel import ordered_map
+from record_store import EMAIL_SCHEMA, RecordStore, store_rows
 
-INPUT_FILE = "/home/eunjo/Desktop/Outlook_LLM_v3/data/outlook_raw.jsonl"
-OUTPUT_FILE = "/home/eunjo/Desktop/Outlook_LLM_v3/data/outlook_clean.jsonl"
+INPUT_FILE = "/home/eunjo/Desktop/Outlook_LLM_v3/data/outlook_raw.store"  # 열 기반 저장소 (src/record_store.py)
+OUTPUT_FILE = "/home/eunjo/Desktop/Outlook_LLM_v3/data/outlook_clean.store"
+STAGE = "data_cleaner"
+UPSTREAM_STAGE = "mbox_converter"
 
-seen_message_ids = set()
+NUM_WORKERS = os.cpu_count() or 1   # 정제 프로세스 수
+BATCH_ROWS = 256                    # 워커 한 작업당 레코드 수
+MAX_INFLIGHT = NUM_WORKERS * 2      # 동시에 대기하는 작업 수 (메모리 상한)
 
+# 대소문자 무시 (아래 CUT_PATTERN 하나로 합쳐 컴파일)
 SIGNATURE_PATTERNS = [
-    r"(?i)(--\s*|\nThanks[^\n]*|Best regards[^\n]*|Sent from [^\n]*|Regards[^\n]*)"
+    r"--\s*|\nThanks[^\n]*|Best regards[^\n]*|Sent from [^\n]*|Regards[^\n]*"
 ]
-HISTORY_PATTERNS = [
-    r"(?i)^[-\s]*Original Message[-\s]*$",
-    r"(?i)^From: .+",
-    r"(?i)^Sent: .+",
-    r"(?i)^To: .+",
-    r"(?i)^Subject: .+",
-    r"(?i)^On .+ wrote:",
-    r"(?i)^> .+",
+HISTORY_PATTERNS = [  # 줄 시작에서만 검사
+    r"[-\s]*Original Message[-\s]*$",
+    r"From: .+",
+    r"Sent: .+",
+    r"To: .+",
+    r"Subject: .+",
+    r"On .+ wrote:",
+    r"> .+",
 ]
+# 이전 메일 인용/서명이 처음 나오는 위치에서 본문을 자름 (패턴별로 전체를 훑지 않고 한 번의 search)
+CUT_PATTERN = re.compile(
+    "^(?:" + "|".join(HISTORY_PATTERNS) + ")|" + "|".join(SIGNATURE_PATTERNS), re.IGNORECASE | re.MULTILINE
+)
+# 태그나 엔티티가 있을 때만 HTML 파서 실행 (태그 이름 뒤가 공백//이나 >인 경우만 태그로 보므로 <kim@example.com>은 제외)
+HTML_HINT = re.compile(
+    r"<\s*/?\s*[a-zA-Z][\w:-]*(?:\s[^<>]*)?/?>"
+    r"|<!doctype|&(?:#\d+|#x[0-9a-f]+|[a-z]+);",
+    re.IGNORECASE,
+)
+WHITESPACE = re.compile(r"\s+")
 
 def clean_whitespace(text):
     if not isinstance(text, str):
         return text
-    return re.sub(r'\s+', ' ', text).strip()
+    return WHITESPACE.sub(' ', text).strip()
 
 def clean_list(lst):
     if not isinstance(lst, list):
@@ -45,17 +65,12 @@ def clean_dict(dct):
 def clean_body(text):
     if not text:
         return ""
-    soup = BeautifulSoup(text, "html.parser")
-    text = soup.get_text()
+    if HTML_HINT.search(text):
+        text = BeautifulSoup(text, "html.parser").get_text()
 
-    for pattern in HISTORY_PATTERNS:
-        matches = list(re.finditer(pattern, text, flags=re.MULTILINE))
-        if matches:
-            text = text[:matches[0].start()]
-            break
-
-    for pattern in SIGNATURE_PATTERNS:
-        text = re.split(pattern, text)[0]
+    match = CUT_PATTERN.search(text)
+    if match:
+        text = text[:match.start()]
 
     return clean_whitespace(text)
 
@@ -66,39 +81,123 @@ def normalize_date(iso_date_str):
     except Exception:
         return iso_date_str
 
-with open(INPUT_FILE, 'r', encoding='utf-8') as infile, open(OUTPUT_FILE, 'w', encoding='utf-8') as outfile:
-    for line in tqdm(infile, desc="Preprocessing emails"):
+def is_skipped(email):
+    return "[SOCIAL NETWORK]" in email.get("subject", "")
+
+def is_seen(email, seen_message_ids):
+    """seen_message_ids: message_id → content_hash. 상위 단계가 같은 message_id를 다른 내용으로
+    다시 내보낸 경우(원본 메일 변경)에만 통과시킨다. (통과하면 기록)
+    """
+    msg_id = email.get("message_id")
+    digest = email.get("content_hash")
+    if msg_id in seen_message_ids and seen_message_ids[msg_id] == digest:
+        return True
+    seen_message_ids[msg_id] = digest
+    return False
+
+def clean_email(email, seen_message_ids):
+    """이메일 레코드 하나를 정제 (건너뛸 레코드면 None 반환)"""
+    if is_skipped(email) or is_seen(email, seen_message_ids):
+        return None
+    return clean_record(email)
+
+def clean_record(email):
+    """중복 확인 없이 필드만 정제 (워커 프로세스에서 실행)"""
+    # body
+    email["body"] = clean_body(email.get("body", ""))
+
+    # subject, from, to, cc, bcc, attachments, etc.
+    for field in ["subject", "from", "to", "cc", "bcc", "attachments"]:
+        if isinstance(email.get(field), list):
+            email[field] = clean_list(email.get(field))
+        elif isinstance(email.get(field), str):
+            email[field] = clean_whitespace(email.get(field))
+
+    # name_email_map 딕셔너리 정제
+    if "name_email_map" in email:
+        email["name_email_map"] = clean_dict(email["name_email_map"])
+
+    # 날짜
+    email["date_iso"] = normalize_date(email.get("date_iso", ""))
+    email.pop("date_display", None)
+    email.pop("date_display_kst", None)
+    return email
+
+_stores = {}  # 워커 프로세스마다 입력 저장소를 한 번만 엶 (memmap이라 레코드는 필요한 행만 읽음)
+
+def clean_batch(task):
+    """워커 프로세스: (입력 저장소, 시작 행, 끝 행) → [(다음 행, message_id, content_hash, 정제된 레코드 또는 None, 오류)]
+
+    메인 프로세스는 행 범위만 넘기고, 워커가 저장소에서 직접 레코드를 읽는다 (줄 복사/JSON 파싱 없음).
+    """
+    input_path, start, stop = task
+    store = _stores.get(input_path)
+    if store is None or len(store) < stop:
+        store = _stores[input_path] = RecordStore(input_path)
+    results = []
+    for row in range(start, stop):
         try:
-            email = json.loads(line)
-
-            if "[SOCIAL NETWORK]" in email.get("subject", ""):
+            email = store.record(row)
+            if is_skipped(email):
+                results.append((row + 1, None, None, None, None))
                 continue
-
-            msg_id = email.get("message_id")
-            if msg_id in seen_message_ids:
-                continue
-            seen_message_ids.add(msg_id)
-
-            # body
-            email["body"] = clean_body(email.get("body", ""))
-
-            # subject, from, to, cc, bcc, attachments, etc.
-            for field in ["subject", "from", "to", "cc", "bcc", "attachments"]:
-                if isinstance(email.get(field), list):
-                    email[field] = clean_list(email.get(field))
-                elif isinstance(email.get(field), str):
-                    email[field] = clean_whitespace(email.get(field))
-
-            # name_email_map 딕셔너리 정제
-            if "name_email_map" in email:
-                email["name_email_map"] = clean_dict(email["name_email_map"])
-
-            # 날짜
-            email["date_iso"] = normalize_date(email.get("date_iso", ""))
-            email.pop("date_display", None)
-            email.pop("date_display_kst", None)
-
-            outfile.write(json.dumps(email, ensure_ascii=False) + "\n")
-
+            msg_id, digest = email.get("message_id"), email.get("content_hash")
+            results.append((row + 1, msg_id, digest, clean_record(email), None))
         except Exception as e:
-            print(f"[ERROR] 처리 실패: {e}")
\ No newline at end of file
+            results.append((row + 1, None, None, None, str(e)))
+    return results
+
+def iter_cleaned(executor, input_path, input_offset, seen_message_ids):
+    """input_path 저장소를 input_offset행부터 병렬 정제해 입력 순서대로 (다음 행, 정제된 레코드 또는 None) 반환
+
+    정제는 워커에서, 중복 확인(seen_message_ids)은 순서가 보장되는 메인 프로세스에서 한다.
+    """
+    total = store_rows(input_path)
+    tasks = ((input_path, start, min(start + BATCH_ROWS, total)) for start in range(input_offset, total, BATCH_ROWS))
+    for results in ordered_map(executor, clean_batch, tasks, MAX_INFLIGHT):
+        for row, msg_id, digest, email, error in results:
+            if error is not None:
+                print(f"[ERROR] 처리 실패: {error}")
+            elif email is not None and is_seen({"message_id": msg_id, "content_hash": digest}, seen_message_ids):
+                email = None
+            yield row, email
+
+def clean_file():
+    """INPUT_FILE 중 이전 체크포인트 이후에 추가된 행만 정제해 OUTPUT_FILE에 이어 씀"""
+    manifest, full_rebuild = resume_state(STAGE, UPSTREAM_STAGE, INPUT_FILE)
+    if "message_ids" in manifest:
+        # message_id를 manifest 안에 두던 예전 형식은 처음부터 다시 만듦
+        manifest = dict(manifest, generation=new_generation(), input_offset=0, output_offset=0)
+        del manifest["message_ids"]
+        full_rebuild = True
+
+    # 기록한 [message_id, 내용 해시]는 체크포인트마다 새 항목만 덧붙이는 기록 파일에 둠
+    with open_store_output(OUTPUT_FILE, EMAIL_SCHEMA, manifest["output_offset"], full_rebuild,
+                           key="message_id") as out_store, \
+            AppendLog(STAGE, "message_ids", manifest, full_rebuild) as message_id_log, \
+            ProcessPoolExecutor(max_workers=NUM_WORKERS) as executor:
+        seen_message_ids = dict(message_id_log.entries())
+
+        def checkpoint(input_offset):
+            manifest["input_offset"] = input_offset
+            manifest["output_offset"] = out_store.commit()
+            message_id_log.commit(manifest)
+            save_manifest(STAGE, manifest)
+
+        pending = 0
+        input_offset = manifest["input_offset"]
+        cleaned = iter_cleaned(executor, INPUT_FILE, input_offset, seen_message_ids)
+        for input_offset, email in tqdm(cleaned, desc="Preprocessing emails"):
+            if email is not None:
+                out_store.append(email)
+                message_id_log.append([email.get("message_id"), email.get("content_hash")])
+
+            pending += 1
+            if pending >= CHECKPOINT_EVERY:
+                checkpoint(input_offset)
+                pending = 0
+        checkpoint(input_offset)
+
+
+if __name__ == "__main__":
+    clean_file()
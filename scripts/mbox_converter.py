@@ -1,15 +1,29 @@
 import os
+import mmap
 import mailbox
-import json
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from email.header import decode_header, make_header
 from bs4 import BeautifulSoup
 from dateutil import parser
 import re
+from checkpoint import (
+    CHECKPOINT_EVERY, FULL_REBUILD, AppendLog, content_hash, load_manifest, new_generation, open_store_output,
+    save_manifest,
+)
+from record_store import EMAIL_SCHEMA
+from parallel import ordered_map
+import attachment_extractor
 
 # === 설정 ===
 mbox_dir = "/home/eunjo/Desktop/Outlook_LLM_v3"
-output_path = os.path.join(mbox_dir, "data", "outlook_raw.jsonl")
-os.makedirs(os.path.dirname(output_path), exist_ok=True)
+output_path = os.path.join(mbox_dir, "data", "outlook_raw.store")  # 열 기반 저장소 (src/record_store.py)
+
+NUM_WORKERS = os.cpu_count() or 1       # 파싱 프로세스 수
+BATCH_BYTES = 8 * 1024 * 1024           # 워커 한 작업당 최대 바이트
+BATCH_MESSAGES = 256                    # 워커 한 작업당 최대 메시지 수
+MAX_INFLIGHT = NUM_WORKERS * 2          # 동시에 대기하는 작업 수 (메모리 상한)
+STAGE = "mbox_converter"                # 체크포인트 manifest 이름
 
 # === 유틸리티 함수 ===
 def decode_mime_words(s):
@@ -76,82 +90,255 @@ def get_body_from_msg(msg):
 
     return plain_text or html_text or rtf_content or ""
 
-def extract_attachment_filenames(msg):
-    filenames = []
+def iter_attachment_parts(msg):
+    """(디코딩된 파일명, MIME part) - Outlook이 본문으로 붙이는 rtf-body.rtf는 제외"""
     for part in msg.walk():
         content_disposition = str(part.get("Content-Disposition", ""))
         filename = part.get_filename()
         if "attachment" in content_disposition and filename:
             decoded_filename = decode_mime_words(filename)
             if decoded_filename.lower() != "rtf-body.rtf":
-                filenames.append(decoded_filename)
-    return filenames
+                yield decoded_filename, part
 
-# === 메시지 처리 ===
-message_ids_seen = set()
+def extract_attachment_filenames(msg):
+    return [filename for filename, _ in iter_attachment_parts(msg)]
+
+def extract_attachment_texts(msg):
+    """첨부파일 본문 텍스트 (attachment_extractor.py, 같은 내용의 파일은 캐시에서 가져옴)"""
+    if not attachment_extractor.EXTRACT_ATTACHMENTS:
+        return []
+    texts = []
+    for filename, part in iter_attachment_parts(msg):
+        try:
+            data = part.get_payload(decode=True)
+        except Exception:
+            data = None
+        texts.append(attachment_extractor.extract_attachment(filename, part.get_content_type(), data))
+    return texts
+
+def build_record(msg):
+    """mbox 메시지 하나를 이메일 레코드(dict)로 변환"""
+    raw_date = msg.get("date", "")
+    try:
+        parsed_date = parser.parse(raw_date)
+        date_iso = parsed_date.isoformat()
+        date_ymd = parsed_date.strftime("%Y-%m-%d")
+    except:
+        date_iso = raw_date
+        date_ymd = ""
+
+    message_id = decode_mime_words(msg.get("Message-ID"))
+    subject = decode_mime_words(msg.get("subject"))
+    from_raw = msg.get("from", "")
+    to_raw = msg.get("to", "")
+    cc_raw = msg.get("cc", "")
+    in_reply_to = decode_mime_words(msg.get("In-Reply-To"))
+    references = decode_mime_words(msg.get("References"))
+
+    # 임시 스레드 ID: References의 첫 항목(대화의 최초 메일). 최종 루트는 thread_builder.py가 결정
+    thread_id = (re.findall(r"<[^<>\s]+>", references) or [in_reply_to or message_id])[0]
+
+    return {
+        "thread_id": thread_id,
+        "subject": subject,
+        "from": decode_mime_words(from_raw),
+        "to": decode_mime_words(to_raw),
+        "cc": decode_mime_words(cc_raw),
+        "from_list": parse_address_list(from_raw),
+        "to_list": parse_address_list(to_raw),
+        "cc_list": parse_address_list(cc_raw),
+        "date_raw": raw_date,
+        "date_iso": date_iso,
+        "date_ymd": date_ymd,
+        "message_id": message_id,
+        "in_reply_to": in_reply_to,
+        "references": references,
+        "body": get_body_from_msg(msg),
+        "attachments": extract_attachment_filenames(msg),
+        "attachment_texts": extract_attachment_texts(msg),
+        "name_email_map": extract_name_email_map(from_raw, to_raw, cc_raw)
+    }
+
+# === mbox 분할 (메모리 매핑) ===
+def iter_message_ranges(mbox_path, start_offset=0):
+    """mbox 파일을 메모리 매핑으로 스캔해 'From ' 구분선 기준 (start, stop, 내용 해시)를 순서대로 반환
+
+    start_offset은 이전 체크포인트의 메시지 경계여야 한다.
+    """
+    size = os.path.getsize(mbox_path)
+    if size <= start_offset:
+        return
+    with open(mbox_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+            memoryview(mm) as view:
+        if start_offset > 0 or mm[:5] == b"From ":
+            start = start_offset
+        else:
+            start = mm.find(b"\nFrom ")
+            if start == -1:
+                return
+            start += 1
+        while True:
+            nxt = mm.find(b"\nFrom ", start)
+            stop = size if nxt == -1 else nxt + 1
+            yield start, stop, content_hash(view[start:stop])
+            if nxt == -1:
+                return
+            start = stop
+
+def iter_batches(ranges):
+    """메시지 범위를 워커 작업 단위(바이트/개수 상한)로 묶음"""
+    batch, batch_bytes = [], 0
+    for start, stop, digest in ranges:
+        batch.append((start, stop, digest))
+        batch_bytes += stop - start
+        if batch_bytes >= BATCH_BYTES or len(batch) >= BATCH_MESSAGES:
+            yield batch
+            batch, batch_bytes = [], 0
+    if batch:
+        yield batch
+
+def message_from_range(f, start, stop):
+    """바이트 범위에서 mboxMessage 생성 (mailbox.mbox.get_message와 동일한 처리)"""
+    f.seek(start)
+    data = f.read(stop - start)
+    from_line, _, raw = data.partition(b"\n")
+    # 메시지 사이 구분용 빈 줄 제거
+    if raw.endswith(b"\n\n"):
+        raw = raw[:-1]
+    msg = mailbox.mboxMessage(raw)
+    msg.set_from(from_line[5:].decode('ascii', errors='replace').rstrip('\r'))
+    return msg
 
-with open(output_path, 'w', encoding='utf-8') as out_file:
+def parse_batch(task):
+    """워커 프로세스: 범위 묶음을 읽어 (stop, 해시, record, error) 리스트 반환"""
+    mbox_path, batch = task
+    results = []
+    with open(mbox_path, 'rb') as f:
+        for start, stop, digest in batch:
+            try:
+                record = build_record(message_from_range(f, start, stop))
+                record["content_hash"] = digest
+                results.append((stop, digest, record, None))
+            except Exception as e:
+                results.append((stop, digest, None, str(e)))
+    return results
+
+def iter_mbox_records(executor, mbox_path, start_offset=0, known_hashes=()):
+    """mbox 하나의 레코드를 파일 순서대로 스트리밍 (이미 처리한 해시의 메시지는 파싱하지 않음)"""
+    ranges = (r for r in iter_message_ranges(mbox_path, start_offset) if r[2] not in known_hashes)
+    tasks = ((mbox_path, batch) for batch in iter_batches(ranges))
+    for results in ordered_map(executor, parse_batch, tasks, MAX_INFLIGHT):
+        yield from results
+
+def mbox_paths():
     for month in range(1, 13):
         month_str = f"{month:02d}"
         mbox_filename = f"2021 {month_str}.mbox"
-        mbox_path = os.path.join(mbox_dir, mbox_filename)
+        yield mbox_filename, os.path.join(mbox_dir, mbox_filename)
 
-        if not os.path.exists(mbox_path):
-            print(f"{mbox_filename} 파일 없음, 건너뜀")
-            continue
+# === 메시지 처리 ===
+def load_converter_manifest():
+    """이전 실행의 manifest 로드 (없거나 FULL_REBUILD면 새 generation으로 시작)"""
+    manifest = None if FULL_REBUILD else load_manifest(STAGE)
+    params = attachment_extractor.params()
+    # 첨부파일 추출 설정이 바뀌면 모든 레코드가 달라지므로 처음부터 다시 만듦
+    # (해시/message_id를 manifest 안에 두던 예전 형식도 다시 만듦)
+    if (manifest is None or not os.path.exists(output_path) or manifest.get("params") != params
+            or "logs" not in manifest):
+        return {"generation": new_generation(), "output_offset": 0, "files": {}, "logs": {}, "params": params}, True
+    return manifest, False
 
-        print(f"처리 중: {mbox_filename}...")
-        try:
-            for msg in mailbox.mbox(mbox_path):
-                try:
-                    raw_date = msg.get("date", "")
-                    try:
-                        parsed_date = parser.parse(raw_date)
-                        date_iso = parsed_date.isoformat()
-                        date_ymd = parsed_date.strftime("%Y-%m-%d")
-                    except:
-                        date_iso = raw_date
-                        date_ymd = ""
-
-                    message_id = decode_mime_words(msg.get("Message-ID"))
-                    if message_id in message_ids_seen:
-                        continue
-                    message_ids_seen.add(message_id)
-
-                    subject = decode_mime_words(msg.get("subject"))
-                    from_raw = msg.get("from", "")
-                    to_raw = msg.get("to", "")
-                    cc_raw = msg.get("cc", "")
-                    in_reply_to = decode_mime_words(msg.get("In-Reply-To"))
-                    references = decode_mime_words(msg.get("References"))
-
-                    thread_id = in_reply_to or references or message_id
-
-                    record = {
-                        "thread_id": thread_id,
-                        "subject": subject,
-                        "from": decode_mime_words(from_raw),
-                        "to": decode_mime_words(to_raw),
-                        "cc": decode_mime_words(cc_raw),
-                        "from_list": parse_address_list(from_raw),
-                        "to_list": parse_address_list(to_raw),
-                        "cc_list": parse_address_list(cc_raw),
-                        "date_raw": raw_date,
-                        "date_iso": date_iso,
-                        "date_ymd": date_ymd,
-                        "message_id": message_id,
-                        "in_reply_to": in_reply_to,
-                        "references": references,
-                        "body": get_body_from_msg(msg),
-                        "attachments": extract_attachment_filenames(msg),
-                        "name_email_map": extract_name_email_map(from_raw, to_raw, cc_raw)
-                    }
-
-                    out_file.write(json.dumps(record, ensure_ascii=False) + '\n')
-
-                except Exception as e:
-                    print(f"메시지 처리 오류: {e}")
-        except Exception as e:
-            print(f"파일 처리 실패: {e}")
-
-print(f"\n모든 mbox 처리 완료! 저장 위치: {output_path}")
\ No newline at end of file
+def convert_mboxes():
+    manifest, full_rebuild = load_converter_manifest()
+    files = manifest["files"]
+    message_ids_this_run = set()
+    written = 0
+    attachment_status = Counter()
+
+    def checkpoint():
+        manifest["output_offset"] = out_store.commit()
+        hash_log.commit(manifest)
+        message_id_log.commit(manifest)
+        save_manifest(STAGE, manifest)
+
+    # 처리한 메시지 해시 [mbox 파일명, 내용 해시]와 기록한 message_id [message_id, mbox 파일명, 내용 해시]는
+    # 체크포인트마다 새 항목만 덧붙이는 기록 파일에 둠 (manifest에는 파일별 offset과 기록 길이만)
+    with open_store_output(output_path, EMAIL_SCHEMA, manifest["output_offset"], full_rebuild,
+                           key="message_id") as out_store, \
+            AppendLog(STAGE, "hashes", manifest, full_rebuild) as hash_log, \
+            AppendLog(STAGE, "message_ids", manifest, full_rebuild) as message_id_log, \
+            ProcessPoolExecutor(max_workers=NUM_WORKERS) as executor:
+        file_hashes = {}
+        for mbox_filename, digest in hash_log.entries():
+            file_hashes.setdefault(mbox_filename, set()).add(digest)
+        # message_id → [원본 mbox 파일명, 내용 해시] (뒤에 기록된 항목이 최신)
+        message_ids_seen = {message_id: [mbox_filename, digest]
+                            for message_id, mbox_filename, digest in message_id_log.entries()}
+        for mbox_filename, mbox_path in mbox_paths():
+            if not os.path.exists(mbox_path):
+                print(f"{mbox_filename} 파일 없음, 건너뜀")
+                continue
+
+            stat = os.stat(mbox_path)
+            entry = files.get(mbox_filename)
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                if entry["committed_offset"] >= stat.st_size:
+                    print(f"{mbox_filename} 변경 없음, 건너뜀")
+                    continue
+                # 같은 파일에서 중단된 경우 마지막 커밋 위치부터 재개
+                start_offset = entry["committed_offset"]
+                modified = entry.get("modified", False)
+            else:
+                start_offset = 0
+                modified = entry is not None
+            entry = files[mbox_filename] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "committed_offset": start_offset,
+                "modified": modified,
+            }
+            known_hashes = file_hashes.setdefault(mbox_filename, set())
+
+            print(f"처리 중: {mbox_filename} (offset {start_offset})...")
+            try:
+                pending = 0
+                for stop, digest, record, error in iter_mbox_records(executor, mbox_path, start_offset, known_hashes):
+                    hash_log.append([mbox_filename, digest])
+                    known_hashes.add(digest)
+                    entry["committed_offset"] = stop
+                    pending += 1
+
+                    if error is not None:
+                        print(f"메시지 처리 오류: {error}")
+                    else:
+                        # 중복 제거는 부모 프로세스에서 순서대로 수행
+                        # 이전 실행에서 같은 mbox에 있던 메시지의 내용이 바뀐 경우에만 다시 기록
+                        message_id = record["message_id"]
+                        seen = message_ids_seen.get(message_id)
+                        changed = modified and seen is not None and seen[0] == mbox_filename and seen[1] != digest
+                        if message_id not in message_ids_this_run and (seen is None or changed):
+                            message_ids_this_run.add(message_id)
+                            message_ids_seen[message_id] = [mbox_filename, digest]
+                            message_id_log.append([message_id, mbox_filename, digest])
+                            out_store.append(record)
+                            written += 1
+                            attachment_status.update(a["status"] for a in record["attachment_texts"])
+
+                    if pending >= CHECKPOINT_EVERY:
+                        checkpoint()
+                        pending = 0
+
+                entry["committed_offset"] = stat.st_size
+                entry["modified"] = False
+                checkpoint()
+            except Exception as e:
+                print(f"파일 처리 실패: {e}")
+
+    print(f"\n모든 mbox 처리 완료! 새로 기록된 메시지 {written}개, 저장 위치: {output_path}")
+    if attachment_status:
+        # cached: 같은 내용의 첨부파일을 이전에 추출한 결과를 재사용
+        print("첨부파일 텍스트 추출: " + ", ".join(f"{status} {n}개" for status, n in attachment_status.most_common()))
+
+
+if __name__ == "__main__":
+    convert_mboxes()
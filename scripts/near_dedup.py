@@ -0,0 +1,299 @@
+"""정제된 이메일의 근접 중복 제거 (MinHash + LSH)
+
+전달된 사본, 여러 폴더에 같은 공지, 같은 내용의 재전송 메일은 message_id가 달라 정확 일치로는 걸러지지 않는다.
+본문 단어 5-gram의 MinHash 서명을 LSH 밴드로 버킷에 넣어 후보만 비교하므로 전체 쌍 비교 없이 거의 선형으로 동작한다.
+
+  - 추정 Jaccard 유사도가 NEAR_DUP_THRESHOLD 이상인 메일은 먼저 나온 대표 메일(canonical)의 중복으로 묶고 출력하지 않음
+  - 대표 메일 → 중복 메일 목록은 data/near_duplicates.json에 저장
+  - 본문이 짧은 메일(MIN_SHINGLES 미만)은 "감사합니다" 같은 답장끼리 묶이지 않도록 비교하지 않음
+
+대표 메일의 서명은 증분 처리를 위해 data/near_dedup_signatures.bin에 이어 쓰고, 서명의 message_id와
+중복 묶음 변경은 checkpoints/near_dedup.events.jsonl에 체크포인트마다 새 항목만 덧붙인다.
+같은 message_id가 다른 내용으로 다시 들어오면 (원본 메일 변경) 이전 서명과 중복 관계를 지우고 다시 비교한다.
+"""
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+from tqdm import tqdm
+from checkpoint import (
+    CHECKPOINT_EVERY, AppendLog, commit_output, iter_records_from, open_store_output, resume_state, save_manifest,
+)
+from chunk_emailwise import split_windows
+from record_store import EMAIL_SCHEMA, RecordStore
+
+INPUT_FILE = "/home/eunjo/Desktop/Outlook_LLM_v3/data/outlook_clean.store"  # 열 기반 저장소 (src/record_store.py)
+OUTPUT_FILE = "/home/eunjo/Desktop/Outlook_LLM_v3/data/outlook_dedup.store"
+SIGNATURE_FILE = "/home/eunjo/Desktop/Outlook_LLM_v3/data/near_dedup_signatures.bin"
+DUPLICATES_PATH = "/home/eunjo/Desktop/Outlook_LLM_v3/data/near_duplicates.json"
+STAGE = "near_dedup"
+UPSTREAM_STAGE = "data_cleaner"
+
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.85"))  # 추정 Jaccard 유사도
+SHINGLE_WORDS = 5
+MIN_SHINGLES = 20
+NUM_PERM = 128
+LSH_BANDS = 16          # 16밴드 x 8행: 유사도 약 0.7부터 후보가 될 확률이 급격히 올라감
+LSH_ROWS = NUM_PERM // LSH_BANDS
+
+MERSENNE_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(1)
+PERM_A = _rng.randint(1, MERSENNE_PRIME, size=NUM_PERM).astype(np.uint64)
+PERM_B = _rng.randint(0, MERSENNE_PRIME, size=NUM_PERM).astype(np.uint64)
+
+WORD = re.compile(r"\w+")
+
+
+def shingle_hashes(text):
+    """본문 → 단어 5-gram의 32비트 해시 배열"""
+    words = WORD.findall(text.lower())
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+def minhash(hashes):
+    """(a*x + b) mod p 순열 NUM_PERM개의 최솟값 → uint32 서명"""
+    x = hashes % MERSENNE_PRIME
+    return ((PERM_A[:, None] * x[None, :] + PERM_B[:, None]) % MERSENNE_PRIME).min(axis=1).astype(np.uint32)
+
+
+class LSHIndex:
+    """서명을 밴드별 버킷에 넣고, 버킷을 공유하는 대표 메일 중 가장 비슷한 것을 찾음"""
+
+    def __init__(self):
+        self.buckets = [{} for _ in range(LSH_BANDS)]
+        self.signatures = []
+        self.message_ids = []  # 행 → message_id (지운 행은 None, 행 번호는 서명 파일과 맞춰 유지)
+        self.rows = {}  # message_id → 행
+
+    def band_keys(self, signature):
+        return [signature[b * LSH_ROWS:(b + 1) * LSH_ROWS].tobytes() for b in range(LSH_BANDS)]
+
+    def add(self, message_id, signature):
+        row = len(self.signatures)
+        self.signatures.append(signature)
+        self.message_ids.append(message_id)
+        self.rows[message_id] = row
+        for band, key in zip(self.buckets, self.band_keys(signature)):
+            band.setdefault(key, []).append(row)
+
+    def remove(self, message_id):
+        """내용이 바뀐 대표 메일의 이전 서명을 버킷에서 제거"""
+        row = self.rows.pop(message_id, None)
+        if row is None:
+            return
+        for band, key in zip(self.buckets, self.band_keys(self.signatures[row])):
+            band[key].remove(row)
+            if not band[key]:
+                del band[key]
+        self.message_ids[row] = None
+
+    def query(self, signature):
+        """→ (대표 message_id, 추정 유사도) 또는 (None, 0.0)"""
+        candidates = set()
+        for band, key in zip(self.buckets, self.band_keys(signature)):
+            candidates.update(band.get(key, ()))
+        best, best_similarity = None, 0.0
+        for row in candidates:
+            similarity = float(np.mean(self.signatures[row] == signature))
+            if similarity > best_similarity:
+                best, best_similarity = self.message_ids[row], similarity
+        return best, best_similarity
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class DuplicateGroups:
+    """대표 message_id → 중복 message_id 목록 (중복 → 대표 역참조로 변경된 메일을 바로 빼냄)"""
+
+    def __init__(self):
+        self.groups = {}
+        self.canonical_of = {}
+        self.released = []  # 대표 메일이 바뀌어 묶음에서 풀린 message_id (호출 측이 다시 비교)
+
+    def add(self, canonical, message_id):
+        """중복 추가 → 새 묶음이면 True"""
+        new_group = canonical not in self.groups
+        self.groups.setdefault(canonical, []).append(message_id)
+        self.canonical_of[message_id] = canonical
+        return new_group
+
+    def remove(self, message_id):
+        """내용이 바뀐 메일을 중복 목록에서 빼고, 대표 메일이었다면 묶음을 풀어 released에 넣음 → 사라진 묶음 수"""
+        removed = 0
+        canonical = self.canonical_of.pop(message_id, None)
+        if canonical is not None:
+            group = self.groups[canonical]
+            group.remove(message_id)
+            if not group:
+                del self.groups[canonical]
+                removed += 1
+        group = self.groups.pop(message_id, None)
+        if group:
+            for duplicate in group:
+                del self.canonical_of[duplicate]
+            self.released.extend(group)
+            removed += 1
+        return removed
+
+
+def load_state(path, events):
+    """이전 실행에서 커밋된 서명과 기록([signature|duplicate|forget, ...])으로 LSH 인덱스와 중복 묶음 복원
+
+    → (lsh, duplicates, 서명 수)
+    """
+    lsh, duplicates = LSHIndex(), DuplicateGroups()
+    events = list(events)
+    count = sum(event[0] == "signature" for event in events)
+    signatures = np.fromfile(path, dtype=np.uint32, count=count * NUM_PERM).reshape(-1, NUM_PERM) if count else []
+    rows = iter(signatures)
+    for event in events:
+        if event[0] == "signature":
+            lsh.add(event[1], next(rows))
+        elif event[0] == "duplicate":
+            duplicates.add(event[1], event[2])
+        else:
+            lsh.remove(event[1])
+            duplicates.remove(event[1])
+    duplicates.released.clear()  # 풀린 메일은 같은 체크포인트 안에서 이미 다시 비교됨
+    return lsh, duplicates, count
+
+
+def open_signatures(path, offset, full_rebuild):
+    """서명 파일을 마지막 커밋 위치로 잘라내고 이어 씀 (커밋 이후에 쓴 서명 제거)"""
+    if full_rebuild or not os.path.exists(path):
+        return open(path, 'wb')
+    os.truncate(path, offset)
+    return open(path, 'ab')
+
+
+def save_duplicates(duplicates, path):
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(duplicates, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+
+def load_duplicates(path=None):
+    """대표 message_id → 중복 message_id 목록 (파일이 없으면 빈 맵)"""
+    path = path or DUPLICATES_PATH
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def print_report(report):
+    def shrink(before, after):
+        return f"{before:,} → {after:,} (-{1 - after / before:.1%})" if before else "0"
+
+    print(f"이메일:   {shrink(report['emails_in'], report['emails_out'])}, "
+          f"중복 묶음 {report['clusters']:,}개")
+    print(f"본문 문자: {shrink(report['chars_in'], report['chars_out'])}")
+    print(f"인덱스 청크(추정): {shrink(report['chunks_in'], report['chunks_out'])}")
+
+
+def new_report():
+    return dict.fromkeys(["emails_in", "emails_out", "clusters", "chars_in", "chars_out", "chunks_in", "chunks_out"], 0)
+
+
+def dedup_email(lsh, email, duplicates, report, events=None):
+    """이메일 하나를 대표 메일들과 비교 → (출력할지, 새로 lsh에 추가한 서명 또는 None)
+
+    근접 중복이면 duplicates(DuplicateGroups)에 추가하고, 아니면 (본문이 충분히 길 때) 새 대표 메일로 등록한다.
+    이미 본 message_id(내용 변경)면 이전 서명과 중복 관계를 먼저 지운다. events가 있으면 변경을 기록한다.
+    """
+    body = email.get("body", "")
+    chunks = len(split_windows(body))
+    report["emails_in"] += 1
+    report["chars_in"] += len(body)
+    report["chunks_in"] += chunks
+
+    message_id = email.get("message_id")
+    if message_id in lsh.rows or message_id in duplicates.canonical_of or message_id in duplicates.groups:
+        lsh.remove(message_id)
+        report["clusters"] -= duplicates.remove(message_id)
+        if events is not None:
+            events.append(["forget", message_id])
+
+    hashes = shingle_hashes(body)
+    canonical = signature = None
+    if len(hashes) >= MIN_SHINGLES:
+        signature = minhash(hashes)
+        canonical, similarity = lsh.query(signature)
+        if similarity < NEAR_DUP_THRESHOLD:
+            canonical = None
+            lsh.add(message_id, signature)
+            if events is not None:
+                events.append(["signature", message_id])
+        else:
+            signature = None
+
+    if canonical is not None:
+        report["clusters"] += duplicates.add(canonical, message_id)
+        if events is not None:
+            events.append(["duplicate", canonical, message_id])
+        return False, None
+    report["emails_out"] += 1
+    report["chars_out"] += len(body)
+    report["chunks_out"] += chunks
+    return True, signature
+
+
+def dedup_file():
+    """INPUT_FILE 중 이전 체크포인트 이후에 추가된 이메일을 기존 대표 메일과 비교해 OUTPUT_FILE에 이어 씀"""
+    # state_format: 서명 ID/중복 묶음을 manifest 대신 기록 파일에 두는 형식 (예전 manifest는 다시 만듦)
+    params = {"threshold": NEAR_DUP_THRESHOLD, "shingle_words": SHINGLE_WORDS, "num_perm": NUM_PERM,
+              "lsh_bands": LSH_BANDS, "min_shingles": MIN_SHINGLES, "state_format": 2}
+    manifest, full_rebuild = resume_state(STAGE, UPSTREAM_STAGE, INPUT_FILE, params)
+    report = manifest.setdefault("report", new_report())
+
+    with AppendLog(STAGE, "events", manifest, full_rebuild) as event_log:
+        lsh, duplicates, signature_count = load_state(SIGNATURE_FILE, event_log.entries())
+        events = []
+        with open_store_output(OUTPUT_FILE, EMAIL_SCHEMA, manifest["output_offset"], full_rebuild,
+                               key="message_id") as out_store, \
+                open_signatures(SIGNATURE_FILE, signature_count * NUM_PERM * 4, full_rebuild) as sigfile:
+            def checkpoint(input_offset):
+                manifest["input_offset"] = input_offset
+                manifest["output_offset"] = out_store.commit()
+                commit_output(sigfile)
+                for event in events:
+                    event_log.append(event)
+                events.clear()
+                event_log.commit(manifest)
+                save_manifest(STAGE, manifest)
+
+            pending = 0
+            input_offset = manifest["input_offset"]
+            for input_offset, email in tqdm(iter_records_from(INPUT_FILE, input_offset), desc="Near-dedup emails"):
+                # 대표 메일이 바뀌어 묶음에서 풀린 중복 메일은 입력 저장소에서 최신 레코드를 꺼내 다시 비교
+                pending_emails = [email]
+                while pending_emails:
+                    current = pending_emails.pop(0)
+                    keep, signature = dedup_email(lsh, current, duplicates, report, events)
+                    if signature is not None:
+                        sigfile.write(signature.tobytes())
+                    if keep:
+                        out_store.append(current)
+                    if duplicates.released:
+                        input_store = RecordStore(INPUT_FILE)
+                        released = (input_store.get(message_id) for message_id in duplicates.released)
+                        pending_emails.extend(record for record in released if record is not None)
+                        duplicates.released.clear()
+
+                pending += 1
+                if pending >= CHECKPOINT_EVERY:
+                    checkpoint(input_offset)
+                    pending = 0
+            checkpoint(input_offset)
+
+    save_duplicates(duplicates.groups, DUPLICATES_PATH)
+    print_report(report)
+    print(f"대표 메일 → 중복 목록이 '{DUPLICATES_PATH}'에 저장되었습니다.")
+
+
+if __name__ == "__main__":
+    dedup_file()
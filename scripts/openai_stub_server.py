@@ -0,0 +1,122 @@
+"""로컬 OpenAI 호환 스텁 서버 - API 키/네트워크 없이 스트리밍 답변과 TTFT 측정을 테스트하기 위한 용도
+
+POST /v1/chat/completions 만 구현한다.
+  - 필터 추출 프롬프트("Return JSON only")에는 빈 필터 JSON을 반환
+  - 그 외에는 고정 답변을 단어 단위로 (stream=true면 SSE로) 반환
+
+사용 예:
+  python openai_stub_server.py --port 8001 --first-token-delay 0.5 --token-delay 0.05
+  OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=stub python rag_chat.py
+"""
+import argparse
+import json
+import re
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_ANSWER = (
+    "This is a stub answer from the local OpenAI-compatible server. "
+    "The retrieved emails were passed in the prompt and the answer is streamed word by word "
+    "so that time-to-first-token and total generation time can be measured."
+)
+EMPTY_FILTERS = {"date_exact": None, "date_month": None, "date_year": None, "sender_name": None, "keywords": []}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    first_token_delay = 0.0
+    token_delay = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        messages = request.get("messages", [])
+        prompt_text = "\n".join(str(m.get("content", "")) for m in messages)
+
+        if "Return JSON only" in prompt_text:
+            answer = json.dumps(EMPTY_FILTERS)
+        else:
+            answer = STUB_ANSWER
+        tokens = re.findall(r"\S+\s*", answer)
+        model = request.get("model", "stub")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        if request.get("stream"):
+            self.stream_response(completion_id, model, tokens)
+        else:
+            time.sleep(self.first_token_delay + self.token_delay * len(tokens))
+            self.send_json({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": len(prompt_text.split()), "completion_tokens": len(tokens),
+                          "total_tokens": len(prompt_text.split()) + len(tokens)},
+            })
+
+    def send_json(self, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream_response(self, completion_id, model, tokens):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        def send_chunk(delta, finish_reason=None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        time.sleep(self.first_token_delay)
+        send_chunk({"role": "assistant", "content": ""})
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self.token_delay)
+            send_chunk({"content": token})
+        send_chunk({}, finish_reason="stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="OpenAI 호환 스텁 서버")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8001)
+    arg_parser.add_argument("--first-token-delay", type=float, default=0.3, help="첫 토큰 전 지연 (초)")
+    arg_parser.add_argument("--token-delay", type=float, default=0.03, help="토큰 사이 지연 (초)")
+    args = arg_parser.parse_args()
+
+    StubHandler.first_token_delay = args.first_token_delay
+    StubHandler.token_delay = args.token_delay
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"🧪 OpenAI 스텁 서버 실행 중: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
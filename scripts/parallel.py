@@ -0,0 +1,25 @@
+"""프로세스 풀 공용 유틸리티 (mbox_converter.py, data_cleaner.py)"""
+from collections import deque
+
+
+def ordered_map(executor, fn, tasks, max_inflight):
+    """작업을 병렬 실행하되 결과는 제출 순서대로 반환 (대기 작업 수 제한으로 메모리 일정 유지)"""
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(fn, task))
+        if len(pending) >= max_inflight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def iter_batches(items, max_items):
+    """이터러블을 max_items개씩 리스트로 묶기"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= max_items:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
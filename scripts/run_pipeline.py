@@ -0,0 +1,258 @@
+"""mbox → 인덱스 단일 패스 파이프라인 (단계 사이에 코퍼스 전체 중간 파일 없이 제너레이터로 연결)
+
+mbox_converter → data_cleaner → near_dedup → chunk_emailwise → build_chromaDB를 한 프로세스에서 레코드 단위로 흘려보낸다.
+각 단계는 앞 단계에서 필요한 만큼만 당겨 오므로(pull) 배압이 자연스럽게 걸리고, 파싱/정제 프로세스 풀(ordered_map의
+MAX_INFLIGHT)과 인덱서 단계 사이 큐(QUEUE_SIZE)가 메모리 상한을 지킨다.
+  - 파싱과 정제는 같은 워커 프로세스에서 이어서 실행 (JSONL 쓰기/재파싱 없음)
+  - 스레드 인덱스(thread_builder)는 흘러가는 헤더를 모아 끝에서 한 번 만든다. 청크의 thread_id는 이전 스레드 인덱스의
+    루트 ID, 없으면 References 첫 항목 (mbox_converter의 임시 스레드 ID)
+  - BM25 인덱스도 인덱서로 가는 청크를 그대로 받아 만든다
+  - 중복 제거를 통과한 이메일은 앱이 message_id로 출처 이메일을 찾는 저장소(near_dedup.OUTPUT_FILE)에도 이어 쓴다
+  - --tee DIR을 주면 단계별 출력을 DIR/clean.jsonl, dedup.jsonl, chunks.jsonl에 함께 기록 (디버깅용)
+
+항상 전체 재생성이며(컬렉션을 새로 만듦) 단계별 체크포인트는 남기지 않는다. 새 mbox만 반영하는 증분 갱신은
+기존처럼 단계별 스크립트를 사용한다 (이 실행 뒤 단계별 스크립트를 돌리면 각 단계가 처음부터 다시 만든다).
+끝나면 단계별 처리 수, 자체 소요 시간(앞 단계 제외), 처리량, 그 단계가 출력하는 동안 관측한 최대 RSS를 출력한다.
+
+사용법: python run_pipeline.py [--mbox-dir DIR] [--tee DIR] [--report report.json]
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import build_chromaDB
+import chunk_emailwise
+import data_cleaner
+import mbox_converter
+import near_dedup
+import thread_builder
+from bm25_index import BM25Builder
+from embedding_cache import EmbeddingCache
+from parallel import ordered_map
+from record_store import EMAIL_SCHEMA, RecordStoreWriter
+
+RSS_SAMPLE_EVERY = 256  # 단계 출력 N개마다 RSS 측정
+
+
+def current_rss():
+    """현재 RSS (바이트, /proc가 없으면 지금까지의 최대 RSS)"""
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StageMeter:
+    """제너레이터 단계 하나의 출력 수 / 소요 시간 / 출력 시점 최대 RSS
+
+    단계는 앞 단계를 당겨 오며 실행되므로, 자체 시간은 (이 단계 next()에 걸린 시간 - 앞 단계 next()에 걸린 시간)이다.
+    """
+
+    def __init__(self, name, upstream=None):
+        self.name = name
+        self.upstream = upstream
+        self.items = 0
+        self.inclusive = 0.0
+        self.peak_rss = 0
+        self.extra = {}
+
+    @property
+    def seconds(self):
+        return self.inclusive - (self.upstream.inclusive if self.upstream else 0.0)
+
+    def wrap(self, iterable):
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.inclusive += time.perf_counter() - started
+                self.peak_rss = max(self.peak_rss, current_rss())
+                return
+            self.inclusive += time.perf_counter() - started
+            self.items += 1
+            if self.items % RSS_SAMPLE_EVERY == 1:
+                self.peak_rss = max(self.peak_rss, current_rss())
+            yield item
+
+    def report(self):
+        return {"items": self.items, "seconds": round(self.seconds, 2),
+                "items_per_sec": round(self.items / self.seconds, 1) if self.seconds > 0 else None,
+                "peak_rss_mb": round(self.peak_rss / 1e6, 1), **self.extra}
+
+
+def tee(items, tee_dir, name):
+    """tee_dir가 있으면 단계 출력을 tee_dir/name.jsonl에도 기록"""
+    if tee_dir is None:
+        yield from items
+        return
+    with open(os.path.join(tee_dir, f"{name}.jsonl"), 'w', encoding='utf-8') as f:
+        for item in items:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            yield item
+
+
+# --- 1단계: mbox 파싱 + 정제 (같은 워커에서) ---
+def parse_clean_batch(task):
+    """워커 프로세스: mbox 범위 묶음 → ([(정제된 레코드 또는 None, 오류)], 파싱 초, 정제 초)"""
+    started = time.perf_counter()
+    parsed = mbox_converter.parse_batch(task)
+    parse_seconds = time.perf_counter() - started
+    results = []
+    for _, _, record, error in parsed:
+        if record is not None and error is None:
+            try:
+                record = None if data_cleaner.is_skipped(record) else data_cleaner.clean_record(record)
+            except Exception as e:
+                record, error = None, str(e)
+        results.append((record, error))
+    return results, parse_seconds, time.perf_counter() - started - parse_seconds
+
+
+def iter_clean_emails(executor, worker_seconds):
+    """모든 mbox의 메시지를 파일 순서대로 파싱/정제해 반환 (워커별 파싱/정제 시간은 worker_seconds에 합산)"""
+    for mbox_filename, mbox_path in mbox_converter.mbox_paths():
+        if not os.path.exists(mbox_path):
+            print(f"{mbox_filename} 파일 없음, 건너뜀")
+            continue
+        print(f"처리 중: {mbox_filename}...")
+        ranges = mbox_converter.iter_message_ranges(mbox_path)
+        tasks = ((mbox_path, batch) for batch in mbox_converter.iter_batches(ranges))
+        for results, parse_seconds, clean_seconds in ordered_map(
+                executor, parse_clean_batch, tasks, mbox_converter.MAX_INFLIGHT):
+            worker_seconds["parse"] += parse_seconds
+            worker_seconds["clean"] += clean_seconds
+            for record, error in results:
+                if error is not None:
+                    print(f"메시지 처리 오류: {error}")
+                elif record is not None:
+                    yield record
+
+
+# --- 2단계: message_id 중복 + 근접 중복 제거 (스레드 헤더 수집) ---
+def iter_unique_emails(emails, lsh, duplicates, report, messages, email_store):
+    """같은 message_id는 처음 나온 것만, 근접 중복은 대표 메일만 통과 (통과한 메일은 email_store에도 기록)
+
+    스레드 인덱스는 단계별 실행과 같이 근접 중복 제거 전의 메일로 만들도록 헤더를 여기서 messages에 모은다.
+    """
+    seen = set()
+    for email in emails:
+        message_id = email.get("message_id")
+        if message_id in seen:
+            continue
+        seen.add(message_id)
+        thread_builder.add_message(messages, email)
+        keep, _ = near_dedup.dedup_email(lsh, email, duplicates, report)
+        if keep:
+            email_store.append(email)
+            yield email
+
+
+# --- 3단계: 청크 (BM25 포스팅 추가) ---
+def iter_chunks(emails, message_roots, bm25):
+    for email in emails:
+        for chunk in chunk_emailwise.chunk_email(email, message_roots):
+            bm25.add(build_chromaDB.make_doc_id(chunk), chunk["content"], build_chromaDB.filter_fields(chunk))
+            yield chunk
+
+
+def print_stage(name, row):
+    rate = f"{row['items_per_sec']:>9.1f}/s" if row.get("items_per_sec") else f"{'-':>11}"
+    rss = f"  peak RSS {row['peak_rss_mb']:>7.1f}MB" if "peak_rss_mb" in row else ""
+    print(f"  {name:<12}{row.get('items', 0):>9}개 {row['seconds']:>8.1f}초 {rate}{rss}")
+
+
+def run_pipeline(tee_dir=None):
+    started = time.perf_counter()
+    if tee_dir:
+        os.makedirs(tee_dir, exist_ok=True)
+
+    manifest = {"generation": uuid.uuid4().hex, "upstream_generation": "run_pipeline",
+                "params": build_chromaDB.params(), "input_offset": 0}
+    model = build_chromaDB.load_embedding_model()
+    cache = EmbeddingCache(build_chromaDB.EMBEDDING_CACHE_DIR, build_chromaDB.EMBEDDING_MODEL,
+                           build_chromaDB.EMBEDDING_CACHE_MAX_ENTRIES)
+    collection = build_chromaDB.open_collection(full_rebuild=True)
+
+    lsh, duplicates, dedup_report = near_dedup.LSHIndex(), near_dedup.DuplicateGroups(), near_dedup.new_report()
+    message_roots = thread_builder.load_message_roots()  # 이전 실행의 스레드 인덱스 (있으면 thread_id로 사용)
+    messages, bm25 = {}, BM25Builder()
+    worker_seconds = {"parse": 0.0, "clean": 0.0}
+
+    email_store = RecordStoreWriter(near_dedup.OUTPUT_FILE, EMAIL_SCHEMA, full_rebuild=True, key="message_id")
+    with email_store, ProcessPoolExecutor(max_workers=mbox_converter.NUM_WORKERS) as executor:
+        clean = StageMeter("parse+clean")
+        dedup = StageMeter("dedup", clean)
+        chunk = StageMeter("chunk", dedup)
+        emails = tee(clean.wrap(iter_clean_emails(executor, worker_seconds)), tee_dir, "clean")
+        unique = tee(dedup.wrap(iter_unique_emails(emails, lsh, duplicates, dedup_report, messages, email_store)),
+                     tee_dir, "dedup")
+        chunks = tee(chunk.wrap(iter_chunks(unique, message_roots, bm25)), tee_dir, "chunks")
+        # 인덱서는 (위치, 레코드)를 받으므로 청크 번호를 위치로 사용
+        index_stats, name_email_map, index_seconds = build_chromaDB.index_records(
+            enumerate(chunks, 1), model, cache, collection, manifest, replace_parents=False)
+    clean.extra = {"worker_parse_seconds": round(worker_seconds["parse"], 2),
+                   "worker_clean_seconds": round(worker_seconds["clean"], 2)}
+
+    # 마무리: 스레드 인덱스, 근접 중복 목록, BM25, 알려진 발신자, 인덱서 manifest
+    finalize_started = time.perf_counter()
+    thread_builder.write_thread_index(messages, thread_builder.THREAD_INDEX_PATH)
+    near_dedup.save_duplicates(duplicates.groups, near_dedup.DUPLICATES_PATH)
+    near_dedup.print_report(dedup_report)
+    bm25_docs = bm25.write(build_chromaDB.BM25_INDEX_DIR)
+    senders = build_chromaDB.save_known_senders(name_email_map, True)
+    build_chromaDB.save_report(manifest, collection, index_stats, index_seconds)
+    print(cache.report())
+    finalize_seconds = time.perf_counter() - finalize_started
+
+    # 인덱서의 읽기(read)는 위 제너레이터 단계들을 당겨 오는 시간이므로 인코딩/쓰기만 따로 표시
+    stages = {meter.name: meter.report() for meter in (clean, dedup, chunk)}
+    for name in ("encode", "write"):
+        stats = index_stats[name]
+        stages[f"index.{name}"] = {"items": stats.docs, "seconds": round(stats.busy, 2),
+                                   "items_per_sec": round(stats.docs / stats.busy, 1) if stats.busy else None}
+    stages["finalize"] = {"items": bm25_docs, "seconds": round(finalize_seconds, 2), "known_senders": senders}
+    result = {
+        "wall_seconds": round(time.perf_counter() - started, 2),
+        "index_wall_seconds": round(index_seconds, 2),
+        # ru_maxrss는 Linux에서 KB 단위, 워커 프로세스는 종료된 자식 중 최대값
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3, 1),
+        "worker_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1e3, 1),
+        "stages": stages,
+    }
+
+    print(f"\n단계별 (전체 {result['wall_seconds']:.1f}초, 메인 프로세스 최대 RSS {result['peak_rss_mb']:.0f}MB, "
+          f"워커 최대 RSS {result['worker_peak_rss_mb']:.0f}MB):")
+    for name, row in stages.items():
+        print_stage(name, row)
+    print(f"  (parse+clean 워커 CPU: 파싱 {worker_seconds['parse']:.1f}초, 정제 {worker_seconds['clean']:.1f}초)")
+    return result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--mbox-dir", help='"2021 MM.mbox" 파일이 있는 폴더 (기본: mbox_converter.mbox_dir)')
+    arg_parser.add_argument("--tee", help="단계별 출력을 JSONL로 함께 기록할 폴더 (디버깅용)")
+    arg_parser.add_argument("--report", help="단계별 시간/메모리 결과 JSON 경로")
+    args = arg_parser.parse_args()
+
+    if args.mbox_dir:
+        mbox_converter.mbox_dir = args.mbox_dir
+    result = run_pipeline(args.tee)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"결과가 '{args.report}'에 저장되었습니다.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""이메일 스레드 재구성 (JWZ 알고리즘) + 스레드 인덱스 생성
+
+References / In-Reply-To 헤더로 부모-자식 관계를 만들고, 부모를 잃은 메일은 정규화한 제목으로 묶는다.
+결과는 data/thread_index.json에 저장한다.
+  message_root: message_id → 스레드 루트 ID
+  threads:      루트 ID → [[message_id, date_iso], ...] (시간순)
+
+헤더 열만 읽으므로(본문은 디스크에서 올라오지 않음) 매번 정제된 저장소 전체로 다시 계산한다. (새 메일이 기존 두 스레드를 잇는 경우도 반영)
+chunk_emailwise.py는 이 인덱스의 루트 ID를 thread_id로 사용한다.
+"""
+import json
+import os
+import re
+
+from dateutil import parser
+from dateutil.tz import tzutc
+from checkpoint import new_generation
+from record_store import RecordStore
+
+INPUT_FILE = "/home/eunjo/Desktop/Outlook_LLM_v3/data/outlook_clean.store"  # 열 기반 저장소 (src/record_store.py)
+THREAD_INDEX_PATH = "/home/eunjo/Desktop/Outlook_LLM_v3/data/thread_index.json"
+
+MESSAGE_ID = re.compile(r"<[^<>\s]+>")
+HEADER_COLUMNS = ["message_id", "subject", "date_iso", "references", "in_reply_to"]
+REPLY_PREFIX = re.compile(r"^\s*((re|fw|fwd|aw|wg|sv|답장|회신|전달)\s*(\[\d+\])?\s*[:：]\s*|\[[^\]]*\]\s*)+", re.IGNORECASE)
+REPLY_MARK = re.compile(r"^\s*(\[[^\]]*\]\s*)*(re|fw|fwd|aw|wg|sv|답장|회신|전달)\s*(\[\d+\])?\s*[:：]", re.IGNORECASE)
+
+
+class Container:
+    __slots__ = ("message_id", "message", "parent", "children")
+
+    def __init__(self, message_id):
+        self.message_id = message_id
+        self.message = None  # 없으면 참조만 된 (보관함에 없는) 메일
+        self.parent = None
+        self.children = []
+
+    def is_ancestor_of(self, other):
+        node = other
+        while node is not None:
+            if node is self:
+                return True
+            node = node.parent
+        return False
+
+
+def normalize_message_id(message_id):
+    """'  <abc@x> ' → '<abc@x>' (꺾쇠가 없으면 공백만 제거)"""
+    found = MESSAGE_ID.findall(message_id or "")
+    return found[0] if found else (message_id or "").strip()
+
+
+def normalize_subject(subject):
+    """'RE: Fw: [VV] Sector 6 transport' → 'sector 6 transport'"""
+    return re.sub(r"\s+", " ", REPLY_PREFIX.sub("", subject or "")).strip().lower()
+
+
+def is_reply_subject(subject):
+    """회신/전달 표시가 붙은 제목인지 ('[VV] Sector 6'처럼 태그만 있으면 원본)"""
+    return bool(REPLY_MARK.match(subject or ""))
+
+
+def parse_sort_date(date_iso):
+    """정렬용 UTC 날짜 문자열 (파싱 실패 시 맨 뒤로)"""
+    try:
+        dt = parser.isoparse(date_iso)
+    except (ValueError, TypeError):
+        return "9999"
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=tzutc())
+    return dt.astimezone(tzutc()).isoformat()
+
+
+def set_parent(child, parent):
+    if child.parent is parent:
+        return
+    if child.parent is not None:
+        child.parent.children.remove(child)
+    child.parent = parent
+    if parent is not None:
+        parent.children.append(child)
+
+
+def thread_messages(messages):
+    """{정규화 message_id: {"raw_id", "subject", "date", "references"}} → {원래 message_id: 루트 ID}"""
+    containers = {}
+
+    def get(message_id):
+        if message_id not in containers:
+            containers[message_id] = Container(message_id)
+        return containers[message_id]
+
+    # 1. References 체인 연결 (이미 부모가 있거나 순환이 생기면 건너뜀)
+    for message_id, message in messages.items():
+        container = get(message_id)
+        container.message = message
+        references = [ref for ref in message["references"] if ref != message_id]
+        previous = None
+        for ref in references:
+            node = get(ref)
+            if previous is not None and node.parent is None and not node.is_ancestor_of(previous):
+                set_parent(node, previous)
+            previous = node
+        # 메일 자신의 부모는 마지막 참조로 교체
+        if previous is not None and not container.is_ancestor_of(previous):
+            set_parent(container, previous)
+        elif previous is None:
+            set_parent(container, None)
+
+    # 2. 루트 집합 + 자식이 하나뿐인 빈 루트는 자식을 루트로 승격
+    roots = []
+    for container in containers.values():
+        if container.parent is not None:
+            continue
+        while container.message is None and len(container.children) == 1:
+            child = container.children[0]
+            set_parent(child, None)
+            container = child
+        if container.message is not None or container.children:
+            roots.append(container)
+
+    # 3. 제목으로 묶기: 회신 제목(RE: ...)인 루트만 같은 제목의 원본 루트 아래로 (가장 이른 원본 우선)
+    def root_subject(root):
+        node = root
+        while node.message is None and node.children:
+            node = min(node.children, key=lambda c: c.message["date"] if c.message else "9999")
+        return node.message["subject"] if node.message else ""
+
+    def root_date(root):
+        return root.message["date"] if root.message else min(
+            (c.message["date"] for c in root.children if c.message), default="9999")
+
+    by_subject = {}
+    for root in sorted(roots, key=root_date):
+        subject = root_subject(root)
+        key = normalize_subject(subject)
+        if not key:
+            continue
+        by_subject.setdefault(key, []).append((root, is_reply_subject(subject)))
+
+    merged = set()
+    for group in by_subject.values():
+        originals = [root for root, reply in group if not reply]
+        target = originals[0] if originals else group[0][0]
+        for root, reply in group:
+            if root is not target and reply:
+                set_parent(root, target)
+                merged.add(id(root))
+
+    # 4. 각 메일의 루트 찾기
+    roots = [root for root in roots if id(root) not in merged]
+    message_root = {}
+    for root in roots:
+        # 루트 메일이 보관함에 없으면 참조된 ID를 그대로 루트 ID로 사용
+        root_id = root.message["raw_id"] if root.message is not None else root.message_id
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node.message is not None:
+                message_root[node.message["raw_id"]] = root_id
+            stack.extend(node.children)
+    return message_root
+
+
+def message_header(email):
+    """이메일 레코드 → 스레딩에 필요한 헤더 (message_id가 없으면 None)"""
+    if not email or not email.get("message_id"):
+        return None
+    references = MESSAGE_ID.findall(email.get("references") or "")
+    in_reply_to = MESSAGE_ID.findall(email.get("in_reply_to") or "")
+    # In-Reply-To가 References 끝에 없으면 덧붙임
+    if in_reply_to and (not references or references[-1] != in_reply_to[0]):
+        references.append(in_reply_to[0])
+    return {
+        "raw_id": email["message_id"],
+        "subject": email.get("subject") or "",
+        "date": parse_sort_date(email.get("date_iso")),
+        "date_iso": email.get("date_iso"),
+        "references": references,
+    }
+
+
+def add_message(messages, email):
+    """messages에 이메일 헤더 추가 (같은 message_id가 다시 나오면 마지막 것 사용)"""
+    header = message_header(email)
+    if header is not None:
+        messages[normalize_message_id(header["raw_id"])] = header
+
+
+def load_messages(input_path):
+    """정제된 저장소의 헤더 열만 읽기"""
+    messages = {}
+    store = RecordStore.load(input_path)
+    if store is not None:
+        for _, email in store.iter_records(0, HEADER_COLUMNS):
+            add_message(messages, email)
+    return messages
+
+
+def load_message_roots(index_path=None):
+    """message_id → 루트 ID (인덱스가 없으면 빈 맵)"""
+    index_path = index_path or THREAD_INDEX_PATH
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, 'r', encoding='utf-8') as f:
+        return json.load(f)["message_root"]
+
+
+def write_thread_index(messages, index_path):
+    """헤더 모음 → 스레드 재구성 후 index_path에 저장, message_id → 루트 ID 반환"""
+    message_root = thread_messages(messages)
+
+    by_raw_id = {message["raw_id"]: message for message in messages.values()}
+    threads = {}
+    for message_id, root in message_root.items():
+        threads.setdefault(root, []).append(message_id)
+    for root, members in threads.items():
+        members.sort(key=lambda m: by_raw_id[m]["date"])
+        threads[root] = [[m, by_raw_id[m]["date_iso"]] for m in members]
+
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    with open(index_path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump({"generation": new_generation(), "message_root": message_root, "threads": threads},
+                  f, ensure_ascii=False)
+    os.replace(index_path + ".tmp", index_path)
+
+    multi = sum(1 for members in threads.values() if len(members) > 1)
+    largest = max((len(members) for members in threads.values()), default=0)
+    print(f"{len(messages)}개 메일 → {len(threads)}개 스레드 (2개 이상 {multi}개, 최대 {largest}개) → '{index_path}'")
+    return message_root
+
+
+def build_thread_index(input_path=None, index_path=None):
+    input_path, index_path = input_path or INPUT_FILE, index_path or THREAD_INDEX_PATH
+    return write_thread_index(load_messages(input_path), index_path)
+
+if __name__ == "__main__":
+    build_thread_index()
@@ -0,0 +1,204 @@
+"""질문 임베딩 기반 의미 답변 캐시
+
+같은(또는 거의 같은) 질문이 다시 들어오면 검색과 GPT-4o 생성을 건너뛰고 저장된 답변과 출처 문서 ID를 반환한다.
+  - 코사인 유사도가 threshold 이상이고 날짜/발신자 필터가 같을 때만 히트
+  - ttl_seconds가 지난 항목은 버리고, max_entries를 넘으면 가장 오래 사용되지 않은 항목부터 제거
+  - build_chromaDB.py의 manifest(generation, input_offset)가 바뀌면 (재생성/upsert) 전체 무효화
+
+cache.jsonl 첫 줄은 헤더(model_name, index_version), 이후 한 줄에 항목 하나(답변, 메타데이터, base64 float32 벡터).
+put은 한 줄만 이어 쓰고, 파일 전체는 제거(LRU/무효화)와 save()(종료 시)에서만 다시 쓴다.
+"""
+import base64
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+EVICT_FRACTION = 0.1  # max_entries를 넘으면 이 비율만큼 한 번에 제거 (전체 다시 쓰기를 몰아서 함)
+
+
+def filter_cache_key(filters):
+    """답변에 영향을 주는 필터(날짜/발신자)만 모은 키 - 키워드는 임베딩 유사도로 판단"""
+    kept = {k: v for k, v in (filters or {}).items() if k != "keywords" and v}
+    return json.dumps(kept, sort_keys=True, ensure_ascii=False)
+
+
+class AnswerCache:
+    def __init__(self, cache_dir, model_name, index_manifest_path, threshold, ttl_seconds, max_entries):
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.index_manifest_path = index_manifest_path
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "saved_seconds": 0.0, "invalidations": 0}
+
+        self.entries = []
+        self.vectors = None
+        self.index_version = None
+        self._manifest_stat = None
+        self._manifest_version = None
+        self._load()
+
+    # --- 파일 경로 ---
+    @property
+    def cache_path(self):
+        return os.path.join(self.cache_dir, "cache.jsonl")
+
+    def _load(self):
+        self.index_version = self.current_index_version()
+        if not os.path.exists(self.cache_path):
+            return
+        entries, vectors = [], []
+        with open(self.cache_path, 'r', encoding='utf-8') as f:
+            lines = f.read().split("\n")
+        try:
+            header = json.loads(lines[0])
+        except json.JSONDecodeError:
+            header = {}
+        if header.get("model_name") != self.model_name:
+            print(f"답변 캐시 설정 변경 감지 - '{self.cache_dir}' 캐시를 새로 만듭니다.")
+            self._save()
+            return
+        complete = lines[-1] == ""
+        for line in filter(None, lines[1:]):
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # 이어 쓰는 도중 끊긴 마지막 줄
+                complete = False
+                break
+            vectors.append(np.frombuffer(base64.b64decode(entry.pop("vector")), dtype=np.float32))
+            entries.append(entry)
+        self.entries = entries
+        self.vectors = np.vstack(vectors) if vectors else None
+        self.index_version = header.get("index_version")
+        if not complete:
+            self._save()
+
+    def current_index_version(self):
+        """인덱서 manifest의 (generation, input_offset) - 파일이 바뀌었을 때만 다시 읽음"""
+        try:
+            st = os.stat(self.index_manifest_path)
+        except OSError:
+            return None
+        stat_key = (st.st_mtime_ns, st.st_size)
+        if stat_key != self._manifest_stat:
+            try:
+                with open(self.index_manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                self._manifest_version = f"{manifest.get('generation')}:{manifest.get('input_offset')}"
+            except (OSError, json.JSONDecodeError):
+                # 인덱서가 쓰는 도중이면 다음 조회에서 다시 확인
+                return self._manifest_version
+            self._manifest_stat = stat_key
+        return self._manifest_version
+
+    def _check_index_version(self):
+        version = self.current_index_version()
+        if version != self.index_version:
+            if self.entries:
+                self.stats["invalidations"] += 1
+                print(f"벡터 DB 변경 감지 - 답변 캐시 {len(self.entries)}개 무효화")
+            self.entries, self.vectors = [], None
+            self.index_version = version
+            self._save()
+
+    def _expire(self, now):
+        keep = [i for i, entry in enumerate(self.entries) if now - entry["created"] <= self.ttl_seconds]
+        if len(keep) < len(self.entries):
+            self._keep(keep)
+
+    def _keep(self, keep):
+        self.entries = [self.entries[i] for i in keep]
+        self.vectors = self.vectors[keep] if keep else None
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding, filter_key):
+        """히트면 {"query", "answer", "doc_ids", "latency", "similarity", ...}, 아니면 None"""
+        now = time.time()
+        with self.lock:
+            self._check_index_version()
+            self._expire(now)
+            hit = None
+            if self.entries:
+                similarities = self.vectors @ self._normalize(embedding)
+                for i in np.argsort(-similarities):
+                    if similarities[i] < self.threshold:
+                        break
+                    if self.entries[i]["filter_key"] == filter_key:
+                        self.entries[i]["last_used"] = now
+                        hit = dict(self.entries[i], similarity=float(similarities[i]))
+                        break
+            if hit is None:
+                self.stats["misses"] += 1
+            else:
+                self.stats["hits"] += 1
+                self.stats["saved_seconds"] += hit["latency"]
+            return hit
+
+    def has_similar(self, embedding):
+        """필터와 상관없이 threshold 이상인 질문이 있는지 (통계와 LRU 순서는 건드리지 않음)"""
+        now = time.time()
+        with self.lock:
+            self._check_index_version()
+            self._expire(now)
+            return bool(self.entries) and float(np.max(self.vectors @ self._normalize(embedding))) >= self.threshold
+
+    def put(self, query, embedding, filter_key, answer, doc_ids, latency):
+        now = time.time()
+        with self.lock:
+            self._check_index_version()
+            entry = {"query": query, "filter_key": filter_key, "answer": answer, "doc_ids": list(doc_ids),
+                     "latency": latency, "created": now, "last_used": now}
+            vector = self._normalize(embedding)[None, :]
+            self.entries.append(entry)
+            self.vectors = vector if self.vectors is None else np.vstack([self.vectors, vector])
+            if len(self.entries) > self.max_entries:
+                # LRU: 가장 오래 사용되지 않은 항목부터 제거하고 파일 전체를 다시 씀
+                keep = max(int(self.max_entries * (1 - EVICT_FRACTION)), 1)
+                order = sorted(range(len(self.entries)), key=lambda i: self.entries[i]["last_used"], reverse=True)
+                self._keep(sorted(order[:keep]))
+                self._save()
+            else:
+                self._append(entry, vector[0])
+
+    @staticmethod
+    def _line(entry, vector):
+        encoded = base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+        return json.dumps(dict(entry, vector=encoded), ensure_ascii=False) + "\n"
+
+    def _append(self, entry, vector):
+        if not os.path.exists(self.cache_path):
+            self._save()
+            return
+        with open(self.cache_path, 'a', encoding='utf-8') as f:
+            f.write(self._line(entry, vector))
+
+    def _save(self):
+        """헤더와 모든 항목을 임시 파일에 쓰고 원자적으로 교체"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"model_name": self.model_name, "index_version": self.index_version},
+                               ensure_ascii=False) + "\n")
+            for entry, vector in zip(self.entries, self.vectors if self.vectors is not None else []):
+                f.write(self._line(entry, vector))
+        os.replace(tmp_path, self.cache_path)
+
+    def save(self):
+        """마지막 사용 시점(LRU 순서)까지 디스크에 반영"""
+        with self.lock:
+            self._save()
+
+    def hit_rate(self):
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
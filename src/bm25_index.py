@@ -0,0 +1,213 @@
+"""BM25 키워드 인덱스 (부품 번호, 문서 ID, 약어 등 정확한 키워드 검색용)
+
+Chroma 컬렉션과 같은 청크 저장소(record_store)로 만들고, 포스팅은 메모리 매핑된 numpy 배열로 저장한다.
+  vocab.json        용어 → 용어 ID
+  offsets.npy       용어 ID별 포스팅 시작 위치 (길이 = 용어 수 + 1)
+  postings_doc.npy  문서 번호 (uint32)
+  postings_tf.npy   용어 빈도 (uint16)
+  doc_len.npy       문서 길이 (토큰 수)
+  doc_ids.json      문서 번호 → Chroma 문서 ID
+  doc_timestamp.npy 문서 번호 → 보낸 시각 (UTC 초, 없으면 NO_TIMESTAMP)
+  doc_sender_name.npy / doc_sender_address.npy  문서 번호 → senders.json의 정규화 발신자 이름/주소 번호
+  senders.json      발신자 이름/주소 문자열 목록
+
+날짜/발신자 필터는 점수를 매긴 뒤 상위 k개를 고르기 전에 문서 열로 걸러서, 필터가 있어도 k개를 채운다.
+"""
+import json
+import math
+import os
+import re
+import shutil
+from array import array
+from collections import Counter
+
+import numpy as np
+
+from record_store import RecordStore
+
+K1 = 1.2
+B = 0.75
+NO_TIMESTAMP = np.iinfo(np.int64).min
+
+TOKEN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*|[가-힣]{2,}")
+SUBTOKEN = re.compile(r"[-_./]")
+
+
+def tokenize(text):
+    """소문자 토큰 + 복합 토큰의 구성 요소 ('vv-s6-101' → 'vv-s6-101', 'vv', 's6', '101')"""
+    tokens = []
+    for token in TOKEN.findall((text or "").lower()):
+        tokens.append(token)
+        if SUBTOKEN.search(token):
+            tokens.extend(part for part in SUBTOKEN.split(token) if part)
+    return tokens
+
+
+ID_COLUMNS = ["metadata.message_id", "metadata.content_hash", "metadata.chunk_index"]  # make_doc_id에 필요한 열
+FILTER_COLUMNS = ["metadata.date", "metadata.from", "metadata.name_email_map"]  # 날짜/발신자 필터 열
+
+
+def iter_chunk_documents(store_path, make_doc_id, make_parent_id, make_filter_fields):
+    """청크 저장소 → (문서 ID, 본문, 필터 열 {"timestamp", "sender_name", "sender_address"})
+
+    한 이메일의 청크는 연속으로 기록되므로, 같은 이메일이 여러 번 나오면(변경된 메일)
+    마지막으로 시작된 청크 묶음만 사용한다. (첫 번째 훑기는 ID 열만 읽음)
+    """
+    store = RecordStore.load(store_path)
+    if store is None:
+        return
+    latest_start = {}
+    for row, record in store.iter_records(0, ID_COLUMNS):
+        if not record['metadata'].get('chunk_index'):
+            latest_start[make_parent_id(record)] = row
+    for row, record in store.iter_records(0, ID_COLUMNS + FILTER_COLUMNS + ["content"]):
+        if row >= latest_start.get(make_parent_id(record), 0):
+            yield make_doc_id(record), record['content'], make_filter_fields(record)
+
+
+class BM25Builder:
+    """(문서 ID, 본문)을 하나씩 받아 포스팅을 쌓고 write()로 인덱스 디렉터리 생성 (청크를 스트리밍으로 받을 때 사용)"""
+
+    def __init__(self):
+        self.vocab = {}
+        self.term_ids, self.doc_nums, self.tfs = array('I'), array('I'), array('H')
+        self.doc_lens = array('I')
+        self.doc_ids = []
+        self.timestamps, self.sender_names, self.sender_addresses = array('q'), array('i'), array('i')
+        self.senders = {}
+
+    def sender_id(self, value):
+        return self.senders.setdefault(value or "", len(self.senders))
+
+    def add(self, doc_id, content, fields=None):
+        """fields: 날짜/발신자 필터 열 {"timestamp", "sender_name", "sender_address"} (없으면 필터에 걸리지 않음)"""
+        fields = fields or {}
+        doc_num = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+        timestamp = fields.get("timestamp")
+        self.timestamps.append(NO_TIMESTAMP if timestamp is None else timestamp)
+        self.sender_names.append(self.sender_id(fields.get("sender_name")))
+        self.sender_addresses.append(self.sender_id(fields.get("sender_address")))
+        tokens = tokenize(content)
+        self.doc_lens.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            self.term_ids.append(self.vocab.setdefault(term, len(self.vocab)))
+            self.doc_nums.append(doc_num)
+            self.tfs.append(min(tf, 65535))
+
+    def write(self, index_dir):
+        """index_dir를 원자적으로 교체. 문서 수 반환"""
+        vocab = self.vocab
+        term_ids = np.frombuffer(self.term_ids, dtype=np.uint32) if self.term_ids else np.zeros(0, dtype=np.uint32)
+        order = np.argsort(term_ids, kind="stable")
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocab)), out=offsets[1:])
+
+        tmp_dir = index_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        np.save(os.path.join(tmp_dir, "offsets.npy"), offsets)
+        np.save(os.path.join(tmp_dir, "postings_doc.npy"), np.asarray(self.doc_nums, dtype=np.uint32)[order])
+        np.save(os.path.join(tmp_dir, "postings_tf.npy"), np.asarray(self.tfs, dtype=np.uint16)[order])
+        np.save(os.path.join(tmp_dir, "doc_len.npy"), np.asarray(self.doc_lens, dtype=np.uint32))
+        np.save(os.path.join(tmp_dir, "doc_timestamp.npy"), np.asarray(self.timestamps, dtype=np.int64))
+        np.save(os.path.join(tmp_dir, "doc_sender_name.npy"), np.asarray(self.sender_names, dtype=np.int32))
+        np.save(os.path.join(tmp_dir, "doc_sender_address.npy"), np.asarray(self.sender_addresses, dtype=np.int32))
+        with open(os.path.join(tmp_dir, "senders.json"), 'w', encoding='utf-8') as f:
+            json.dump(list(self.senders), f, ensure_ascii=False)
+        with open(os.path.join(tmp_dir, "vocab.json"), 'w', encoding='utf-8') as f:
+            json.dump(vocab, f, ensure_ascii=False)
+        with open(os.path.join(tmp_dir, "doc_ids.json"), 'w', encoding='utf-8') as f:
+            json.dump(self.doc_ids, f, ensure_ascii=False)
+
+        # 기존 인덱스와 교체
+        old_dir = index_dir + ".old"
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(index_dir):
+            os.replace(index_dir, old_dir)
+        os.replace(tmp_dir, index_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        return len(self.doc_ids)
+
+
+def build_bm25_index(store_path, index_dir, make_doc_id, make_parent_id, make_filter_fields):
+    """전체 청크로 BM25 인덱스를 새로 만들고 index_dir를 원자적으로 교체. 문서 수 반환"""
+    builder = BM25Builder()
+    for doc_id, content, fields in iter_chunk_documents(store_path, make_doc_id, make_parent_id, make_filter_fields):
+        builder.add(doc_id, content, fields)
+    return builder.write(index_dir)
+
+
+class BM25Index:
+    """메모리 매핑된 BM25 인덱스 (읽기 전용, 여러 스레드에서 동시에 검색 가능)"""
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, "vocab.json"), 'r', encoding='utf-8') as f:
+            self.vocab = json.load(f)
+        with open(os.path.join(index_dir, "doc_ids.json"), 'r', encoding='utf-8') as f:
+            self.doc_ids = json.load(f)
+        self.offsets = np.load(os.path.join(index_dir, "offsets.npy"), mmap_mode="r")
+        self.postings_doc = np.load(os.path.join(index_dir, "postings_doc.npy"), mmap_mode="r")
+        self.postings_tf = np.load(os.path.join(index_dir, "postings_tf.npy"), mmap_mode="r")
+        doc_len = np.load(os.path.join(index_dir, "doc_len.npy")).astype(np.float32)
+        self.num_docs = len(self.doc_ids)
+        self.filterable = os.path.exists(os.path.join(index_dir, "senders.json"))  # 필터 열이 없는 예전 인덱스
+        if self.filterable:
+            self.timestamps = np.load(os.path.join(index_dir, "doc_timestamp.npy"), mmap_mode="r")
+            self.sender_names = np.load(os.path.join(index_dir, "doc_sender_name.npy"), mmap_mode="r")
+            self.sender_addresses = np.load(os.path.join(index_dir, "doc_sender_address.npy"), mmap_mode="r")
+            with open(os.path.join(index_dir, "senders.json"), 'r', encoding='utf-8') as f:
+                self.sender_ids = {value: i for i, value in enumerate(json.load(f))}
+        avg_len = float(doc_len.mean()) if self.num_docs else 1.0
+        # 문서 길이 정규화 항은 미리 계산
+        self.length_norm = K1 * (1 - B + B * doc_len / max(avg_len, 1.0))
+
+    @classmethod
+    def load(cls, index_dir):
+        """인덱스가 없으면 None (벡터 검색만 사용)"""
+        if not os.path.exists(os.path.join(index_dir, "vocab.json")):
+            return None
+        return cls(index_dir)
+
+    def filter_mask(self, date_span=None, sender=None):
+        """날짜 구간 [start, end)와 발신자 (정규화 이름 후보, 주소 후보)에 맞는 문서 → bool 배열 (조건이 없으면 None)"""
+        if not self.filterable or (date_span is None and sender is None):
+            return None
+        mask = np.ones(self.num_docs, dtype=bool)
+        if date_span is not None:
+            timestamps = np.asarray(self.timestamps)
+            mask &= (timestamps >= date_span[0]) & (timestamps < date_span[1])
+        if sender is not None:
+            names, addresses = sender
+            name_ids = [self.sender_ids[n] for n in names if n and n in self.sender_ids]
+            address_ids = [self.sender_ids[a] for a in addresses if a and a in self.sender_ids]
+            mask &= (np.isin(np.asarray(self.sender_names), name_ids)
+                     | np.isin(np.asarray(self.sender_addresses), address_ids))
+        return mask
+
+    def search(self, query, k=10, date_span=None, sender=None):
+        """[(문서 ID, BM25 점수)] 상위 k개 (date_span/sender를 주면 그 조건에 맞는 문서 중에서)"""
+        terms = Counter(t for t in tokenize(query) if t in self.vocab)
+        if not terms or self.num_docs == 0:
+            return []
+
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term, query_tf in terms.items():
+            term_id = self.vocab[term]
+            start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            docs = np.asarray(self.postings_doc[start:end])
+            tf = np.asarray(self.postings_tf[start:end], dtype=np.float32)
+            df = end - start
+            idf = math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+            # 한 용어의 포스팅에서 문서 번호는 중복되지 않으므로 fancy index 누적이 안전
+            scores[docs] += query_tf * idf * tf * (K1 + 1) / (tf + self.length_norm[docs])
+
+        mask = self.filter_mask(date_span, sender)
+        if mask is not None:
+            scores[~mask] = 0.0
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.doc_ids[i], float(scores[i])) for i in top]
@@ -1,78 +1,446 @@
 import json
 import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
 import chromadb
-from chromadb.utils import embedding_functions
+import numpy as np
+from dateutil import parser as date_parser
+from dateutil.tz import tzutc
+from sentence_transformers import SentenceTransformer
+from bm25_index import build_bm25_index
+from embedding_cache import EmbeddingCache
+from query_filters import normalize_name
+from record_store import RecordStore
+
+# 단계별 manifest는 scripts/checkpoint.py를 다른 단계와 함께 사용
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from checkpoint import resume_state, save_manifest  # noqa: E402
 
 # --- 설정 ---
-JSONL_PATH = "/home/eunjo/Desktop/Outlook_LLM_v3/data/outlook_chunk_emailwise.jsonl"  # 전처리된 이메일 청크 데이터
+CHUNK_STORE_PATH = "/home/eunjo/Desktop/Outlook_LLM_v3/data/outlook_chunk_emailwise.store"  # 이메일 청크 (열 기반 저장소)
 CHROMA_DB_PATH = "/home/eunjo/Desktop/Outlook_LLM_v3/data/vectorstore/chroma_outlook"  # 벡터 DB 저장 경로
+KNOWN_SENDERS_PATH = "/home/eunjo/Desktop/Outlook_LLM_v3/data/known_senders.json"  # 질문 필터 fast path용 이름 → 이메일 맵
+BM25_INDEX_DIR = "/home/eunjo/Desktop/Outlook_LLM_v3/data/bm25_index"  # 하이브리드 검색용 키워드 인덱스
 COLLECTION_NAME = "email_rag_collection"
 BATCH_SIZE = 500  # 일괄 삽입 단위
+STAGE = "build_chromaDB"
+METADATA_VERSION = 4  # 메타데이터 스키마가 바뀌면 올림 (기존 컬렉션은 자동으로 전체 재생성)
+UPSTREAM_STAGE = "chunk_emailwise"
+EMBEDDING_MODEL = "BAAI/bge-m3"
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE")  # 미지정 시 GPU가 있으면 cuda, 없으면 cpu
+EMBEDDING_CACHE_DIR = "/home/eunjo/Desktop/Outlook_LLM_v3/data/embedding_cache"  # 임베딩 캐시 경로
+EMBEDDING_CACHE_MAX_ENTRIES = 500_000  # 캐시 최대 항목 수 (bge-m3 1024차원 float16 기준 약 1GB)
 
-# 임베딩 모델 설정 (BGE-M3: 고성능 다국어 임베딩, GPU 가속)
-embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name="BAAI/bge-m3",
-    device="cuda"  # GPU 사용
-)
+# --- 파이프라인 설정 ---
+QUEUE_SIZE = 4            # 단계 사이 큐에 대기할 수 있는 배치 수 (메모리 상한)
+ENCODE_POOL_SIZE = 2000   # 길이별 정렬을 위해 인코더가 모아서 처리하는 문서 수
+TOKEN_BUDGET = 32768      # 인코딩 배치 하나의 (최장 토큰 길이 × 배치 크기) 상한
+MAX_ENCODE_BATCH = 256    # 짧은 문서만 모였을 때의 배치 크기 상한
 
 
-def build_chroma_db():
+def pick_device():
+    if EMBEDDING_DEVICE:
+        return EMBEDDING_DEVICE
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def load_embedding_model():
+    # 임베딩 모델 설정 (BGE-M3: 고성능 다국어 임베딩, GPU 가속 / GPU 없으면 CPU)
+    device = pick_device()
+    print(f"임베딩 모델 '{EMBEDDING_MODEL}' 로딩 중... (device={device})")
+    return SentenceTransformer(EMBEDDING_MODEL, device=device)
+
+
+def params():
+    """인덱스 내용에 영향을 주는 설정 (바뀌면 컬렉션을 처음부터 다시 만듦)"""
+    return {"metadata_version": METADATA_VERSION}
+
+
+def make_parent_id(record):
+    """message_id 기반 고정 부모 ID (이메일의 첫 번째 청크 ID와 같음)"""
+    message_id = record['metadata'].get('message_id')
+    return f"email_{message_id or record['metadata'].get('content_hash')}"
+
+
+def make_doc_id(record):
+    """청크 ID (내용이 바뀐 메일은 같은 ID로 upsert되어 교체됨)"""
+    chunk_index = record['metadata'].get('chunk_index') or 0
+    parent_id = make_parent_id(record)
+    return parent_id if chunk_index == 0 else f"{parent_id}#{chunk_index}"
+
+
+def save_known_senders(name_email_map, full_rebuild):
+    """이번 실행에서 모은 name_email_map을 기존 파일과 합쳐 저장 (query_filters.py의 발신자 인식에 사용)"""
+    known = {}
+    if not full_rebuild and os.path.exists(KNOWN_SENDERS_PATH):
+        with open(KNOWN_SENDERS_PATH, 'r', encoding='utf-8') as f:
+            known = json.load(f)
+    known.update(name_email_map)
+    with open(KNOWN_SENDERS_PATH + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(known, f, ensure_ascii=False)
+    os.replace(KNOWN_SENDERS_PATH + ".tmp", KNOWN_SENDERS_PATH)
+    return len(known)
+
+
+def parse_timestamp(date_str):
+    """ISO 날짜 문자열 → UTC epoch 초 (파싱 실패 시 None)"""
+    if not date_str:
+        return None
+    try:
+        dt = date_parser.isoparse(date_str)
+    except (ValueError, TypeError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=tzutc())
+    return dt.astimezone(tzutc())
+
+
+def resolve_sender_name(address, name_email_map):
+    """name_email_map에서 발신 주소에 해당하는 표시 이름 찾기"""
+    for name, email in (name_email_map or {}).items():
+        if isinstance(email, str) and email.lower() == address:
+            return name
+    return ""
+
+
+def filter_fields(record):
+    """날짜/발신자 필터에 쓰는 값 (Chroma 메타데이터와 BM25 인덱스가 같은 값을 사용)"""
+    sender = (record['metadata'].get('from') or [''])[0]
+    sender_address = sender.strip().lower()
+    sender_display = resolve_sender_name(sender_address, record['metadata'].get('name_email_map'))
+    dt = parse_timestamp(record['metadata'].get('date'))
+    return {
+        "sender": sender,
+        "sender_address": sender_address,
+        "sender_name": normalize_name(sender_display),
+        "sender_display": sender_display,
+        "timestamp": int(dt.timestamp()) if dt is not None else None,
+    }
+
+
+def build_metadata(record):
+    """Chroma 메타데이터 - where 절에서 인덱스 필터로 쓰도록 날짜는 정수, 발신자는 정규화해 저장"""
+    fields = filter_fields(record)
+    meta = {
+        "thread_id": record['metadata'].get('thread_id', 'N/A'),
+        "date": record['metadata'].get('date'),
+        "sender": fields["sender"],
+        "sender_address": fields["sender_address"],
+        "sender_name": fields["sender_name"],
+        "sender_display": fields["sender_display"].strip(" \"'"),
+        "recipients": ", ".join(record['metadata'].get('to', [])),
+        # 첨부파일 청크의 첫 줄은 파일명이므로 이메일 제목은 메타데이터에서 가져옴
+        "subject_preview": (record['metadata'].get('subject') or record['content'].split('\n')[0])[:100] + "...",
+        # Chroma 메타데이터는 리스트를 저장하지 못하므로 첨부파일 이름은 쉼표로 이어 붙임
+        "attachments": ", ".join(record['metadata'].get('attachments') or []),
+        # 긴 이메일의 윈도우 청크를 검색 시 부모 이메일로 모으기 위한 정보
+        "parent_id": make_parent_id(record),
+        "chunk_index": record['metadata'].get('chunk_index') or 0,
+        "chunk_count": record['metadata'].get('chunk_count') or 1,
+        "body_start": record['metadata'].get('body_start') or 0,
+        "attachment": record['metadata'].get('attachment') or "",  # 첨부파일 자식 청크면 파일명, 본문이면 ""
+    }
+    if fields["timestamp"] is not None:
+        dt = datetime.fromtimestamp(fields["timestamp"], tz=timezone.utc)
+        meta["timestamp"] = fields["timestamp"]
+        meta["year"] = dt.year
+        meta["month"] = dt.month
+    return meta
+
+
+def directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+
+
+class StageStats:
+    """단계별 처리 문서 수와 실제 작업 시간(큐 대기 제외)"""
+
+    def __init__(self, name):
+        self.name = name
+        self.docs = 0
+        self.busy = 0.0
+
+    def report(self):
+        rate = self.docs / self.busy if self.busy else 0.0
+        return f"  - {self.name}: {self.docs}개 문서, 작업 {self.busy:.1f}초, {rate:.1f} docs/sec"
+
+
+def put_until_stopped(q, item, stop):
+    """다른 단계가 실패하면 대기를 멈추도록 timeout을 두고 put"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def get_until_stopped(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return None
+
+
+# --- 1단계: 청크 저장소 읽기 + 메타데이터 구성 ---
+def iter_chunk_records(input_offset):
+    """청크 저장소를 input_offset행부터 읽어 (다음 행, 레코드) 반환 (커밋된 행까지만, 읽은 만큼만 디스크에서 올라옴)"""
+    store = RecordStore.load(CHUNK_STORE_PATH)
+    if store is not None:
+        yield from store.iter_records(input_offset)
+
+
+def reader_stage(records, out_q, stats, stop, name_email_map):
+    """(다음 위치, 청크 레코드)를 {"items": [(id, 본문, 메타)], "offset": 다음 위치} 배치로 전달
+
+    records는 iter_chunk_records(파일) 또는 scripts/run_pipeline.py의 청크 제너레이터.
+    읽는 김에 레코드의 name_email_map을 name_email_map에 모은다.
+    """
+    items, input_offset = [], None
+    started = time.perf_counter()
+    for input_offset, record in records:
+        items.append((make_doc_id(record), record['content'], build_metadata(record)))
+        name_email_map.update(record['metadata'].get('name_email_map') or {})
+        stats.docs += 1
+
+        if len(items) >= BATCH_SIZE:
+            stats.busy += time.perf_counter() - started
+            if not put_until_stopped(out_q, {"items": items, "offset": input_offset}, stop):
+                return
+            items = []
+            started = time.perf_counter()
+        if stop.is_set():
+            return
+
+    stats.busy += time.perf_counter() - started
+    # 마지막 배치(비어 있어도 최종 offset 커밋용으로 전달) 후 종료 신호
+    if put_until_stopped(out_q, {"items": items, "offset": input_offset}, stop):
+        put_until_stopped(out_q, None, stop)
+
+
+# --- 2단계: 길이 버킷 인코딩 ---
+def token_lengths(model, texts):
+    encoded = model.tokenizer(texts, add_special_tokens=True, truncation=True,
+                              max_length=model.max_seq_length, return_length=True)
+    return encoded["length"]
+
+
+def iter_length_buckets(lengths):
+    """긴 문서부터 정렬해 (최장 길이 × 배치 크기) <= TOKEN_BUDGET 이 되도록 배치 구성"""
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batch = []
+    for i in order:
+        # 정렬되어 있으므로 배치의 첫 문서가 최장 길이
+        longest = lengths[batch[0]] if batch else lengths[i]
+        if batch and ((len(batch) + 1) * longest > TOKEN_BUDGET or len(batch) >= MAX_ENCODE_BATCH):
+            yield batch
+            batch = []
+        batch.append(i)
+    if batch:
+        yield batch
+
+
+def encode_pool(model, cache, documents):
+    """캐시 미스 문서만 길이별 배치로 인코딩하고, 원래 순서의 임베딩 리스트 반환"""
+    embeddings, misses = cache.get_many(documents)
+    if not misses:
+        return embeddings
+
+    miss_documents = [documents[i] for i in misses]
+    lengths = token_lengths(model, miss_documents)
+    vectors = [None] * len(miss_documents)
+    for bucket in iter_length_buckets(lengths):
+        texts = [miss_documents[i] for i in bucket]
+        encoded = model.encode(texts, batch_size=len(texts), convert_to_numpy=True, show_progress_bar=False)
+        for i, vector in zip(bucket, encoded):
+            vectors[i] = np.asarray(vector, dtype=np.float32).tolist()
+
+    vectors = cache.put_many(miss_documents, vectors)  # 히트와 같은 float16 정밀도
+    for i, vector in zip(misses, vectors):
+        embeddings[i] = vector
+    return embeddings
+
+
+def encoder_stage(model, cache, in_q, out_q, stats, stop):
+    """ENCODE_POOL_SIZE만큼 모은 뒤 인코딩하고, 읽은 순서대로 BATCH_SIZE 단위로 writer에 전달"""
+    pool, offset, done = [], None, False
+    while not done:
+        batch = get_until_stopped(in_q, stop)
+        if stop.is_set():
+            return
+        if batch is None:
+            done = True
+        else:
+            pool.extend(batch["items"])
+            offset = batch["offset"]
+            if len(pool) < ENCODE_POOL_SIZE:
+                continue
+        if offset is None:
+            break
+
+        started = time.perf_counter()
+        embeddings = encode_pool(model, cache, [content for _, content, _ in pool]) if pool else []
+        stats.docs += len(pool)
+        stats.busy += time.perf_counter() - started
+
+        # 풀 전체를 인코딩한 뒤 읽은 순서대로 내보내므로, 풀의 offset은 마지막 조각에만 붙여 커밋
+        chunks = [(pool[i:i + BATCH_SIZE], embeddings[i:i + BATCH_SIZE]) for i in range(0, len(pool), BATCH_SIZE)]
+        chunks = chunks or [([], [])]
+        for n, (items, vectors) in enumerate(chunks):
+            chunk_offset = offset if n == len(chunks) - 1 else None
+            if not put_until_stopped(out_q, {"items": items, "embeddings": vectors, "offset": chunk_offset}, stop):
+                return
+        pool, offset = [], None
+
+    put_until_stopped(out_q, None, stop)
+
+
+# --- 3단계: Chroma upsert + 체크포인트 ---
+def writer_stage(collection, manifest, in_q, stats, stop, replace_parents):
+    """replace_parents면 첫 청크가 들어온 이메일의 기존 청크를 먼저 지움 (윈도우 수가 줄어든 변경 메일 대비)"""
+    while True:
+        batch = get_until_stopped(in_q, stop)
+        if batch is None:
+            return
+
+        started = time.perf_counter()
+        if batch["items"]:
+            # 같은 배치 안의 중복 ID는 마지막 레코드만 유지 (Chroma는 배치 내 중복 ID를 거부)
+            # 같은 이메일이 다시 시작되면(chunk_index 0) 앞선 버전의 청크는 모두 버림
+            unique, parents = {}, set()
+            for (doc_id, content, meta), vector in zip(batch["items"], batch["embeddings"]):
+                if meta["chunk_index"] == 0:
+                    if meta["parent_id"] in parents:
+                        unique = {i: v for i, v in unique.items() if v[1]["parent_id"] != meta["parent_id"]}
+                    parents.add(meta["parent_id"])
+                unique[doc_id] = (content, meta, vector)
+            if replace_parents and parents:
+                collection.delete(where={"parent_id": {"$in": sorted(parents)}})
+            ids = list(unique)
+            collection.upsert(
+                ids=ids,
+                documents=[unique[i][0] for i in ids],
+                metadatas=[unique[i][1] for i in ids],
+                embeddings=[unique[i][2] for i in ids],
+            )
+            stats.docs += len(batch["items"])
+            print(f"{stats.docs}개 문서 인덱싱 완료...")
+        # upsert가 끝난 뒤에만 위치를 커밋해 중단 시 이 지점부터 재개
+        if batch["offset"] is not None:
+            manifest["input_offset"] = batch["offset"]
+            save_manifest(STAGE, manifest)
+        stats.busy += time.perf_counter() - started
+
+
+def run_stage(target, stop, errors, *args):
+    """단계 실행 래퍼: 예외가 나면 기록하고 다른 단계도 멈추게 함"""
+    try:
+        target(*args)
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+
+
+def open_collection(full_rebuild):
     print(f"ChromaDB 클라이언트 연결 및 컬렉션 '{COLLECTION_NAME}' 초기화...")
     client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
 
-    # 기존 컬렉션 삭제 후 재생성
-    try:
-        client.delete_collection(name=COLLECTION_NAME)
-    except:
-        pass
+    # 전체 재생성일 때만 기존 컬렉션 삭제, 아니면 새 청크만 upsert
+    if full_rebuild:
+        try:
+            client.delete_collection(name=COLLECTION_NAME)
+        except:
+            pass
 
-    collection = client.get_or_create_collection(
+    # 임베딩은 항상 직접 계산해 전달하므로 컬렉션에는 임베딩 함수를 연결하지 않음
+    return client.get_or_create_collection(
         name=COLLECTION_NAME,
-        embedding_function=embedding_function,
         metadata={"hnsw:space": "cosine"}  # 코사인 유사도 사용
     )
 
-    documents, metadatas, ids = [], [], []
-    counter = 0
 
-    print(f"🚀 JSONL 파일 '{JSONL_PATH}' 로딩 중...")
-    with open(JSONL_PATH, 'r', encoding='utf-8') as f:
-        for line in f:
-            if not line.strip():
-                continue
+def index_records(records, model, cache, collection, manifest, replace_parents):
+    """(다음 위치, 청크 레코드) 스트림을 읽기/인코딩/쓰기 단계로 겹쳐 실행해 컬렉션에 upsert
 
-            try:
-                record = json.loads(line)
-            except json.JSONDecodeError as e:
-                print(f"JSON 디코딩 오류: {e} - 건너뜀")
-                continue
+    → (단계별 StageStats, 모은 name_email_map, 소요 시간)
+    """
+    read_q, write_q = queue.Queue(maxsize=QUEUE_SIZE), queue.Queue(maxsize=QUEUE_SIZE)
+    stop, errors = threading.Event(), []
+    stats = {name: StageStats(name) for name in ("read", "encode", "write")}
+    name_email_map = {}
+    started = time.perf_counter()
+
+    # 인코딩은 메인 스레드에서, 읽기/쓰기는 별도 스레드에서 겹쳐 실행
+    threads = [
+        threading.Thread(target=run_stage, daemon=True,
+                         args=(reader_stage, stop, errors, records, read_q, stats["read"], stop, name_email_map)),
+        threading.Thread(target=run_stage, daemon=True,
+                         args=(writer_stage, stop, errors, collection, manifest, write_q, stats["write"], stop,
+                               replace_parents)),
+    ]
+    for t in threads:
+        t.start()
+    run_stage(encoder_stage, stop, errors, model, cache, read_q, write_q, stats["encode"], stop)
+    for t in threads:
+        t.join()
+    # 임베딩 캐시 인덱스는 끝에서 한 번만 저장 (실패해도 그때까지 인코딩한 벡터는 남김)
+    # 제거된 슬롯을 덮어쓰기 전의 저장은 put_many가 따로 하므로 중간에 멈춰도 캐시는 일관됨
+    cache.save()
+    if errors:
+        raise errors[0]
+    return stats, name_email_map, time.perf_counter() - started
+
+
+def build_chroma_db():
+    # FULL_REBUILD=1 이거나 청크 단계가 전체 재생성되면 컬렉션을 삭제하고 처음부터 재생성
+    manifest, full_rebuild = resume_state(STAGE, UPSTREAM_STAGE, CHUNK_STORE_PATH, params())
+    model = load_embedding_model()
+    cache = EmbeddingCache(EMBEDDING_CACHE_DIR, EMBEDDING_MODEL, EMBEDDING_CACHE_MAX_ENTRIES)
+    collection = open_collection(full_rebuild)
 
-            doc_id = f"email_{counter}_{record['metadata']['message_id']}"
-            meta = {
-                "thread_id": record['metadata'].get('thread_id', 'N/A'),
-                "date": record['metadata'].get('date'),
-                "sender": record['metadata'].get('from', [''])[0],
-                "recipients": ", ".join(record['metadata'].get('to', [])),
-                "subject_preview": record['content'].split('\n')[0][:100] + "...",
-            }
-
-            documents.append(record['content'])
-            metadatas.append(meta)
-            ids.append(doc_id)
-            counter += 1
-
-            if len(documents) >= BATCH_SIZE:
-                print(f"{counter}개 문서 인덱싱 중...")
-                collection.add(documents=documents, metadatas=metadatas, ids=ids)
-                documents, metadatas, ids = [], [], []
-
-    if documents:
-        print(f"마지막 {len(documents)}개 문서 인덱싱 중...")
-        collection.add(documents=documents, metadatas=metadatas, ids=ids)
+    print(f"🚀 청크 저장소 '{CHUNK_STORE_PATH}' 로딩 중... ({manifest['input_offset']}행부터)")
+    stats, name_email_map, elapsed = index_records(
+        iter_chunk_records(manifest["input_offset"]), model, cache, collection, manifest, not full_rebuild)
 
     total = collection.count()
-    print(f"인덱싱 완료! 총 {total}개의 문서가 저장되었습니다.")
+    print(f"인덱싱 완료! 이번 실행 {stats['write'].docs}개 upsert, 총 {total}개의 문서가 저장되었습니다.")
+    print(f"단계별 처리 속도 (전체 {elapsed:.1f}초):")
+    for stage_stats in stats.values():
+        print(stage_stats.report())
+    print(cache.report())
+    print(f"알려진 발신자 {save_known_senders(name_email_map, full_rebuild)}명 → '{KNOWN_SENDERS_PATH}'")
+
+    # BM25 인덱스는 임베딩 없이 토큰화만 하므로 매번 전체 청크로 다시 만들어 Chroma와 맞춤
+    bm25_started = time.perf_counter()
+    bm25_docs = build_bm25_index(CHUNK_STORE_PATH, BM25_INDEX_DIR, make_doc_id, make_parent_id, filter_fields)
+    print(f"BM25 인덱스 {bm25_docs}개 문서 ({time.perf_counter() - bm25_started:.1f}초) → '{BM25_INDEX_DIR}'")
+
+    save_report(manifest, collection, stats, elapsed)
+
 
+def save_report(manifest, collection, stats, elapsed):
+    """청크 설정(CHUNK_MAX_CHARS)을 바꿔 가며 비교할 수 있도록 인덱스 크기와 임베딩 시간 기록"""
+    report = {
+        "chunks": collection.count(),
+        "chroma_bytes": directory_size(CHROMA_DB_PATH),
+        "encoded_docs": stats["encode"].docs,
+        "encode_seconds": round(stats["encode"].busy, 2),
+        "total_seconds": round(elapsed, 2),
+    }
+    manifest["report"] = report
+    save_manifest(STAGE, manifest)
+    print(f"인덱스 크기: 청크 {report['chunks']}개, Chroma {report['chroma_bytes'] / 1e6:.1f}MB · "
+          f"임베딩 {report['encoded_docs']}개 {report['encode_seconds']:.1f}초")
 
 if __name__ == "__main__":
-    build_chroma_db()
\ No newline at end of file
+    build_chroma_db()
@@ -0,0 +1,176 @@
+"""토큰 예산 안에서 검색된 이메일로 프롬프트 context를 구성
+
+1. 같은 스레드의 거의 같은 청크(인용 반복 등)는 순위가 높은 것 하나만 남김
+2. 긴 이메일은 질문과 가장 비슷한 문단/문장만 남기도록 잘라냄
+3. 검색 순위 점수 순으로 예산이 찰 때까지 탐욕적으로 채움
+"""
+import math
+import re
+
+import numpy as np
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")  # GPT-4o 토크나이저
+except Exception:  # tiktoken이 없거나 인코딩 파일을 받을 수 없으면 길이로 추정
+    _ENCODING = None
+
+DEDUP_THRESHOLD = 0.85      # 같은 스레드에서 단어 3-gram Jaccard 유사도가 이 이상이면 중복
+MAX_PASSAGE_TOKENS = 200    # 이보다 긴 문단은 문장 단위로 나눔
+GAP_MARKER = "[...]"
+
+PARAGRAPH_SPLIT = re.compile(r"\n\s*\n")
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?。])\s+|\n")
+WORD = re.compile(r"\w+")
+
+
+def count_tokens(text):
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 3)
+
+
+# --- 1. 같은 스레드 중복 제거 ---
+def shingles(text, n=3):
+    words = WORD.findall(text.lower())
+    return {tuple(words[i:i + n]) for i in range(max(len(words) - n + 1, 1))}
+
+
+def dedupe_thread_duplicates(docs):
+    """같은 thread_id 안에서 거의 같은 청크 제거 (앞선 = 순위 높은 문서 유지) → (남은 문서, 제거 수)"""
+    kept, kept_shingles = [], []
+    removed = 0
+    for doc in docs:
+        thread_id = doc.metadata.get("thread_id")
+        doc_shingles = shingles(doc.page_content)
+        duplicate = False
+        if thread_id and thread_id != "N/A":
+            for other, other_shingles in zip(kept, kept_shingles):
+                if other.metadata.get("thread_id") != thread_id:
+                    continue
+                union = len(doc_shingles | other_shingles)
+                if union and len(doc_shingles & other_shingles) / union >= DEDUP_THRESHOLD:
+                    duplicate = True
+                    break
+        if duplicate:
+            removed += 1
+        else:
+            kept.append(doc)
+            kept_shingles.append(doc_shingles)
+    return kept, removed
+
+
+# --- 2. 질문과 비슷한 문단만 남기기 ---
+def split_passages(text):
+    passages = []
+    for paragraph in PARAGRAPH_SPLIT.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if count_tokens(paragraph) <= MAX_PASSAGE_TOKENS:
+            passages.append(paragraph)
+        else:
+            passages.extend(s.strip() for s in SENTENCE_SPLIT.split(paragraph) if s.strip())
+    return passages
+
+
+def trim_to_budget(passages, scores, budget):
+    """점수 높은 문단부터 budget까지 고른 뒤 원래 순서로 이어 붙임 (건너뛴 부분은 [...])"""
+    chosen, used = [], 0
+    for i in np.argsort(-np.asarray(scores)):
+        tokens = count_tokens(passages[i]) + 1
+        if used + tokens > budget:
+            continue
+        chosen.append(int(i))
+        used += tokens
+    if not chosen:
+        return ""
+    chosen.sort()
+    parts, previous = [], -1
+    for i in chosen:
+        if i != previous + 1:
+            parts.append(GAP_MARKER)
+        parts.append(passages[i])
+        previous = i
+    if previous != len(passages) - 1:
+        parts.append(GAP_MARKER)
+    return "\n".join(parts)
+
+
+def passage_scores(query_embedding, passages, embed_documents):
+    """질문 임베딩과 문단 임베딩의 코사인 유사도"""
+    vectors = np.asarray(embed_documents(passages), dtype=np.float32)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(query) or 1.0)
+    return (vectors @ query) / np.where(norms == 0, 1.0, norms)
+
+
+# --- 3. 예산 안에서 채우기 ---
+def format_header(i, meta, sender):
+    # 인덱스 메타데이터는 쉼표로 이은 문자열 (이전 형식의 리스트도 허용)
+    attachments = meta.get('attachments') or []
+    if isinstance(attachments, list):
+        attachments = ', '.join(attachments)
+    return (
+        f"[EMAIL {i}] 📅 DATE: {meta.get('date', 'Unknown')} | 👤 FROM: {sender} | "
+        f"👥 TO: {meta.get('recipients', 'Unknown')} | "
+        f"📎 ATTACHMENTS: {attachments or 'None'}"
+        + (f" | 🧵 THREAD {meta['thread_position']}" if meta.get("thread_position") else "")
+        + "\n"
+    )
+
+
+def pack_context(docs, query_embedding, embed_documents, sender_label, budget, max_email_tokens):
+    """→ (context 문자열, 사용된 문서, 통계)
+
+    docs는 검색 순위 순서. 각 이메일은 max_email_tokens를 넘으면 질문과 비슷한 문단만 남기고,
+    남은 예산보다 길면 남은 예산에 맞춰 한 번 더 자른다.
+    """
+    docs, duplicates = dedupe_thread_duplicates(docs)
+
+    # 잘라야 하는 긴 이메일의 문단만 한 번에 임베딩
+    passages = {}
+    for n, doc in enumerate(docs):
+        if count_tokens(doc.page_content) > max_email_tokens:
+            passages[n] = split_passages(doc.page_content)
+    scores = {}
+    if passages and query_embedding is not None:
+        flat = [p for n in passages for p in passages[n]]
+        flat_scores = passage_scores(query_embedding, flat, embed_documents) if flat else []
+        start = 0
+        for n in passages:
+            scores[n] = flat_scores[start:start + len(passages[n])]
+            start += len(passages[n])
+
+    blocks, used_docs, used_tokens, trimmed = [], [], 0, 0
+    for n, doc in enumerate(docs):
+        header = format_header(len(used_docs) + 1, doc.metadata, sender_label(doc.metadata))
+        remaining = budget - used_tokens - count_tokens(header)
+        if remaining <= 0:
+            break
+        content = doc.page_content
+        limit = min(max_email_tokens, remaining)
+        if count_tokens(content) > limit:
+            doc_passages = passages.get(n) or split_passages(content)
+            # 임베딩 점수가 없으면 앞부분부터 유지
+            doc_scores = scores.get(n)
+            if doc_scores is None or len(doc_scores) != len(doc_passages):
+                doc_scores = -np.arange(len(doc_passages), dtype=np.float32)
+            content = trim_to_budget(doc_passages, doc_scores, limit)
+            trimmed += 1
+            if not content:
+                continue
+        block = header + content
+        blocks.append(block)
+        used_docs.append(doc)
+        used_tokens += count_tokens(block) + 1
+
+    stats = {
+        "context_tokens": used_tokens,
+        "budget": budget,
+        "emails_used": len(used_docs),
+        "emails_retrieved": len(docs) + duplicates,
+        "duplicates_removed": duplicates,
+        "emails_trimmed": trimmed,
+    }
+    return "\n\n".join(blocks), used_docs, stats
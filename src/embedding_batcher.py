@@ -0,0 +1,115 @@
+"""동시에 들어온 질문 임베딩을 모아 한 번의 인코더 호출로 처리하는 마이크로 배처 (최근 질문 LRU 캐시 포함)
+
+요청마다 embed_query를 따로 부르면 짧은 forward pass가 모델 앞에서 줄을 선다.
+submit()은 질문을 큐에 넣고 Future를 돌려주며, 백그라운드 스레드가 첫 질문이 도착한 뒤
+max_wait초 동안(또는 max_batch개가 찰 때까지) 모은 질문을 embed_documents 한 번으로 임베딩해 나눠 준다.
+최근 cache_size개 질문의 임베딩은 캐시에서 바로 돌려주고, 한 배치 안의 같은 질문은 한 번만 임베딩한다.
+
+RagResources.query_embedder로 Streamlit 앱, rag_chat.py, rag_api.py가 함께 사용한다.
+"""
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class EmbeddingBatcher:
+    def __init__(self, embedding_model, max_batch, max_wait, cache_size=0):
+        self.embedding_model = embedding_model
+        self.max_batch = max_batch
+        self.max_wait = max_wait  # 첫 질문 이후 배치를 더 모으는 최대 시간 (초), 0이면 이미 쌓인 것만
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # 질문 → 임베딩 (LRU)
+        self.lock = threading.Lock()
+        self.requests = queue.Queue()
+        self.stats = {"requests": 0, "cache_hits": 0, "queries": 0, "batches": 0, "max_batch": 0,
+                      "encode_seconds": 0.0}
+        self.closed = False
+        self.worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self.worker.start()
+
+    def submit(self, text):
+        """질문 하나 → 임베딩 Future (캐시에 있으면 이미 완료된 Future, asyncio에서는 asyncio.wrap_future로 기다림)"""
+        if self.closed:
+            raise RuntimeError("EmbeddingBatcher가 이미 종료됨")
+        future = Future()
+        with self.lock:
+            self.stats["requests"] += 1
+            vector = self.cache.get(text)
+            if vector is not None:
+                self.cache.move_to_end(text)
+                self.stats["cache_hits"] += 1
+        if vector is not None:
+            future.set_result(vector)
+        else:
+            self.requests.put((text, future))
+        return future
+
+    def embed_query(self, text):
+        """embedding_model.embed_query와 같은 인터페이스 (동기 호출자용)"""
+        return self.submit(text).result()
+
+    def _collect(self):
+        """첫 요청을 기다린 뒤 deadline까지 도착한 요청을 최대 max_batch개 모음 (종료 신호면 None)"""
+        first = self.requests.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.requests.put(None)  # 지금 배치를 처리한 뒤 종료
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            started = time.perf_counter()
+            try:
+                vectors = dict(zip(texts, self.embedding_model.embed_documents(texts)))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            with self.lock:
+                self.stats["encode_seconds"] += time.perf_counter() - started
+                self.stats["queries"] += len(texts)
+                self.stats["batches"] += 1
+                self.stats["max_batch"] = max(self.stats["max_batch"], len(texts))
+                if self.cache_size:
+                    self.cache.update(vectors)
+                    for text in texts:
+                        self.cache.move_to_end(text)
+                    while len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+            for text, future in batch:
+                future.set_result(vectors[text])
+
+    def mean_batch(self):
+        """인코더 호출 한 번에 임베딩한 평균 질문 수"""
+        return self.stats["queries"] / self.stats["batches"] if self.stats["batches"] else 0.0
+
+    def cache_hit_rate(self):
+        return self.stats["cache_hits"] / self.stats["requests"] if self.stats["requests"] else 0.0
+
+    def close(self):
+        """큐에 남은 요청을 처리한 뒤 워커 스레드 종료"""
+        if self.closed:
+            return
+        self.closed = True
+        self.requests.put(None)
+        self.worker.join(timeout=5)
@@ -0,0 +1,160 @@
+"""(모델명, 정규화된 본문 해시) 기반 디스크 임베딩 캐시
+
+벡터는 float16 memmap 행렬(vectors.f16)에, 키와 마지막 사용 시점은 작은 인덱스 파일(index.npz)에 저장한다.
+캐시 용량(max_entries)을 넘으면 가장 오래 사용되지 않은 항목부터 묶음으로 제거한다.
+캐시 상태와 상관없이 같은 본문이 같은 벡터를 갖도록 미스 벡터도 put_many에서 float16으로 반올림해 돌려준다.
+"""
+import hashlib
+import json
+import os
+import re
+import unicodedata
+
+import numpy as np
+
+KEY_BYTES = 16
+EVICT_FRACTION = 0.05  # 가득 찼을 때 한 번에 비우는 비율
+
+
+def normalize_text(text):
+    """공백/유니코드 차이만 있는 본문이 같은 키를 갖도록 정규화"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir, model_name, max_entries):
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.dim = None
+        self.vectors = None
+        self.keys = None
+        self.last_used = None
+        self.index = {}
+        self.free_slots = []
+        self.clock = 0
+        self._load()
+
+    # --- 파일 경로 ---
+    @property
+    def meta_path(self):
+        return os.path.join(self.cache_dir, "meta.json")
+
+    @property
+    def index_path(self):
+        return os.path.join(self.cache_dir, "index.npz")
+
+    @property
+    def vectors_path(self):
+        return os.path.join(self.cache_dir, "vectors.f16")
+
+    def _load(self):
+        if not os.path.exists(self.meta_path) or not os.path.exists(self.index_path):
+            return
+        with open(self.meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        # 모델/용량이 바뀌었으면 기존 캐시는 버림
+        if meta.get("model_name") != self.model_name or meta.get("max_entries") != self.max_entries:
+            print(f"임베딩 캐시 설정 변경 감지 - '{self.cache_dir}' 캐시를 새로 만듭니다.")
+            return
+        self._allocate(meta["dim"], mode="r+")
+        data = np.load(self.index_path)
+        self.keys[:] = data["keys"]
+        self.last_used[:] = data["last_used"]
+        self.clock = int(self.last_used.max(initial=0))
+        used = np.flatnonzero(self.last_used)
+        self.index = {self.keys[slot].tobytes(): int(slot) for slot in used}
+        self.free_slots = np.flatnonzero(self.last_used == 0)[::-1].tolist()
+
+    def _allocate(self, dim, mode):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.dim = dim
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float16, mode=mode, shape=(self.max_entries, dim))
+        self.keys = np.zeros((self.max_entries, KEY_BYTES), dtype=np.uint8)
+        self.last_used = np.zeros(self.max_entries, dtype=np.int64)  # 0 = 빈 슬롯
+        self.index = {}
+        self.free_slots = list(range(self.max_entries - 1, -1, -1))
+
+    def make_key(self, text):
+        data = f"{self.model_name}\0{normalize_text(text)}".encode("utf-8")
+        return hashlib.blake2b(data, digest_size=KEY_BYTES).digest()
+
+    def get_many(self, texts):
+        """캐시된 벡터 리스트(없으면 None)와 미스 위치 리스트 반환"""
+        self.clock += 1
+        results, misses = [], []
+        for i, text in enumerate(texts):
+            slot = self.index.get(self.make_key(text))
+            if slot is None:
+                results.append(None)
+                misses.append(i)
+            else:
+                self.last_used[slot] = self.clock
+                results.append(self.vectors[slot].astype(np.float32).tolist())
+        self.hits += len(texts) - len(misses)
+        self.misses += len(misses)
+        return results, misses
+
+    def put_many(self, texts, vectors):
+        """벡터를 캐시에 저장하고, 캐시 히트와 같은 float16 정밀도로 반올림한 벡터 리스트 반환"""
+        if not texts:
+            return []
+        vectors = np.asarray(vectors, dtype=np.float32).astype(np.float16).astype(np.float32)
+        if self.vectors is None:
+            self._allocate(vectors.shape[1], mode="w+")
+
+        keys = [self.make_key(text) for text in texts]
+        new_keys = [key for key in dict.fromkeys(keys) if key not in self.index]
+        if len(new_keys) > len(self.free_slots):
+            self._evict(len(new_keys) - len(self.free_slots))
+            # 제거된 슬롯을 덮어쓰기 전에 인덱스부터 저장 (중단 시 잘못된 벡터를 가리키지 않도록)
+            self.save()
+
+        self.clock += 1
+        for key, vector in zip(keys, vectors):
+            slot = self.index.get(key)
+            if slot is None:
+                if not self.free_slots:
+                    break
+                slot = self.free_slots.pop()
+                self.index[key] = slot
+                self.keys[slot] = np.frombuffer(key, dtype=np.uint8)
+            self.vectors[slot] = vector
+            self.last_used[slot] = self.clock
+        return vectors.tolist()
+
+    def _evict(self, needed):
+        count = min(self.max_entries, max(needed, int(self.max_entries * EVICT_FRACTION)))
+        used = np.flatnonzero(self.last_used)
+        if len(used) == 0:
+            return
+        count = min(count, len(used))
+        oldest = used[np.argpartition(self.last_used[used], count - 1)[:count]]
+        for slot in oldest.tolist():
+            del self.index[self.keys[slot].tobytes()]
+            self.last_used[slot] = 0
+            self.free_slots.append(slot)
+        self.evictions += count
+
+    def save(self):
+        """벡터를 먼저 디스크에 반영한 뒤 인덱스와 메타데이터를 원자적으로 교체"""
+        if self.vectors is None:
+            return
+        self.vectors.flush()
+        tmp_index = self.index_path + ".tmp.npz"
+        np.savez(tmp_index, keys=self.keys, last_used=self.last_used)
+        os.replace(tmp_index, self.index_path)
+        tmp_meta = self.meta_path + ".tmp"
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump({"model_name": self.model_name, "dim": self.dim, "max_entries": self.max_entries}, f)
+        os.replace(tmp_meta, self.meta_path)
+
+    def report(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0.0
+        return (f"임베딩 캐시: 히트 {self.hits}개, 미스 {self.misses}개 (히트율 {hit_rate:.1f}%), "
+                f"제거 {self.evictions}개, 저장 항목 {len(self.index)}/{self.max_entries}")
@@ -0,0 +1,332 @@
+"""질문에서 검색 필터(날짜/발신자/키워드) 추출
+
+규칙 기반 파서(fast path)로 날짜·월·연도와 알려진 발신자 이름을 먼저 찾고,
+파서가 확신하지 못하는 질문(상대 날짜, 모르는 사람 이름 등)만 LLM으로 보낸다.
+결과는 정규화된 질문 단위로 메모이즈한다.
+"""
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from tracing import NULL_SPAN, traced
+
+KNOWN_SENDERS_PATH = "../data/known_senders.json"  # build_chromaDB.py가 name_email_map으로 생성
+MEMO_SIZE = 1024
+
+FILTER_FIELDS = ("date_exact", "date_month", "date_year", "sender_name")
+
+MONTHS = {
+    "january": 1, "jan": 1, "february": 2, "feb": 2, "march": 3, "mar": 3, "april": 4, "apr": 4,
+    "may": 5, "june": 6, "jun": 6, "july": 7, "jul": 7, "august": 8, "aug": 8,
+    "september": 9, "sep": 9, "sept": 9, "october": 10, "oct": 10, "november": 11, "nov": 11,
+    "december": 12, "dec": 12,
+}
+_MONTH = r"(" + "|".join(sorted(MONTHS, key=len, reverse=True)) + r")\.?"
+_YEAR = r"((?:19|20)\d{2})"
+_DAY = r"(\d{1,2})(?:st|nd|rd|th)?"
+
+# 구체적인 패턴부터 순서대로 검사
+DATE_EXACT_PATTERNS = [
+    (re.compile(r"\b" + _YEAR + r"[-/.](\d{1,2})[-/.](\d{1,2})\b"), ("y", "m", "d")),
+    (re.compile(_YEAR + r"\s*년\s*(\d{1,2})\s*월\s*(\d{1,2})\s*일"), ("y", "m", "d")),
+    (re.compile(r"\b" + _MONTH + r"\s+" + _DAY + r",?\s+" + _YEAR + r"\b", re.I), ("mn", "d", "y")),
+    (re.compile(r"\b" + _DAY + r"\s+(?:of\s+)?" + _MONTH + r",?\s+" + _YEAR + r"\b", re.I), ("d", "mn", "y")),
+]
+DATE_MONTH_PATTERNS = [
+    (re.compile(r"\b" + _YEAR + r"-(\d{1,2})\b(?![-/.]\d)"), ("y", "m")),
+    (re.compile(_YEAR + r"\s*년\s*(\d{1,2})\s*월"), ("y", "m")),
+    (re.compile(r"\b" + _MONTH + r",?\s+(?:of\s+)?" + _YEAR + r"\b", re.I), ("mn", "y")),
+]
+DATE_YEAR_PATTERNS = [
+    re.compile(_YEAR + r"\s*년"),
+    re.compile(r"\b" + _YEAR + r"\b"),
+]
+
+# 규칙으로 풀 수 없는 시간 표현 → LLM으로 넘김
+AMBIGUOUS_TIME = re.compile(
+    r"\b(today|yesterday|tomorrow|tonight|ago|q[1-4]|"
+    r"(last|past|previous|next|this|coming)\s+(\d+\s+)?(days?|weeks?|weekend|months?|years?|quarter|"
+    r"monday|tuesday|wednesday|thursday|friday|saturday|sunday))\b|어제|오늘|지난\s*주|지난\s*달|이번\s*주|이번\s*달|작년|올해",
+    re.I,
+)
+# 연도 없는 월 이름 (May는 일반 단어라 제외)
+MONTH_WITHOUT_YEAR = re.compile(r"\b(January|February|March|April|June|July|August|September|October|"
+                                r"November|December|Jan|Feb|Mar|Apr|Jun|Jul|Aug|Sept?|Oct|Nov|Dec)\b")
+NUMERIC_DATE_WITHOUT_YEAR = re.compile(r"\b\d{1,2}[/.]\d{1,2}\b(?![/.]\d)|\d{1,2}\s*월")
+
+# 사람을 가리키는 표현 (알려진 이름으로 해결되지 않으면 LLM으로 넘김)
+PERSON_REFERENCE = re.compile(
+    r"\b(?:from|by|did|does|sent by|wrote|said|says|ask(?:ed)?|tell|told|reply from|cc)\s+"
+    r"([A-Z][a-zA-Z\-]+(?:\s+[A-Z][a-zA-Z\-]+)*)"
+    r"|\b([A-Z][a-z][a-zA-Z\-]*)'s\b"
+)
+EMAIL_ADDRESS = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "in", "on", "at", "to", "for", "from", "by", "with", "about",
+    "what", "which", "who", "whom", "when", "where", "why", "how", "is", "are", "was", "were", "be",
+    "been", "do", "does", "did", "have", "has", "had", "any", "all", "there", "their", "it", "its",
+    "this", "that", "these", "those", "me", "my", "i", "we", "our", "you", "your", "he", "she", "they",
+    "say", "said", "says", "tell", "show", "find", "list", "give", "email", "emails", "mail", "mails",
+    "message", "messages", "sent", "send", "about", "regarding", "please", "can", "could", "would",
+    "should", "will", "status", "summary", "summarize", "happened", "happen",
+}
+WORD = re.compile(r"[A-Za-z0-9][A-Za-z0-9_\-./]*[A-Za-z0-9]|[A-Za-z0-9]|[가-힣]{2,}")
+
+
+# =====================
+# LLM Fallback
+# =====================
+filter_prompt = ChatPromptTemplate.from_messages([
+    ("system",
+     "You are a query analyzer. Extract search filters from the user's question.\n"
+     "Return ONLY a valid JSON object with these fields (use null if not found):\n"
+     "{{\n"
+     '  "date_exact": "YYYY-MM-DD" or null,\n'
+     '  "date_month": "YYYY-MM" or null,\n'
+     '  "date_year": "YYYY" or null,\n'
+     '  "sender_name": "name" or null,\n'
+     '  "keywords": ["keyword1", "keyword2"] or []\n'
+     "}}\n\n"
+     "Examples:\n"
+     'Q: "What happened on January 31, 2021?" → {{"date_exact": "2021-01-31", ...}}\n'
+     'Q: "Emails in July 2021" → {{"date_month": "2021-07", ...}}\n'
+     'Q: "What did Alex Martin say?" → {{"sender_name": "Alex Martin", ...}}\n'
+     'Q: "ANB reports" → {{"keywords": ["ANB", "report"], ...}}\n'),
+    ("human", "Question: {question}\n\nReturn JSON only:")
+])
+
+
+def extract_query_filters(query: str, llm) -> dict:
+    """LLM으로 쿼리에서 필터 조건 추출"""
+    try:
+        chain = filter_prompt | llm | JsonOutputParser()
+        filters = chain.invoke({"question": query})
+        return filters
+    except:
+        return {}
+
+
+# =====================
+# Rule-based Fast Path
+# =====================
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query.strip().lower()).rstrip("?!. ")
+
+
+def normalize_name(name: str) -> str:
+    """'"MARTIN Alex (ITER)"' → 'martin alex'"""
+    name = re.sub(r"[\(\[].*?[\)\]]", " ", name)
+    name = re.sub(r"[\"',]", " ", name)
+    return re.sub(r"\s+", " ", name).strip().lower()
+
+
+def load_known_senders(path=KNOWN_SENDERS_PATH) -> dict:
+    """이름 → 이메일 주소 맵 (파일이 없으면 빈 맵)"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _valid_date(y, m, d=1):
+    try:
+        date(int(y), int(m), int(d))
+        return True
+    except ValueError:
+        return False
+
+
+def _date_parts(match, roles):
+    parts = {}
+    for role, value in zip(roles, match.groups()):
+        if role == "mn":
+            parts["m"] = MONTHS[value.lower().rstrip(".")]
+        else:
+            parts[role] = int(value)
+    return parts
+
+
+def parse_dates(query: str):
+    """(필터 dict, 매칭된 구간 리스트) - 가장 구체적인 날짜 하나만 사용"""
+    for pattern, roles in DATE_EXACT_PATTERNS:
+        match = pattern.search(query)
+        if match:
+            p = _date_parts(match, roles)
+            if _valid_date(p["y"], p["m"], p["d"]):
+                return {"date_exact": f"{p['y']:04d}-{p['m']:02d}-{p['d']:02d}"}, [match.span()]
+    for pattern, roles in DATE_MONTH_PATTERNS:
+        match = pattern.search(query)
+        if match:
+            p = _date_parts(match, roles)
+            if _valid_date(p["y"], p["m"]):
+                return {"date_month": f"{p['y']:04d}-{p['m']:02d}"}, [match.span()]
+    for pattern in DATE_YEAR_PATTERNS:
+        match = pattern.search(query)
+        if match:
+            return {"date_year": match.group(1)}, [match.span()]
+    return {}, []
+
+
+class SenderMatcher:
+    """알려진 발신자 이름을 질문에서 찾는 정규식 (성/이름 순서가 바뀐 표기도 매칭)"""
+
+    def __init__(self, known_senders: dict):
+        self.names = {}
+        # 정규화된 이름 → 주소 목록 (같은 사람이 여러 주소를 쓰는 경우 포함)
+        self.addresses = {}
+        # 이름의 첫/마지막 단어 → 정규화된 전체 이름 (LLM이 "Alex"처럼 이름 일부만 돌려준 경우)
+        self.name_tokens = {}
+        for name, email in known_senders.items():
+            if isinstance(email, str):
+                self.addresses.setdefault(normalize_name(name), set()).add(email.strip().lower())
+            normalized = normalize_name(name)
+            tokens = normalized.split()
+            # 한 단어 이름은 오탐이 많아 제외
+            if len(tokens) < 2 or "@" in normalized:
+                continue
+            for token in (tokens[0], tokens[-1]):
+                self.name_tokens.setdefault(token, set()).add(normalized)
+            display_name = name.strip(" \"'")
+            self.names.setdefault(normalized, display_name)
+            self.names.setdefault(" ".join(reversed(tokens)), display_name)
+        self.emails = {
+            email.lower(): name.strip(" \"'")
+            for name, email in known_senders.items() if isinstance(email, str)
+        }
+        alternatives = sorted(self.names, key=len, reverse=True)
+        self.pattern = (
+            re.compile(r"\b(" + "|".join(re.escape(n) for n in alternatives) + r")\b")
+            if alternatives else None
+        )
+
+    def resolve(self, sender_name: str):
+        """필터의 발신자 값 → (정규화 이름 후보, 발신 주소 후보) - Chroma $in 필터용
+
+        한 단어 값은 그 단어가 이름의 첫/마지막 단어인 알려진 발신자 전체 이름으로 넓힌다.
+        """
+        value = sender_name.strip().lower()
+        if "@" in value:
+            return [], [value]
+        normalized = normalize_name(value)
+        names = [normalized, " ".join(reversed(normalized.split()))]
+        if len(normalized.split()) == 1:
+            names += sorted(self.name_tokens.get(normalized, ()))
+        names = list(dict.fromkeys(names))
+        addresses = sorted(set().union(*(self.addresses.get(n, set()) for n in names)))
+        return names, addresses
+
+    def find(self, query_lower: str):
+        """(표시 이름, 매칭 구간) 또는 (None, None)"""
+        match = EMAIL_ADDRESS.search(query_lower)
+        if match and match.group(0) in self.emails:
+            return self.emails[match.group(0)], match.span()
+        if self.pattern is not None:
+            match = self.pattern.search(query_lower)
+            if match:
+                return self.names[match.group(1)], match.span()
+        return None, None
+
+
+def parse_query_filters(query: str, sender_matcher: SenderMatcher):
+    """규칙 기반 필터 추출 → (filters, confident)"""
+    filters = {field: None for field in FILTER_FIELDS}
+    confident = True
+
+    date_filters, spans = parse_dates(query)
+    filters.update(date_filters)
+    if not date_filters and (MONTH_WITHOUT_YEAR.search(query) or NUMERIC_DATE_WITHOUT_YEAR.search(query)):
+        confident = False
+    if AMBIGUOUS_TIME.search(query):
+        confident = False
+
+    query_lower = query.lower()
+    sender, span = sender_matcher.find(query_lower)
+    if sender:
+        filters["sender_name"] = sender
+        spans.append(span)
+    else:
+        for match in PERSON_REFERENCE.finditer(query):
+            name = match.group(1) or match.group(2)
+            # 약어(ANB, VV 등)나 월 이름은 사람 이름이 아님
+            if name and not name.isupper() and name.lower() not in MONTHS:
+                confident = False
+                break
+
+    # 날짜/발신자 구간을 제외한 나머지 단어를 키워드로 사용
+    remaining = query
+    for start, end in sorted(spans, reverse=True):
+        remaining = remaining[:start] + " " + remaining[end:]
+    filters["keywords"] = [
+        word for word in WORD.findall(remaining)
+        if word.lower() not in STOPWORDS and not word.isdigit()
+    ]
+    return filters, confident
+
+
+class QueryFilterExtractor:
+    """fast path → (필요 시) LLM 순으로 필터를 추출하고 결과를 메모이즈"""
+
+    def __init__(self, llm, known_senders=None):
+        self.llm = llm
+        self.sender_matcher = SenderMatcher(known_senders if known_senders is not None else load_known_senders())
+        self.memo = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"queries": 0, "memo_hits": 0, "fast_path": 0, "llm": 0}
+
+    def extract(self, query: str, trace=None, before_llm=None) -> dict:
+        """trace가 있으면 감싸고 있는 span에 source(memo/fast_path/llm)를 남기고, LLM 호출은 하위 span으로 기록
+
+        before_llm은 LLM을 부르기 직전에만 호출된다 (예: LLM 왕복 동안 추측 검색 시작).
+        """
+        key = normalize_query(query)
+        span = trace.current() if trace is not None else NULL_SPAN
+        with self.lock:
+            self.stats["queries"] += 1
+            if key in self.memo:
+                self.memo.move_to_end(key)
+                self.stats["memo_hits"] += 1
+                span.set(source="memo")
+                return self._copy(self.memo[key])
+
+        filters, confident = parse_query_filters(query, self.sender_matcher)
+        if confident:
+            source = "fast_path"
+        else:
+            source = "llm"
+            if before_llm is not None:
+                before_llm()
+            with traced(trace, "extract_query_filters") as llm_span:
+                filters = extract_query_filters(query, self.llm) or {}
+                if not filters:
+                    # extract_query_filters는 실패 시 빈 dict를 반환
+                    llm_span.fail(ValueError("LLM이 필터 JSON을 반환하지 않음"))
+        span.set(source=source)
+
+        with self.lock:
+            self.stats[source] += 1
+            self.memo[key] = filters
+            if len(self.memo) > MEMO_SIZE:
+                self.memo.popitem(last=False)
+        return self._copy(filters)
+
+    @staticmethod
+    def _copy(filters):
+        copied = dict(filters)
+        if isinstance(copied.get("keywords"), list):
+            copied["keywords"] = list(copied["keywords"])
+        return copied
+
+    def resolve_sender(self, sender_name: str):
+        return self.sender_matcher.resolve(sender_name)
+
+    def fast_path_ratio(self):
+        """메모 히트를 제외하고 실제로 분석한 질문 중 fast path 비율"""
+        analyzed = self.stats["fast_path"] + self.stats["llm"]
+        return self.stats["fast_path"] / analyzed if analyzed else 0.0
@@ -0,0 +1,198 @@
+"""헤드리스 검색/답변 HTTP API (FastAPI + uvicorn)
+
+Streamlit 앱, rag_chat.py와 같은 파이프라인을 다른 내부 도구에서 HTTP로 쓸 수 있게 한다.
+  GET  /health  리소스 상태, 임베딩 배치/재정렬/LLM 동시 실행/trace 통계
+  POST /search  {"query": "..."} → 추출된 필터와 출처 이메일 (JSON)
+  POST /ask     {"query": "..."} → SSE 스트림: sources → token ... → done (실패하면 error 이벤트)
+
+프로세스 하나에 임베딩 모델/Chroma 클라이언트/LLM 클라이언트를 하나만 올리고 (uvicorn worker 1개),
+  - 동시에 들어온 질문 임베딩은 resources.query_embedder(EmbeddingBatcher)가 모아 한 번의 인코더 호출로 처리
+  - 필터 추출, 검색 같은 블로킹 단계는 API_WORKERS개 스레드 풀에서 실행
+  - 필터 추출이 LLM까지 가면 그 왕복 동안 필터 없는 넓은 벡터 검색을 미리 실행하고, 필터가 나오면 그 후보를 사후 필터링
+  - 답변 생성은 LLM_CONCURRENCY개까지만 동시에 실행하고 나머지는 대기 (대기 시간은 llm_wait span)
+한다. 요청마다 trace를 남기므로 data/traces/traces.jsonl과 /health에서 지연을 볼 수 있다.
+
+사용법: cd src && python rag_api.py --port 8000
+  curl -N -X POST localhost:8000/ask -H 'Content-Type: application/json' -d '{"query": "VV transportation issues"}'
+"""
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import uvicorn
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+
+from rag_pipeline import (
+    analyze_query, astream_answer, lookup_answer, retrieve_context, save_answer, smart_retrieve,
+)
+from rag_resources import load_resources
+from tracing import RequestTrace, traced
+
+load_dotenv()
+
+API_HOST = os.getenv("RAG_API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("RAG_API_PORT", "8000"))
+API_WORKERS = 16  # 필터 추출/검색/캐시 조회 등 블로킹 단계를 실행하는 스레드 수
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))  # 동시에 스트리밍할 최대 답변 수
+
+
+class QueryRequest(BaseModel):
+    query: str = Field(min_length=1)
+
+
+class ApiState:
+    """서버 프로세스 하나가 공유하는 리소스, 스레드 풀, LLM 동시 실행 제한"""
+
+    def __init__(self, resources):
+        self.resources = resources
+        self.executor = ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix="rag-api")
+        self.llm_slots = asyncio.Semaphore(LLM_CONCURRENCY)
+        self.llm = {"concurrency": LLM_CONCURRENCY, "active": 0, "waiting": 0}
+
+    async def run(self, fn, *args):
+        """블로킹 함수를 API 스레드 풀에서 실행"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def analyze(self, query, trace):
+        """질문 임베딩(배처)과 필터 추출을 스레드 풀에서 실행 → (query_embedding, filters, speculative)
+
+        필터 추출이 LLM까지 가면 그 왕복 동안 필터 없는 넓은 벡터 검색이 함께 진행된다 (rag_pipeline.analyze_query).
+        """
+        return await self.run(analyze_query, query, self.resources, trace)
+
+    @asynccontextmanager
+    async def llm_slot(self, trace):
+        self.llm["waiting"] += 1
+        try:
+            with traced(trace, "llm_wait"):
+                await self.llm_slots.acquire()
+        finally:
+            self.llm["waiting"] -= 1
+        self.llm["active"] += 1
+        try:
+            yield
+        finally:
+            self.llm["active"] -= 1
+            self.llm_slots.release()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.resources.close()
+
+
+def doc_json(doc):
+    return {"id": doc.id, "metadata": doc.metadata, "content": doc.page_content}
+
+
+def trace_json(trace):
+    """응답에 붙이는 단계별 소요 시간 (ms)"""
+    return {
+        "trace_id": trace.trace_id,
+        "total_ms": round(trace.elapsed() * 1000, 1),
+        "timings_ms": {name: round(seconds * 1000, 1) for name, seconds in trace.timings.items()},
+    }
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def ask_events(state, query, trace):
+    """/ask SSE 이벤트 (캐시 조회 → 검색 → 출처 → 답변 토큰 → 완료)"""
+    resources = state.resources
+    try:
+        query_embedding, filters, speculative = await state.analyze(query, trace)
+        _, _, hit = await state.run(lookup_answer, query, resources, trace, query_embedding, filters)
+        if hit is not None:
+            if speculative is not None:
+                speculative.cancel()
+            # 비슷한 질문의 캐시된 답변
+            yield sse("sources", {"filters": filters, "results": [doc_json(d) for d in hit["docs"]]})
+            yield sse("token", {"text": hit["answer"]})
+            yield sse("done", dict(trace_json(trace), cached=True, similarity=hit["similarity"]))
+            return
+
+        docs, context = await state.run(retrieve_context, query, resources, trace, query_embedding, filters,
+                                        speculative)
+        yield sse("sources", {"filters": filters, "results": [doc_json(d) for d in docs]})
+
+        tokens = []
+        async with state.llm_slot(trace):
+            async for token in astream_answer(resources.rag_chain, query, context, trace):
+                tokens.append(token)
+                if token:
+                    yield sse("token", {"text": token})
+        await state.run(save_answer, resources, query, query_embedding, filters, "".join(tokens), docs,
+                        trace.elapsed())
+        yield sse("done", dict(trace_json(trace), cached=False, context=trace.metrics))
+    except Exception as e:
+        trace.fail(e)
+        yield sse("error", {"message": str(e), "trace_id": trace.trace_id})
+    finally:
+        resources.tracer.export(trace)
+
+
+def create_app(resources_factory=load_resources):
+    """resources_factory()가 만든 리소스를 공유하는 FastAPI 앱 (시작할 때 한 번 로드)"""
+
+    @asynccontextmanager
+    async def lifespan(app):
+        app.state.api = ApiState(await asyncio.to_thread(resources_factory))
+        yield
+        app.state.api.close()
+
+    app = FastAPI(title="Outlook Email RAG API", lifespan=lifespan)
+
+    @app.get("/health")
+    async def health(request: Request):
+        state = request.app.state.api
+        embedder = state.resources.query_embedder
+        return {
+            "ok": state.resources.health.get("ok", False),
+            "resources": state.resources.health,
+            "embedding_batcher": dict(embedder.stats, mean_batch=embedder.mean_batch()),
+            "llm": state.llm,
+            "reranker": state.resources.reranker.stats if state.resources.reranker is not None else None,
+            "traces": state.resources.tracer.stats,
+        }
+
+    @app.post("/search")
+    async def search(body: QueryRequest, request: Request):
+        state = request.app.state.api
+        trace = RequestTrace(body.query, name="search")
+        try:
+            query_embedding, filters, speculative = await state.analyze(body.query, trace)
+            docs = await state.run(smart_retrieve, body.query, state.resources, trace, query_embedding, filters,
+                                   True, speculative)
+        except Exception as e:
+            trace.fail(e)
+            raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            state.resources.tracer.export(trace)
+        return dict(trace_json(trace), query=body.query, filters=filters, results=[doc_json(d) for d in docs])
+
+    @app.post("/ask")
+    async def ask(body: QueryRequest, request: Request):
+        trace = RequestTrace(body.query)
+        return StreamingResponse(ask_events(request.app.state.api, body.query, trace),
+                                 media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    return app
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Outlook Email RAG HTTP API")
+    arg_parser.add_argument("--host", default=API_HOST)
+    arg_parser.add_argument("--port", type=int, default=API_PORT)
+    args = arg_parser.parse_args()
+    # worker를 늘리면 프로세스마다 모델이 따로 올라가므로 1개로 고정 (동시성은 asyncio + 스레드 풀)
+    uvicorn.run(app, host=args.host, port=args.port, workers=1)
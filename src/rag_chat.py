@@ -1,13 +1,12 @@
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnableParallel, RunnablePassthrough
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_openai import ChatOpenAI
-from langchain_core.documents import Document
-
 import os
 from dotenv import load_dotenv
 
+from rag_pipeline import (
+    analyze_query, context_summary, lookup_answer, retrieve_context, save_answer, sender_label, stream_answer,
+)
+from rag_resources import load_resources
+from tracing import RequestTrace
+
 load_dotenv()
 
 api_key = os.getenv("OPENAI_API_KEY")
@@ -15,47 +14,48 @@ if not api_key:
     raise EnvironmentError("❌ OPENAI_API_KEY is not set. Please add it to your .env or export it.")
 os.environ["OPENAI_API_KEY"] = api_key
 
-# ===== 2️⃣ 임베딩 모델 및 DB 로딩 =====
-embedding_model = HuggingFaceEmbeddings(
-    model_name="BAAI/bge-m3",
-    model_kwargs={"device": "cuda"}  # GPU 사용
-)
-
-vectorstore = Chroma(
-    persist_directory="../vectorstore/chroma_outlook",  # 벡터 DB 경로
-    embedding_function=embedding_model
-)
-retriever = vectorstore.as_retriever(search_kwargs={"k": 10})
-
-# ===== 3️⃣ 프롬프트 정의 =====
-prompt_template = """
-You are an expert assistant for analyzing Outlook email data.
-
-When answering a question, follow these guidelines:
+# ===== 2️⃣ 임베딩 모델 / DB / LLM 로딩 (Streamlit 앱과 같은 리소스와 체인 사용) =====
+resources = load_resources(warmup=True)
+rag_chain = resources.rag_chain
+
+
+def print_sources(docs):
+    """검색이 끝나는 즉시 출처 이메일 목록 출력 (답변 생성 전)"""
+    print("\n📎 출처 이메일:")
+    for i, doc in enumerate(docs, 1):
+        meta = doc.metadata
+        print(f"  {i}. [{meta.get('date', 'Unknown')}] {sender_label(meta)} - {meta.get('subject_preview', '')}")
+
+
+def answer_turn(query, trace):
+    """채팅 한 턴 (쿼리 분석 (LLM이 필요하면 추측 검색) → 캐시 조회 → 검색 → 답변 스트리밍), 단계별 span은 trace에 기록"""
+    query_embedding, filters, speculative = analyze_query(query, resources, trace)
+    _, _, hit = lookup_answer(query, resources, trace, query_embedding, filters)
+    if hit is not None:
+        if speculative is not None:
+            speculative.cancel()
+        # 비슷한 질문의 캐시된 답변
+        print_sources(hit["docs"])
+        print(f"\n📘 답변 (⚡ 캐시, 유사도 {hit['similarity']:.3f}):\n{hit['answer']}")
+        print(f"\n⏱️ total {trace.elapsed() * 1000:.0f}ms — {trace.summary()}")
+        return
+
+    docs, context = retrieve_context(query, resources, trace, query_embedding, filters, speculative)
+    print_sources(docs)
+
+    # 답변을 토큰 단위로 출력
+    print("\n📘 답변:")
+    tokens = []
+    for token in stream_answer(rag_chain, query, context, trace):
+        tokens.append(token)
+        print(token, end="", flush=True)
+    print()
+    save_answer(resources, query, query_embedding, filters, "".join(tokens), docs, trace.elapsed())
+
+    print(f"\n⏱️ first token {trace.timings.get('first_token', 0) * 1000:.0f}ms · "
+          f"total {trace.elapsed() * 1000:.0f}ms — {trace.summary()}")
+    print(f"📝 {context_summary(trace.metrics)}")
 
-1. If the question is about a mail thread: summarize the flow of the thread in chronological order. Clarify who said what, to whom, and what actions or replies were requested or made.
-
-2. If the question is a conceptual one: provide a general answer based on common knowledge, then enrich the response with any relevant content from the documents.
-
-3. Filter or summarize the information as needed. Focus on delivering the most relevant and concise insight.
-
-Question: {question}
-
-Reference documents:
-{context}
-"""
-
-rag_prompt = ChatPromptTemplate.from_template(prompt_template)
-
-# ===== 4️⃣ LLM + 체인 연결 =====
-llm = ChatOpenAI(model="gpt-4o", temperature=0.2)
-
-# Chain 구성: context → prompt → LLM
-rag_chain = (
-    RunnableParallel({"context": retriever, "question": RunnablePassthrough()})
-    | rag_prompt
-    | llm
-)
 
 # ===== 5️⃣ 실행 예시 =====
 if __name__ == "__main__":
@@ -64,5 +64,11 @@ if __name__ == "__main__":
         if query.strip().lower() == "exit":
             break
 
-        result = rag_chain.invoke(query)
-        print(f"\n📘 답변:\n{result.content}")
\ No newline at end of file
+        trace = RequestTrace(query)
+        try:
+            answer_turn(query, trace)
+        except Exception as e:
+            trace.fail(e)
+            print(f"\n❌ 오류: {e}")
+        finally:
+            resources.tracer.export(trace)
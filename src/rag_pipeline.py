@@ -0,0 +1,702 @@
+"""RAG 검색/답변 파이프라인 (쿼리 분석 → 메타데이터 필터 → 하이브리드 검색 → 포맷팅 → 답변 생성)
+
+채팅 한 턴에서 검색은 한 번만 실행하고, 그 결과를 프롬프트 context와 출처 이메일 표시에 함께 사용한다.
+"""
+import re
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from answer_cache import filter_cache_key
+from context_packer import count_tokens, pack_context
+from query_filters import normalize_name
+from tracing import traced
+
+SEARCH_K = 10  # Top 10 유사 문서 검색
+HYBRID_CANDIDATES = 30  # 벡터/BM25 각각에서 가져와 융합할 후보 수
+RERANK_CANDIDATES = 100  # cross-encoder로 다시 정렬할 때 가져와 융합할 후보 청크 수
+RERANK_K = 5  # 모든 후보를 다시 정렬했을 때 LLM에 보낼 이메일 수 (예산 초과로 일부만 정렬하면 SEARCH_K)
+SPECULATIVE_CANDIDATES = 200  # 필터 추출 중에 미리 가져오는 필터 없는 벡터 검색 후보 수 (사후 필터링용)
+RRF_K = 60  # Reciprocal Rank Fusion 상수 (1 / (RRF_K + 순위))
+THREAD_EXPAND_HITS = 2  # 대화 흐름 질문에서 스레드 전체로 확장할 상위 검색 결과 수
+THREAD_MAX_MESSAGES = 15  # 확장할 스레드 하나의 최대 메일 수 (검색된 메일 주변 위주)
+THREAD_QUERY = re.compile(
+    r"\b(thread|conversation|flow|history|discussion|timeline|follow[- ]?up)s?\b|스레드|대화|흐름|경과|히스토리",
+    re.IGNORECASE,
+)
+CONTEXT_TOKEN_BUDGET = 6000  # 프롬프트에 넣을 이메일 context의 토큰 상한
+MAX_EMAIL_TOKENS = 1200  # 이메일 하나의 토큰 상한 (넘으면 질문과 비슷한 문단만 남김)
+
+
+# =====================
+# Query Analysis & Filtering
+# =====================
+def date_range(filters: dict):
+    """date_exact / date_month / date_year → UTC epoch 초 [start, end) 범위 (없거나 형식 오류면 None)"""
+    try:
+        if filters.get("date_exact"):
+            start = datetime.strptime(filters["date_exact"], "%Y-%m-%d")
+            end = start + timedelta(days=1)
+        elif filters.get("date_month"):
+            start = datetime.strptime(filters["date_month"], "%Y-%m")
+            end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+        elif filters.get("date_year"):
+            start = datetime.strptime(str(filters["date_year"]), "%Y")
+            end = start.replace(year=start.year + 1)
+        else:
+            return None
+    except (ValueError, TypeError):
+        return None
+    return int(start.replace(tzinfo=timezone.utc).timestamp()), int(end.replace(tzinfo=timezone.utc).timestamp())
+
+
+def resolve_sender(filters: dict, sender_resolver=None):
+    """발신자 필터 → (정규화 이름 후보, 주소 후보)"""
+    sender_name = filters.get("sender_name")
+    if not sender_name:
+        return None
+    if sender_resolver is not None:
+        return sender_resolver(sender_name)
+    if "@" in sender_name:
+        return [], [sender_name.strip().lower()]
+    return [normalize_name(sender_name)], []
+
+
+def filter_docs_by_metadata(docs, filters: dict, sender_resolver=None):
+    """추출된 필터로 문서 필터링 (where 절과 같은 조건을 검색 결과에 적용)"""
+    if not filters:
+        return docs
+
+    filtered = docs
+
+    # 날짜 범위 매칭 (정확한 날짜 / 월 / 연도)
+    span = date_range(filters)
+    if span:
+        start, end = span
+        filtered = [d for d in filtered
+                    if isinstance(d.metadata.get("timestamp"), int) and start <= d.metadata["timestamp"] < end]
+
+    # 발신자 매칭 (정규화 이름 또는 주소)
+    sender = resolve_sender(filters, sender_resolver)
+    if sender:
+        names, addresses = sender
+        filtered = [d for d in filtered
+                    if d.metadata.get("sender_name") in names or d.metadata.get("sender_address") in addresses]
+
+    return filtered
+
+
+def build_where_filter(filters: dict, sender_resolver=None):
+    """추출된 필터로 ChromaDB where 절 구성 (메타데이터 필터링 선행)
+
+    날짜는 정수 timestamp/year/month, 발신자는 정규화된 이름/주소에 대한 $eq/$in 조건으로 만든다.
+    """
+    if not filters:
+        return None
+
+    where_conditions = []
+
+    # 날짜 필터링
+    span = date_range(filters)
+    if span and filters.get("date_exact"):
+        where_conditions.append({"timestamp": {"$gte": span[0]}})
+        where_conditions.append({"timestamp": {"$lt": span[1]}})
+    elif span and filters.get("date_month"):
+        year, month = filters["date_month"].split("-")
+        where_conditions.append({"year": {"$eq": int(year)}})
+        where_conditions.append({"month": {"$eq": int(month)}})
+    elif span:
+        where_conditions.append({"year": {"$eq": int(filters["date_year"])}})
+
+    # 발신자 필터링
+    sender = resolve_sender(filters, sender_resolver)
+    if sender:
+        names, addresses = sender
+        sender_conditions = []
+        if addresses:
+            sender_conditions.append({"sender_address": {"$in": addresses}})
+        if names:
+            sender_conditions.append({"sender_name": {"$in": names}})
+        if len(sender_conditions) > 1:
+            where_conditions.append({"$or": sender_conditions})
+        elif sender_conditions:
+            where_conditions.append(sender_conditions[0])
+
+    # 여러 조건이 있으면 AND 연산
+    if len(where_conditions) > 1:
+        return {"$and": where_conditions}
+    elif len(where_conditions) == 1:
+        return where_conditions[0]
+    return None
+
+
+# =====================
+# Document Formatting
+# =====================
+def sender_label(meta):
+    """'표시 이름 <주소>' (이름을 모르면 주소만)"""
+    sender = meta.get('sender', 'Unknown')
+    display = meta.get('sender_display')
+    return f"{display} <{sender}>" if display else sender
+
+
+def context_summary(metrics):
+    """프롬프트 토큰 / context 예산 사용량 한 줄 요약 (retrieve_context가 trace에 남긴 값)"""
+    if "prompt_tokens" not in metrics:
+        return ""
+    return (
+        f"prompt {metrics['prompt_tokens']} tokens · context {metrics['context_tokens']}/{metrics['budget']} · "
+        f"{metrics['emails_used']}/{metrics['emails_retrieved']} emails "
+        f"({metrics['duplicates_removed']} duplicates, {metrics['emails_trimmed']} trimmed)"
+    )
+
+
+def prompt_tokens(query: str, context: str):
+    """시스템 프롬프트 + 질문 + context의 토큰 수"""
+    return sum(count_tokens(m.content) for m in prompt.format_messages(question=query, context=context))
+
+
+prompt = ChatPromptTemplate.from_messages([
+    ("system",
+     "You are a helpful assistant specialized in ITER project email communications.\n"
+     "You have access to email archives from the ITER Vacuum Vessel project.\n\n"
+     "IMPORTANT INSTRUCTIONS:\n"
+     "1. Use the provided email context to answer questions about:\n"
+     "   - VV (Vacuum Vessel) components and procedures\n"
+     "   - Transportation and logistics\n"
+     "   - ANB reports and inspections\n"
+     "   - Meeting schedules and discussions\n"
+     "   - Technical documentation\n\n"
+     "2. If the context contains relevant information, cite it in your answer.\n"
+     "3. For conceptual questions about ITER/fusion, combine the email context with your knowledge.\n"
+     "4. If no relevant emails are found, say so clearly.\n"
+     "5. When discussing email threads, describe the conversation flow.\n"
+     "6. Be specific about dates, people, and technical details when available.\n\n"
+     "⚠️ CRITICAL FOR DATE/METADATA-BASED QUERIES:\n"
+     "- Pay CLOSE ATTENTION to the 📅 DATE field in each email\n"
+     "- 🧵 THREAD i/n marks emails of one conversation, listed in chronological order\n"
+     "- Long emails may be trimmed to the passages relevant to the question; [...] marks omitted text\n"
+     "- When asked about specific dates, filter emails by matching the DATE exactly\n"
+     "- Check 📎 ATTACHMENTS when asked about files or documents; text extracted from a matching attachment\n"
+     "  follows the email body as '📎 <file name>' excerpts, so cite the file name when you use it\n"
+     "- Use 👤 FROM and 👥 TO fields for sender/recipient questions\n"
+     "- List ALL matching emails when asked about a specific date or person\n"
+     "- Format dates clearly (e.g., 'January 31, 2021' or '2021-01-31')\n"),
+    ("human", "Question: {question}\n\nRelevant Emails:\n{context}")
+])
+
+
+# =====================
+# Hybrid Search
+# =====================
+def vector_search(resources, query: str, k: int, where_filter=None, query_embedding=None):
+    """의미 검색 → [(문서 ID, Document)] (RRF에서 BM25 결과와 맞추기 위해 ID를 함께 반환)"""
+    embedding = query_embedding if query_embedding is not None else resources.query_embedder.embed_query(query)
+    result = resources.vectorstore._collection.query(
+        query_embeddings=[embedding], n_results=k, where=where_filter,
+        include=["documents", "metadatas"],
+    )
+    return [
+        (doc_id, Document(id=doc_id, page_content=content, metadata=meta or {}))
+        for doc_id, content, meta in zip(result["ids"][0], result["documents"][0], result["metadatas"][0])
+    ]
+
+
+def keyword_search(resources, query: str, filters: dict, k: int, where_filter=None):
+    """BM25 검색 → [(문서 ID, Document)] (추출된 키워드가 있으면 키워드로, 없으면 질문 전체로 검색)
+
+    날짜/발신자 필터는 BM25 인덱스의 문서 열로 상위 k개를 고르기 전에 적용한다.
+    (필터 열이 없는 예전 인덱스면 Chroma에서 본문/메타데이터를 가져오면서 같은 where 절로 거름)
+    """
+    index = resources.bm25_index
+    if index is None:
+        return []
+    filters = filters or {}
+    keywords = filters.get("keywords") or []
+    hits = index.search(" ".join(keywords) if keywords else query, k=k, date_span=date_range(filters),
+                        sender=resolve_sender(filters, resources.filter_extractor.resolve_sender))
+    if not hits:
+        return []
+
+    ids = [doc_id for doc_id, _ in hits]
+    result = resources.vectorstore._collection.get(ids=ids, where=None if index.filterable else where_filter,
+                                                   include=["documents", "metadatas"])
+    found = {
+        doc_id: Document(id=doc_id, page_content=content, metadata=meta or {})
+        for doc_id, content, meta in zip(result["ids"], result["documents"], result["metadatas"])
+    }
+    return [(doc_id, found[doc_id]) for doc_id in ids if doc_id in found]
+
+
+def reciprocal_rank_fusion(rankings, k: int = SEARCH_K):
+    """여러 검색 결과 [(문서 ID, Document)]를 RRF 점수 순으로 합쳐 상위 k개 Document 반환"""
+    scores, docs = {}, {}
+    for ranking in rankings:
+        for rank, (doc_id, doc) in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (RRF_K + rank)
+            docs.setdefault(doc_id, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [docs[doc_id] for doc_id in ranked[:k]]
+
+
+def stitch_windows(windows):
+    """한 이메일의 윈도우 청크 [(메타데이터, 본문)] → 겹치는 부분을 없앤 원래 이메일 (subject + 본문)"""
+    windows = sorted(windows, key=lambda w: w[0].get("chunk_index") or 0)
+    subject = windows[0][1].partition("\n\n")[0]
+    body = ""
+    for meta, content in windows:
+        text = content.partition("\n\n")[2]
+        start = meta.get("body_start") or 0
+        if start > len(body) and body:
+            body += " "  # 윈도우 사이에서 빠진 문장 경계 공백
+        body += text[max(len(body) - start, 0):]
+    return f"{subject}\n\n{body}"
+
+
+def collapse_to_parents(resources, docs, k: int):
+    """윈도우 청크 검색 결과를 부모 이메일 단위로 모아 상위 k개 이메일 Document 반환
+
+    부모의 순위는 가장 먼저 나온 윈도우의 순위를 따르고, 여러 윈도우로 나뉜 이메일은 이메일 저장소에서
+    message_id로 원본을 바로 꺼낸다. (저장소가 없거나 없는 메일이면 Chroma에서 모든 본문 윈도우를 가져와 이어 붙임)
+    첨부파일 자식 청크가 검색되면 부모 이메일 본문 뒤에 해당 첨부파일 구간("📎 파일명 ...")을 붙인다.
+    """
+    hits = {}
+    for doc in docs:
+        parent_id = doc.metadata.get("parent_id") or doc.id
+        hits.setdefault(parent_id, []).append(doc)
+    order = list(hits)[:k]
+
+    def body_hits(parent_id):
+        return [d for d in hits[parent_id] if not d.metadata.get("attachment")]
+
+    # 본문을 다시 모아야 하는 부모: 여러 윈도우로 나뉘었거나 첨부파일 청크만 검색된 이메일
+    split = [pid for pid in order
+             if (hits[pid][0].metadata.get("chunk_count") or 1) > 1 or not body_hits(pid)]
+    stored = {}
+    if resources.email_store is not None:
+        for parent_id in split:
+            email = resources.email_store.get(parent_id[len("email_"):], ["subject", "body"])
+            if email is not None:
+                stored[parent_id] = f"{email['subject']}\n\n{email['body']}"
+        split = [pid for pid in split if pid not in stored]
+    windows = {}
+    if split:
+        result = resources.vectorstore._collection.get(
+            where={"$and": [{"parent_id": {"$in": split}}, {"attachment": ""}]},
+            include=["documents", "metadatas"])
+        for content, meta in zip(result["documents"], result["metadatas"]):
+            windows.setdefault(meta["parent_id"], []).append((meta, content))
+
+    parents = []
+    for parent_id in order:
+        best = hits[parent_id][0]
+        body = body_hits(parent_id)
+        excerpts = list(dict.fromkeys(d.page_content for d in hits[parent_id] if d.metadata.get("attachment")))
+        if parent_id in stored:
+            content, meta = stored[parent_id], dict(best.metadata, chunk_index=0, body_start=0)
+        elif parent_id in windows:
+            content = stitch_windows(windows[parent_id])
+            meta = min(windows[parent_id], key=lambda w: w[0].get("chunk_index") or 0)[0]
+        elif not excerpts:
+            parents.append(best)
+            continue
+        elif body:
+            content, meta = body[0].page_content, body[0].metadata
+        else:
+            # 본문을 찾지 못함 - 첨부파일 구간만 사용
+            content, meta = "", best.metadata
+        parents.append(Document(
+            id=parent_id,
+            page_content="\n\n".join(filter(None, [content, *excerpts])),
+            metadata=dict(meta, attachment="", matched_chunks=len(hits[parent_id]),
+                          matched_attachments=len(excerpts)),
+        ))
+    return parents
+
+
+def thread_window(members, center, size):
+    """시간순 스레드에서 center 위치를 포함하는 최대 size개 구간 [start, end)"""
+    start = max(0, min(center - size // 2, len(members) - size))
+    return start, min(len(members), start + size)
+
+
+def expand_threads(resources, docs, max_hits: int = THREAD_EXPAND_HITS, max_messages: int = THREAD_MAX_MESSAGES):
+    """상위 검색 결과를 스레드 인덱스로 대화 전체(시간순)로 확장
+
+    확장된 메일에는 thread_position("3/7")을 붙이고, 이미 포함된 메일은 다시 넣지 않는다.
+    """
+    if resources.thread_index is None:
+        return docs
+
+    expanded, seen = [], set()
+    for rank, doc in enumerate(docs):
+        parent_id = doc.metadata.get("parent_id") or doc.id
+        if parent_id in seen:
+            continue
+        members = resources.thread_index.members(parent_id[len("email_"):]) if rank < max_hits else []
+        ids = [f"email_{message_id}" for message_id, _ in members]
+        if len(ids) < 2 or parent_id not in ids:
+            expanded.append(doc)
+            seen.add(parent_id)
+            continue
+
+        start, end = thread_window(ids, ids.index(parent_id), max_messages)
+        positions = {doc_id: i + 1 for i, doc_id in enumerate(ids)}
+        for thread_doc in fetch_docs(resources, [doc_id for doc_id in ids[start:end] if doc_id not in seen]):
+            thread_doc.metadata = dict(thread_doc.metadata, thread_position=f"{positions[thread_doc.id]}/{len(ids)}")
+            expanded.append(thread_doc)
+            seen.add(thread_doc.id)
+    return expanded
+
+
+def current_thread_ids(resources, docs):
+    """청크에 저장된 thread_id를 스레드 인덱스의 현재 루트 ID로 교체
+
+    청크는 만들 때의 스레드 인덱스로 thread_id를 받으므로, 이후 thread_builder가 루트를 바꾸면 (늦게 온 답장이
+    두 스레드를 잇거나 제목으로 합쳐진 경우) 오래된 값이 남는다. context 중복 제거는 이 값으로 스레드를 묶는다.
+    """
+    if resources.thread_index is None:
+        return docs
+    for doc in docs:
+        parent_id = doc.metadata.get("parent_id") or doc.id
+        root = resources.thread_index.root(parent_id[len("email_"):])
+        if root and root != doc.metadata.get("thread_id"):
+            doc.metadata = dict(doc.metadata, thread_id=root)
+    return docs
+
+
+def timed_call(trace, parent, name, fn, *args):
+    """스레드 풀에서 실행할 검색 단계를 parent 아래 span으로 기록 (후보 수를 속성으로)"""
+    with traced(trace, name, parent) as span:
+        ranking = fn(*args)
+        span.set(candidates=len(ranking))
+        return ranking
+
+
+# =====================
+# Speculative Search
+# =====================
+class SpeculativeSearch:
+    """필터 추출(LLM 왕복)을 기다리지 않고 미리 시작한 필터 없는 넓은 벡터 검색
+
+    필터가 나오면 filter_docs_by_metadata로 후보를 사후 필터링한다. 살아남은 후보가 필요한 수 이상이거나
+    컬렉션 전체를 가져온 경우라면 필터 검색 결과와 같으므로 그대로 쓰고, 아니면 필터 검색을 새로 실행한다.
+    """
+
+    def __init__(self, embedding, future, k):
+        self.embedding = embedding  # 질문 임베딩 또는 그 Future (EmbeddingBatcher.submit)
+        self.future = future
+        self.k = k
+
+    def query_embedding(self):
+        return self.embedding.result() if isinstance(self.embedding, Future) else self.embedding
+
+    def ranking(self, filters, where_filter, k, sender_resolver=None):
+        """필터를 적용한 상위 k개 [(문서 ID, Document)] → (ranking 또는 None, 사유)
+
+        필터가 있는데 추측 검색이 아직 끝나지 않았으면 기다리지 않고 None (바로 필터 검색을 하는 편이 빠름).
+        """
+        if where_filter is not None and not self.future.done():
+            self.future.cancel()
+            return None, "not_ready"
+        try:
+            ranking = self.future.result()
+        except Exception:
+            return None, "failed"
+        if where_filter is not None:
+            kept = {id(doc) for doc in filter_docs_by_metadata([doc for _, doc in ranking], filters, sender_resolver)}
+            survivors = [(doc_id, doc) for doc_id, doc in ranking if id(doc) in kept]
+        else:
+            survivors = ranking
+        if len(survivors) >= k or len(ranking) < self.k:
+            return survivors[:k], "used"
+        return None, "too_few"
+
+    def cancel(self):
+        self.future.cancel()
+
+
+def speculative_vector_search(resources, query: str, embedding, k: int):
+    embedding = embedding.result() if isinstance(embedding, Future) else embedding
+    return vector_search(resources, query, k, query_embedding=embedding)
+
+
+def start_speculative_search(query: str, resources, trace=None, query_embedding=None):
+    """질문 임베딩(없으면 배처에 제출)과 필터 없는 넓은 벡터 검색을 search_executor에서 시작 → SpeculativeSearch"""
+    embedding = query_embedding if query_embedding is not None else resources.query_embedder.submit(query)
+    parent = trace.current() if trace is not None else None
+    future = resources.search_executor.submit(
+        timed_call, trace, parent, "speculative_search", speculative_vector_search, resources, query, embedding,
+        SPECULATIVE_CANDIDATES)
+    return SpeculativeSearch(embedding, future, SPECULATIVE_CANDIDATES)
+
+
+def analyze_query(query: str, resources, trace=None):
+    """질문 임베딩과 필터 추출 → (query_embedding, filters, SpeculativeSearch 또는 None)
+
+    필터 추출이 LLM까지 갈 때만, 그리고 답변 캐시에 비슷한 질문이 없을 때만 LLM 왕복 동안
+    필터 없는 넓은 벡터 검색을 search_executor에서 미리 실행한다. fast path/메모로 필터가 바로 나오면
+    필터 검색을 바로 할 수 있으므로 추측 검색은 하지 않는다 (speculative는 None).
+    답변 캐시 히트로 검색이 필요 없으면 호출자가 speculative.cancel()을 부른다.
+    """
+    embedding = resources.query_embedder.submit(query)
+    speculative = query_embedding = None
+
+    def speculate():
+        nonlocal speculative, query_embedding
+        with traced(trace, "embed_query"):
+            query_embedding = embedding.result()
+        if not resources.answer_cache.has_similar(query_embedding):
+            speculative = start_speculative_search(query, resources, trace, query_embedding)
+
+    try:
+        filters = extract_filters(query, resources, trace, before_llm=speculate)
+    except Exception:
+        if speculative is not None:
+            speculative.cancel()
+        raise
+    if query_embedding is None:
+        # speculate()가 실행되지 않았으면 (fast path/메모) 여기서 기다림 - embed_query span은 턴당 한 번
+        with traced(trace, "embed_query"):
+            query_embedding = embedding.result()
+    return query_embedding, filters, speculative
+
+
+# =====================
+# Smart Retrieval Function
+# =====================
+def extract_filters(query: str, resources, trace=None, before_llm=None):
+    """쿼리 분석 (규칙 기반 fast path, 필요할 때만 LLM) - 한 턴에 한 번만 실행해 캐시 조회와 검색에 함께 사용"""
+    with traced(trace, "extract_filters") as span:
+        filters = resources.filter_extractor.extract(query, trace, before_llm)
+        span.set(keywords=len(filters.get("keywords") or []),
+                 filtered=bool(build_where_filter(filters, resources.filter_extractor.resolve_sender)))
+    return filters
+
+
+def rerank_chunks(query: str, resources, chunks, trace=None):
+    """융합된 후보 청크를 cross-encoder 점수 순으로 정렬 → (청크, 부모 이메일 수)
+
+    예산 안에 모든 후보를 정렬하면 RERANK_K개, 일부만 정렬했으면 SEARCH_K개 이메일을 남긴다.
+    """
+    with traced(trace, "rerank") as span:
+        chunks, complete = resources.reranker.rerank(query, chunks)
+        span.set(candidates=len(chunks), complete=complete,
+                 scored=sum("rerank_score" in doc.metadata for doc in chunks))
+    return chunks, RERANK_K if complete else SEARCH_K
+
+
+def smart_retrieve(query: str, resources, trace=None, query_embedding=None, filters=None, rerank=True,
+                   speculative=None):
+    """쿼리 분석 + 메타데이터 필터링(선행) + 벡터/BM25 하이브리드 검색 + cross-encoder 재정렬을 결합한 스마트 검색
+
+    resources: query_embedder, vectorstore, bm25_index, search_executor, filter_extractor, reranker를 가진 객체
+    (rag_resources.RagResources). query_embedding / filters를 주면 다시 계산하지 않는다.
+    resources.reranker가 없거나 rerank=False면 RRF 순서 그대로 상위 SEARCH_K개 이메일을 반환한다.
+    speculative(analyze_query의 SpeculativeSearch)를 주면 벡터 검색은 가능한 한 그 후보를 사후 필터링해 대신한다.
+    """
+    reranker = resources.reranker if rerank else None
+    candidates = RERANK_CANDIDATES if reranker is not None else HYBRID_CANDIDATES
+    with traced(trace, "smart_retrieve") as retrieve_span:
+        # 1단계: 쿼리 분석
+        if filters is None:
+            filters = extract_filters(query, resources, trace)
+
+        # 2단계: ChromaDB where 절 구성 (날짜 범위 + 발신자 $in)
+        where_filter = build_where_filter(filters, resources.filter_extractor.resolve_sender)
+
+        # 3단계: 메타데이터 필터를 적용한 벡터 검색과 BM25 검색을 동시에 실행 (검색 span은 smart_retrieve 아래)
+        #        추측 검색 후보가 충분하면 벡터 검색 대신 사후 필터링한 후보를 사용
+        parent = trace.current() if trace is not None else None
+        try:
+            keyword_future = resources.search_executor.submit(
+                timed_call, trace, parent, "keyword_search", keyword_search, resources, query, filters,
+                candidates, where_filter)
+            vector_ranking = None
+            if speculative is not None:
+                with traced(trace, "speculative_filter") as span:
+                    vector_ranking, outcome = speculative.ranking(
+                        filters, where_filter, candidates, resources.filter_extractor.resolve_sender)
+                    span.set(outcome=outcome, candidates=len(vector_ranking or []))
+                retrieve_span.set(speculative=outcome)
+            if vector_ranking is None:
+                if query_embedding is None and speculative is not None:
+                    query_embedding = speculative.query_embedding()
+                vector_ranking = timed_call(trace, parent, "vector_search", vector_search, resources, query,
+                                            candidates, where_filter, query_embedding)
+            rankings = [vector_ranking, keyword_future.result()]
+
+            # 발신자 이름이 알려진 발신자와 맞지 않아 아무것도 찾지 못하면 발신자 조건만 빼고 다시 검색
+            if filters.get("sender_name") and not any(rankings):
+                retrieve_span.set(sender_fallback=filters["sender_name"])
+                relaxed = dict(filters, sender_name=None)
+                relaxed_where = build_where_filter(relaxed, resources.filter_extractor.resolve_sender)
+                if query_embedding is None and speculative is not None:
+                    query_embedding = speculative.query_embedding()
+                with traced(trace, "sender_fallback") as span:
+                    fallback_parent = trace.current() if trace is not None else None
+                    keyword_future = resources.search_executor.submit(
+                        timed_call, trace, fallback_parent, "keyword_search", keyword_search, resources, query,
+                        relaxed, candidates, relaxed_where)
+                    rankings = [timed_call(trace, fallback_parent, "vector_search", vector_search, resources, query,
+                                           candidates, relaxed_where, query_embedding),
+                                keyword_future.result()]
+                    span.set(candidates=sum(len(ranking) for ranking in rankings))
+        except Exception as e:
+            # 필터링 실패시 폴백 (실패한 검색 span은 ERROR로 남음)
+            print(f"Filtered search failed: {e}, falling back to normal search")
+            retrieve_span.set(fallback=str(e))
+            with traced(trace, "fallback_search") as span:
+                rankings = [vector_search(resources, query, candidates, query_embedding=query_embedding)]
+                span.set(candidates=len(rankings[0]))
+
+        # 4단계: Reciprocal Rank Fusion으로 윈도우 청크 순위를 합치고 (있으면) cross-encoder로 다시 정렬한 뒤
+        #        부모 이메일 상위 k개로 모음
+        with traced(trace, "fuse") as span:
+            chunks = reciprocal_rank_fusion(rankings, candidates)
+            span.set(chunks=len(chunks))
+        k = SEARCH_K
+        if reranker is not None and chunks:
+            chunks, k = rerank_chunks(query, resources, chunks, trace)
+        with traced(trace, "collapse_parents") as span:
+            docs = collapse_to_parents(resources, chunks, k)
+            span.set(emails=len(docs))
+
+        # 5단계: 대화 흐름을 묻는 질문이면 상위 결과를 스레드 전체로 확장
+        if THREAD_QUERY.search(query):
+            with traced(trace, "expand_threads") as span:
+                docs = expand_threads(resources, docs)
+                span.set(emails=len(docs))
+        docs = current_thread_ids(resources, docs)
+        retrieve_span.set(emails=len(docs))
+    return docs
+
+
+# =====================
+# Answer Cache
+# =====================
+def fetch_docs(resources, doc_ids):
+    """부모 이메일 ID 순서대로 Document 조회 (캐시된 답변의 출처 표시용, 삭제된 문서는 제외)"""
+    if not doc_ids:
+        return []
+    result = resources.vectorstore._collection.get(ids=list(doc_ids), include=["documents", "metadatas"])
+    found = {
+        doc_id: Document(id=doc_id, page_content=content, metadata=meta or {})
+        for doc_id, content, meta in zip(result["ids"], result["documents"], result["metadatas"])
+    }
+    docs = [found[doc_id] for doc_id in doc_ids if doc_id in found]
+    return collapse_to_parents(resources, docs, len(docs))
+
+
+def lookup_answer(query: str, resources, trace=None, query_embedding=None, filters=None):
+    """질문 임베딩으로 답변 캐시 조회 → (query_embedding, filters, hit)
+
+    hit이 있으면 "docs"에 출처 Document가 채워져 있다. 미스면 query_embedding과 filters를 검색에 그대로 넘긴다.
+    query_embedding / filters를 주면 (예: API 서버에서 동시에 미리 계산) 다시 계산하지 않는다.
+    질문 임베딩은 resources.query_embedder(마이크로 배처 + LRU 캐시)를 거친다.
+    """
+    with traced(trace, "cache_lookup") as span:
+        if query_embedding is None:
+            with traced(trace, "embed_query"):
+                query_embedding = resources.query_embedder.embed_query(query)
+        if filters is None:
+            filters = extract_filters(query, resources, trace)
+        hit = resources.answer_cache.lookup(query_embedding, filter_cache_key(filters))
+        span.set(hit=hit is not None)
+        if hit is not None:
+            span.set(similarity=hit["similarity"])
+            hit["docs"] = fetch_docs(resources, hit["doc_ids"])
+    return query_embedding, filters, hit
+
+
+def save_answer(resources, query: str, query_embedding, filters, answer: str, docs, latency: float):
+    """생성한 답변과 출처 문서 ID를 캐시에 저장 (빈 답변은 저장하지 않음)"""
+    if not answer or not answer.strip():
+        return
+    doc_ids = [doc.id for doc in docs if doc.id]
+    resources.answer_cache.put(query, query_embedding, filter_cache_key(filters), answer, doc_ids, latency)
+
+
+# =====================
+# LLM and Chain
+# =====================
+def build_rag_chain(llm):
+    """{"question", "context"} → 답변 문자열 (검색은 체인 밖에서 한 번만 실행)"""
+    return prompt | llm | StrOutputParser()
+
+
+def retrieve_context(query: str, resources, trace=None, query_embedding=None, filters=None, speculative=None):
+    """검색 + context 구성을 한 번 실행해 (context에 들어간 출처 문서, 프롬프트 context) 반환"""
+    if query_embedding is None:
+        with traced(trace, "embed_query"):
+            query_embedding = resources.query_embedder.embed_query(query)
+    docs = smart_retrieve(query, resources, trace, query_embedding, filters, speculative=speculative)
+    with traced(trace, "pack_context") as span:
+        context, docs, stats = pack_context(
+            docs, query_embedding, resources.embedding_model.embed_documents, sender_label,
+            CONTEXT_TOKEN_BUDGET, MAX_EMAIL_TOKENS,
+        )
+        span.set(**stats)
+    if trace is not None:
+        for name, value in stats.items():
+            trace.note(name, value)
+        trace.note("prompt_tokens", prompt_tokens(query, context))
+    return docs, context
+
+
+def generate_answer(rag_chain, query: str, context: str, trace=None):
+    with traced(trace, "generate") as span:
+        answer = rag_chain.invoke({"question": query, "context": context})
+        span.set(prompt_tokens=trace.metrics.get("prompt_tokens") if trace else None,
+                 completion_tokens=count_tokens(answer))
+        return answer
+
+
+def stream_answer(rag_chain, query: str, context: str, trace=None):
+    """답변을 토큰 단위로 yield (generate span 아래에 첫 토큰까지 시간 first_token을 기록)"""
+    started = time.perf_counter()
+    span = trace.start("generate", prompt_tokens=trace.metrics.get("prompt_tokens")) if trace is not None else None
+    parts, first = [], True
+    try:
+        for token in rag_chain.stream({"question": query, "context": context}):
+            if first and token:
+                first = False
+                if trace is not None:
+                    trace.record("first_token", time.perf_counter() - started, parent=span)
+            parts.append(token)
+            yield token
+    except Exception as e:
+        if span is not None:
+            span.fail(e)
+        raise
+    finally:
+        if span is not None:
+            span.set(completion_tokens=count_tokens("".join(parts)))
+            trace.end(span)
+
+
+async def astream_answer(rag_chain, query: str, context: str, trace=None):
+    """stream_answer의 async 버전 (API 서버의 이벤트 루프에서 LLM 스트림을 기다림)"""
+    started = time.perf_counter()
+    span = trace.start("generate", prompt_tokens=trace.metrics.get("prompt_tokens")) if trace is not None else None
+    parts, first = [], True
+    try:
+        async for token in rag_chain.astream({"question": query, "context": context}):
+            if first and token:
+                first = False
+                if trace is not None:
+                    trace.record("first_token", time.perf_counter() - started, parent=span)
+            parts.append(token)
+            yield token
+    except Exception as e:
+        if span is not None:
+            span.fail(e)
+        raise
+    finally:
+        if span is not None:
+            span.set(completion_tokens=count_tokens("".join(parts)))
+            trace.end(span)
@@ -0,0 +1,210 @@
+"""임베딩 모델 / Chroma 클라이언트 / LLM 등 무거운 리소스를 프로세스당 한 번만 생성
+
+Streamlit은 상호작용마다 스크립트를 다시 실행하므로, 앱에서는 st.cache_resource로 감싼
+load_resources()를 사용해 모든 세션이 같은 인스턴스를 공유한다.
+"""
+import atexit
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_community.vectorstores import Chroma
+from langchain_openai import ChatOpenAI
+
+from answer_cache import AnswerCache
+from bm25_index import BM25Index
+from build_chromaDB import pick_device
+from embedding_batcher import EmbeddingBatcher
+from query_filters import QueryFilterExtractor
+from record_store import RecordStore
+from reranker import CrossEncoderReranker
+from thread_index import ThreadIndex
+from tracing import TraceExporter
+from rag_pipeline import build_rag_chain
+
+CHROMA_PATH = "../data/vectorstore/chroma_outlook"
+COLLECTION_NAME = "email_rag_collection"
+BM25_INDEX_DIR = "../data/bm25_index"
+THREAD_INDEX_PATH = "../data/thread_index.json"  # scripts/thread_builder.py 출력
+EMAIL_STORE_PATH = "../data/outlook_dedup.store"  # scripts/near_dedup.py 출력 (message_id → 원본 이메일)
+SEARCH_WORKERS = 4  # 벡터 검색과 BM25 검색을 동시에 실행하는 스레드 수
+QUERY_EMBED_BATCH_SIZE = 32  # 한 번의 인코더 호출에 넣을 최대 질문 수
+QUERY_EMBED_WAIT = float(os.getenv("QUERY_EMBED_WAIT", "0.005"))  # 첫 질문 이후 배치를 더 모으는 시간 (초)
+QUERY_EMBED_CACHE_SIZE = 1024  # 최근 질문 임베딩 LRU 캐시 크기
+INDEX_MANIFEST_PATH = "../data/checkpoints/build_chromaDB.json"  # 바뀌면 답변 캐시 무효화
+ANSWER_CACHE_DIR = "../data/answer_cache"
+ANSWER_CACHE_THRESHOLD = 0.95  # 코사인 유사도가 이 이상이면 같은 질문으로 취급
+ANSWER_CACHE_TTL_SECONDS = 7 * 24 * 3600
+ANSWER_CACHE_MAX_ENTRIES = 2000
+TRACE_LOG_PATH = "../data/traces/traces.jsonl"  # 요청별 span (OTLP/JSON, 한 줄에 요청 하나)
+TRACE_WINDOW = 200  # 사이드바 지연 백분위를 계산할 최근 요청 수
+TRACE_MAX_BYTES = 50 * 1024 * 1024  # 넘으면 traces.jsonl.1로 넘기고 새 파일 시작
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")  # 다국어, CPU에서도 사용 가능
+RERANK_ENABLED = os.getenv("RERANK", "1") == "1"  # RERANK=0 이면 RRF 순서 그대로 사용
+RERANK_MAX_LENGTH = 256  # cross-encoder 입력 토큰 상한 (질문 + 청크 앞부분)
+RERANK_BATCH_SIZE = 16  # 한 번의 predict에 넣을 (질문, 청크) 쌍 수
+RERANK_BUDGET = float(os.getenv("RERANK_BUDGET", "0.8"))  # 검색 한 번의 재정렬 시간 상한 (초)
+RERANK_CACHE_SIZE = 50000  # (질문, 청크) 점수 LRU 캐시 크기
+EMBEDDING_MODEL = "BAAI/bge-m3"
+LLM_MODEL = "gpt-4o"
+LLM_BASE_URL = os.getenv("OPENAI_BASE_URL")  # OpenAI 호환 서버 (예: scripts/openai_stub_server.py), 미지정 시 OpenAI API
+
+
+class RagResources:
+    """프로세스 전체에서 공유하는 RAG 리소스 묶음"""
+
+    def __init__(self, embedding_model, vectorstore, llm, bm25_index=None, thread_index=None, email_store=None,
+                 rerank_model=None):
+        self.embedding_model = embedding_model
+        self.vectorstore = vectorstore
+        self.llm = llm
+        self.bm25_index = bm25_index  # 없으면 벡터 검색만 사용
+        self.thread_index = thread_index  # 없으면 스레드 확장 없음
+        self.email_store = email_store  # 없으면 여러 윈도우로 나뉜 이메일을 Chroma에서 모아 이어 붙임
+        # 없으면 재정렬 없이 RRF 순서 그대로 사용
+        self.reranker = (CrossEncoderReranker(rerank_model, RERANK_BATCH_SIZE, RERANK_BUDGET, RERANK_CACHE_SIZE)
+                         if rerank_model is not None else None)
+        self.search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS)
+        # 질문 임베딩은 모든 세션/요청이 이 배처를 거쳐 한 번의 인코더 호출로 묶임 (문서 임베딩은 모델 직접 호출)
+        self.query_embedder = EmbeddingBatcher(embedding_model, QUERY_EMBED_BATCH_SIZE, QUERY_EMBED_WAIT,
+                                               QUERY_EMBED_CACHE_SIZE)
+        self.rag_chain = build_rag_chain(llm)
+        self.filter_extractor = QueryFilterExtractor(llm)
+        self.answer_cache = AnswerCache(ANSWER_CACHE_DIR, EMBEDDING_MODEL, INDEX_MANIFEST_PATH,
+                                        ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_ENTRIES)
+        self.tracer = TraceExporter(TRACE_LOG_PATH, TRACE_WINDOW, TRACE_MAX_BYTES)
+        self.health = {}
+        self.lock = threading.Lock()
+        self.active = 0  # 이 인스턴스를 사용 중인 요청 수
+        self.retired = False  # 리로드로 교체됨 (사용 중인 요청이 모두 끝나면 close)
+        self.closed = False
+
+    @contextmanager
+    def in_use(self):
+        """요청 하나가 이 인스턴스를 쓰는 동안 감싸는 블록 (그 사이 retire되면 블록이 끝날 때 close)"""
+        with self.lock:
+            self.active += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.active -= 1
+                done = self.retired and self.active == 0
+            if done:
+                self.close()
+
+    def retire(self):
+        """리로드로 새 인스턴스가 생길 때 호출 - 사용 중인 요청이 없으면 바로, 있으면 마지막 요청이 끝날 때 close"""
+        with self.lock:
+            self.retired = True
+            done = self.active == 0
+        if done:
+            self.close()
+
+    def warmup(self):
+        """더미 임베딩과 작은 검색을 한 번 실행해 모델/인덱스를 메모리에 올리고 상태 기록"""
+        health = {"ok": False}
+        started = time.perf_counter()
+        try:
+            vector = self.embedding_model.embed_query("warmup")
+            health["embedding_dim"] = len(vector)
+            health["embed_ms"] = (time.perf_counter() - started) * 1000
+
+            search_started = time.perf_counter()
+            self.vectorstore.similarity_search_by_vector(vector, k=1)
+            health["search_ms"] = (time.perf_counter() - search_started) * 1000
+            health["documents"] = self.vectorstore._collection.count()
+            health["bm25_documents"] = self.bm25_index.num_docs if self.bm25_index else 0
+            health["threads"] = len(self.thread_index) if self.thread_index else 0
+            health["stored_emails"] = len(self.email_store) if self.email_store else 0
+            if self.reranker is not None:
+                rerank_started = time.perf_counter()
+                self.reranker.model.predict([("warmup", "warmup")], show_progress_bar=False)
+                health["rerank_ms"] = (time.perf_counter() - rerank_started) * 1000
+            health["ok"] = True
+        except Exception as e:
+            health["error"] = str(e)
+            print(f"[WARN] 리소스 워밍업 실패: {e}")
+        health["warmup_ms"] = (time.perf_counter() - started) * 1000
+        self.health = health
+        return health
+
+    def close(self):
+        """프로세스 종료 또는 리로드 시 참조를 끊고 GPU 메모리 반환"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.query_embedder.close()
+        self.search_executor.shutdown(wait=False)
+        try:
+            self.answer_cache.save()
+        except Exception as e:
+            print(f"[WARN] 답변 캐시 저장 실패: {e}")
+        self.embedding_model = self.vectorstore = self.llm = self.rag_chain = self.bm25_index = self.thread_index = None
+        self.email_store = self.reranker = None
+        try:
+            if pick_device() == "cuda":
+                import torch
+                torch.cuda.empty_cache()
+        except Exception as e:
+            print(f"[WARN] 리소스 정리 실패: {e}")
+
+
+def close_at_exit(ref):
+    """프로세스 종료 시 아직 살아 있는 인스턴스만 close (atexit이 인스턴스를 붙잡아 두지 않도록 weakref 사용)"""
+    resources = ref()
+    if resources is not None:
+        resources.close()
+
+
+def load_rerank_model(model_name=RERANK_MODEL):
+    """cross-encoder 로드 (실패하면 경고 후 None - 재정렬 없이 검색)"""
+    try:
+        from sentence_transformers import CrossEncoder
+        return CrossEncoder(model_name, max_length=RERANK_MAX_LENGTH, device=pick_device())
+    except Exception as e:
+        print(f"[WARN] 재정렬 모델 로드 실패 ('{model_name}'): {e} - RRF 순서 그대로 사용")
+        return None
+
+
+def load_resources(warmup=True):
+    """리소스를 생성하고 (기본) 워밍업까지 마친 RagResources 반환"""
+    started = time.perf_counter()
+    embedding_model = HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL,
+        model_kwargs={"device": pick_device()}
+    )
+
+    vectorstore = Chroma(
+        persist_directory=CHROMA_PATH,
+        collection_name=COLLECTION_NAME,
+        embedding_function=embedding_model
+    )
+
+    llm = ChatOpenAI(model=LLM_MODEL, temperature=0, base_url=LLM_BASE_URL)
+
+    bm25_index = BM25Index.load(BM25_INDEX_DIR)
+    if bm25_index is None:
+        print(f"[WARN] BM25 인덱스 없음 ('{BM25_INDEX_DIR}') - 벡터 검색만 사용")
+
+    thread_index = ThreadIndex.load(THREAD_INDEX_PATH)
+    if thread_index is None:
+        print(f"[WARN] 스레드 인덱스 없음 ('{THREAD_INDEX_PATH}') - 스레드 확장 없이 검색")
+
+    email_store = RecordStore.load(EMAIL_STORE_PATH)
+    if email_store is None:
+        print(f"[WARN] 이메일 저장소 없음 ('{EMAIL_STORE_PATH}') - 긴 이메일은 Chroma 윈도우를 이어 붙여 표시")
+
+    rerank_model = load_rerank_model() if RERANK_ENABLED else None
+
+    resources = RagResources(embedding_model, vectorstore, llm, bm25_index, thread_index, email_store, rerank_model)
+    if warmup:
+        resources.warmup()
+    resources.health["load_ms"] = (time.perf_counter() - started) * 1000
+    atexit.register(close_at_exit, weakref.ref(resources))
+    return resources
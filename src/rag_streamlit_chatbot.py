@@ -2,14 +2,11 @@
 import os
 import streamlit as st
 from dotenv import load_dotenv
-from langchain_community.vectorstores import Chroma
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_core.documents import Document
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.example_selectors import SemanticSimilarityExampleSelector
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from rag_pipeline import (
+    analyze_query, context_summary, lookup_answer, retrieve_context, save_answer, sender_label, stream_answer,
+)
+from rag_resources import TRACE_WINDOW, load_resources
+from tracing import RequestTrace
 
 # =====================
 # 0. Load API key
@@ -33,204 +30,41 @@ if "source_docs" not in st.session_state:
     st.session_state.source_docs = {}
 
 # =====================
-# 2. Load Vector DB
+# 2. Load Shared Resources
 # =====================
-CHROMA_PATH = "../data/vectorstore/chroma_outlook"
-COLLECTION_NAME = "email_rag_collection"
-
-embedding_model = HuggingFaceEmbeddings(
-    model_name="BAAI/bge-m3",
-    model_kwargs={"device": "cuda"}  # GPU 사용 (RTX 6000 Ada)
-)
-
-vectorstore = Chroma(
-    persist_directory=CHROMA_PATH,
-    collection_name=COLLECTION_NAME,
-    embedding_function=embedding_model
-)
-
-retriever = vectorstore.as_retriever(search_kwargs={"k": 10})  # Top 10 유사 문서 검색
+@st.cache_resource(show_spinner="🚀 Loading embedding model and vector DB...")
+def get_resources():
+    """임베딩 모델 / Chroma / LLM을 프로세스당 한 번만 생성하고 워밍업 (모든 세션이 공유)"""
+    return load_resources(warmup=True)
 
-# =====================
-# 3. Query Analysis & Filtering
-# =====================
-def extract_query_filters(query: str, llm) -> dict:
-    """LLM으로 쿼리에서 필터 조건 추출"""
-    filter_prompt = ChatPromptTemplate.from_messages([
-        ("system", 
-         "You are a query analyzer. Extract search filters from the user's question.\n"
-         "Return ONLY a valid JSON object with these fields (use null if not found):\n"
-         "{{\n"
-         '  "date_exact": "YYYY-MM-DD" or null,\n'
-         '  "date_month": "YYYY-MM" or null,\n'
-         '  "date_year": "YYYY" or null,\n'
-         '  "sender_name": "name" or null,\n'
-         '  "keywords": ["keyword1", "keyword2"] or []\n'
-         "}}\n\n"
-         "Examples:\n"
-         'Q: "What happened on January 31, 2021?" → {{"date_exact": "2021-01-31", ...}}\n'
-         'Q: "Emails in July 2021" → {{"date_month": "2021-07", ...}}\n'
-         'Q: "What did Alex Martin say?" → {{"sender_name": "Alex Martin", ...}}\n'
-         'Q: "ANB reports" → {{"keywords": ["ANB", "report"], ...}}\n'),
-        ("human", "Question: {question}\n\nReturn JSON only:")
-    ])
-    
-    try:
-        from langchain_core.output_parsers import JsonOutputParser
-        parser = JsonOutputParser()
-        chain = filter_prompt | llm | parser
-        filters = chain.invoke({"question": query})
-        return filters
-    except:
-        return {}
-
-def filter_docs_by_metadata(docs, filters: dict):
-    """추출된 필터로 문서 필터링"""
-    if not filters:
-        return docs
-    
-    filtered = docs
-    
-    # 정확한 날짜 매칭
-    if filters.get("date_exact"):
-        target_date = filters["date_exact"]
-        filtered = [d for d in filtered if target_date in d.metadata.get("date", "")]
-    
-    # 월 범위 매칭 (e.g., 2021-07)
-    elif filters.get("date_month"):
-        target_month = filters["date_month"]
-        filtered = [d for d in filtered if target_month in d.metadata.get("date", "")]
-    
-    # 연도 매칭
-    elif filters.get("date_year"):
-        target_year = filters["date_year"]
-        filtered = [d for d in filtered if target_year in d.metadata.get("date", "")]
-    
-    # 발신자 매칭 (이름 또는 이메일)
-    if filters.get("sender_name"):
-        sender_name = filters["sender_name"].lower()
-        filtered = [d for d in filtered 
-                   if sender_name in d.metadata.get("sender", "").lower()]
-    
-    return filtered
+resources = get_resources()
+rag_chain = resources.rag_chain
 
-# =====================
-# 4. Document Formatting
-# =====================
-def format_docs(docs):
-    """문서를 문자열로 포맷팅 - 메타데이터 강조로 날짜/발신자 기반 검색 정확도 향상"""
-    formatted = []
+def render_source_docs(docs):
+    """출처 이메일 목록 표시"""
     for i, doc in enumerate(docs, 1):
         meta = doc.metadata
-        sender = meta.get('sender', 'Unknown')
-        recipients = meta.get('recipients', 'Unknown')
-        date = meta.get('date', 'Unknown')
-        attachments = meta.get('attachments', [])
+        title = meta.get("subject_preview", "(No Subject)")
+        sender = sender_label(meta) if meta.get("sender") else "(Unknown Sender)"
+        recipients = meta.get("recipients", "(Unknown Recipients)")
+        date = meta.get("date", "(Unknown Date)")
         content = doc.page_content
-        
-        # 첨부파일 포맷팅
-        attachments_str = ', '.join(attachments) if attachments else 'None'
-        
-        formatted.append(
-            f"========== EMAIL {i} ==========\n"
-            f"📅 DATE: {date}\n"
-            f"👤 FROM: {sender}\n"
-            f"👥 TO: {recipients}\n"
-            f"📎 ATTACHMENTS: {attachments_str}\n"
-            f"📧 CONTENT:\n{content}\n"
-            f"================================"
-        )
-    return "\n\n".join(formatted)
-
-prompt = ChatPromptTemplate.from_messages([
-    ("system",
-     "You are a helpful assistant specialized in ITER project email communications.\n"
-     "You have access to email archives from the ITER Vacuum Vessel project.\n\n"
-     "IMPORTANT INSTRUCTIONS:\n"
-     "1. Use the provided email context to answer questions about:\n"
-     "   - VV (Vacuum Vessel) components and procedures\n"
-     "   - Transportation and logistics\n"
-     "   - ANB reports and inspections\n"
-     "   - Meeting schedules and discussions\n"
-     "   - Technical documentation\n\n"
-     "2. If the context contains relevant information, cite it in your answer.\n"
-     "3. For conceptual questions about ITER/fusion, combine the email context with your knowledge.\n"
-     "4. If no relevant emails are found, say so clearly.\n"
-     "5. When discussing email threads, describe the conversation flow.\n"
-     "6. Be specific about dates, people, and technical details when available.\n\n"
-     "⚠️ CRITICAL FOR DATE/METADATA-BASED QUERIES:\n"
-     "- Pay CLOSE ATTENTION to the 📅 DATE field in each email\n"
-     "- When asked about specific dates, filter emails by matching the DATE exactly\n"
-     "- Check 📎 ATTACHMENTS when asked about files or documents\n"
-     "- Use 👤 FROM and 👥 TO fields for sender/recipient questions\n"
-     "- List ALL matching emails when asked about a specific date or person\n"
-     "- Format dates clearly (e.g., 'January 31, 2021' or '2021-01-31')\n"),
-    ("human", "Question: {question}\n\nRelevant Emails:\n{context}")
-])
 
-# =====================
-# 5. Smart Retrieval Function
-# =====================
-def smart_retrieve(query: str):
-    """쿼리 분석 + 메타데이터 필터링(선행) + 의미 검색을 결합한 스마트 검색"""
-    # 1단계: LLM으로 쿼리 분석
-    filters = extract_query_filters(query, llm)
-    
-    # 2단계: ChromaDB where 절 구성 (메타데이터 필터링 선행)
-    where_filter = None
-    if filters and any(filters.values()):
-        where_conditions = []
-        
-        # 날짜 필터링
-        if filters.get("date_exact"):
-            where_conditions.append({"date": {"$contains": filters["date_exact"]}})
-        elif filters.get("date_month"):
-            where_conditions.append({"date": {"$contains": filters["date_month"]}})
-        elif filters.get("date_year"):
-            where_conditions.append({"date": {"$contains": filters["date_year"]}})
-        
-        # 발신자 필터링
-        if filters.get("sender_name"):
-            where_conditions.append({"sender": {"$contains": filters["sender_name"]}})
-        
-        # 여러 조건이 있으면 AND 연산
-        if len(where_conditions) > 1:
-            where_filter = {"$and": where_conditions}
-        elif len(where_conditions) == 1:
-            where_filter = where_conditions[0]
-    
-    # 3단계: 메타데이터 필터링 후 유사도 검색 (k=10)
-    try:
-        if where_filter:
-            # 메타데이터 필터링을 먼저 적용한 검색
-            candidates = vectorstore.similarity_search(query, k=10, filter=where_filter)
-        else:
-            # 필터 없으면 일반 유사도 검색
-            candidates = vectorstore.similarity_search(query, k=10)
-    except Exception as e:
-        # 필터링 실패시 폴백
-        print(f"Filtered search failed: {e}, falling back to normal search")
-        candidates = vectorstore.similarity_search(query, k=10)
-    
-    return candidates
+        st.markdown(f"**📧 Email {i}**")
+        st.markdown(f"**From:** `{sender}`")
+        st.markdown(f"**To:** `{recipients}`")
+        st.markdown(f"**Date:** `{date}`")
+        st.markdown(f"**Subject:** {title}")
 
-# =====================
-# 6. LLM and Chain
-# =====================
-llm = ChatOpenAI(model="gpt-4o", temperature=0)
+        # 내용 미리보기
+        with st.expander(f"📄 View Email Content"):
+            st.text(content[:800] + ('...' if len(content) > 800 else ''))
 
-rag_chain = (
-    {
-        "context": lambda x: format_docs(smart_retrieve(x)),
-        "question": RunnablePassthrough()
-    }
-    | prompt
-    | llm
-    | StrOutputParser()
-)
+        if i < len(docs):
+            st.markdown("---")
 
 # =====================
-# 5. Chat UI with History
+# 4. Chat UI with History
 # =====================
 
 # 사이드바에 Clear Chat 버튼 추가
@@ -246,6 +80,73 @@ with st.sidebar:
     st.metric("Total Messages", len(st.session_state.messages))
     st.metric("Q&A Pairs", len(st.session_state.messages) // 2)
 
+    # 필터 추출 fast path 통계 (프로세스 전체)
+    filter_stats = resources.filter_extractor.stats
+    st.metric("Filter Fast Path", f"{resources.filter_extractor.fast_path_ratio() * 100:.0f}%")
+    st.caption(
+        f"Rule-based {filter_stats['fast_path']} · LLM {filter_stats['llm']} · "
+        f"memo hits {filter_stats['memo_hits']}"
+    )
+
+    # 답변 캐시 통계 (프로세스 전체)
+    cache_stats = resources.answer_cache.stats
+    st.metric("Answer Cache Hit Rate", f"{resources.answer_cache.hit_rate() * 100:.0f}%")
+    st.caption(
+        f"Hits {cache_stats['hits']} · misses {cache_stats['misses']} · "
+        f"saved {cache_stats['saved_seconds']:.1f}s · {len(resources.answer_cache.entries)} cached"
+    )
+
+    # 질문 임베딩 배처 통계 (프로세스 전체, 모든 세션의 질문이 같은 배처를 거침)
+    embedder = resources.query_embedder
+    st.metric("Query Embedding Cache", f"{embedder.cache_hit_rate() * 100:.0f}%")
+    st.caption(
+        f"{embedder.stats['batches']} encoder calls · mean batch {embedder.mean_batch():.1f} · "
+        f"max batch {embedder.stats['max_batch']}"
+    )
+
+    # cross-encoder 재정렬 통계 (프로세스 전체)
+    reranker = resources.reranker
+    if reranker is not None:
+        st.metric("Rerank Within Budget", f"{reranker.complete_rate() * 100:.0f}%")
+        st.caption(
+            f"Pair cache {reranker.cache_hit_rate() * 100:.0f}% · {reranker.stats['scored']} pairs scored · "
+            f"{reranker.stats['skipped']} over budget"
+        )
+
+    # 최근 요청의 단계별 지연 백분위 (프로세스 전체, span 이름별)
+    st.markdown("---")
+    st.markdown("### ⏱️ Latency")
+    latency = resources.tracer.percentiles()
+    if latency:
+        st.dataframe(
+            [{"span": name, "n": row["n"], "p50 ms": round(row["p50"]), "p95 ms": round(row["p95"]),
+              "p99 ms": round(row["p99"])}
+             for name, row in sorted(latency.items(), key=lambda item: -item[1]["p50"])],
+            hide_index=True, use_container_width=True,
+        )
+        trace_stats = resources.tracer.stats
+        st.caption(f"Last {min(trace_stats['exported'], TRACE_WINDOW)} requests · "
+                   f"{trace_stats['errors']} with errors · traces in `{resources.tracer.path}`")
+    else:
+        st.caption("No requests yet")
+
+    st.markdown("---")
+    st.markdown("### 🩺 Resource Health")
+    health = resources.health
+    if health.get("ok"):
+        st.success(f"Ready · {health.get('documents', 0)} emails indexed")
+        st.caption(
+            f"Load {health.get('load_ms', 0):.0f}ms · embed {health.get('embed_ms', 0):.0f}ms · "
+            f"search {health.get('search_ms', 0):.0f}ms"
+        )
+    else:
+        st.error(f"Warmup failed: {health.get('error', 'unknown error')}")
+    if st.button("🔄 Reload Models", use_container_width=True):
+        # 다른 세션이 답변 중일 수 있으므로 캐시를 비운 뒤, 이전 인스턴스는 진행 중인 턴이 모두 끝나면 close
+        get_resources.clear()
+        resources.retire()
+        st.rerun()
+
 # 채팅 메시지 히스토리 표시
 chat_container = st.container()
 with chat_container:
@@ -266,27 +167,49 @@ with chat_container:
             # Assistant 메시지에 출처 문서 표시
             if message["role"] == "assistant" and idx in st.session_state.source_docs:
                 with st.expander("📎 View Source Emails"):
-                    docs = st.session_state.source_docs[idx]
-                    for i, doc in enumerate(docs, 1):
-                        meta = doc.metadata
-                        title = meta.get("subject_preview", "(No Subject)")
-                        sender = meta.get("sender", "(Unknown Sender)")
-                        recipients = meta.get("recipients", "(Unknown Recipients)")
-                        date = meta.get("date", "(Unknown Date)")
-                        content = doc.page_content
-                        
-                        st.markdown(f"**📧 Email {i}**")
-                        st.markdown(f"**From:** `{sender}`")
-                        st.markdown(f"**To:** `{recipients}`")
-                        st.markdown(f"**Date:** `{date}`")
-                        st.markdown(f"**Subject:** {title}")
-                        
-                        # 내용 미리보기
-                        with st.expander(f"📄 View Email Content"):
-                            st.text(content[:800] + ('...' if len(content) > 800 else ''))
-                        
-                        if i < len(docs):
-                            st.markdown("---")
+                    render_source_docs(st.session_state.source_docs[idx])
+
+def answer_turn(prompt, trace):
+    """채팅 한 턴 (캐시 조회 → 검색 → 답변 스트리밍) → (답변, 출처 문서)"""
+    # 답변 자리를 먼저 잡아 두고, 출처는 검색이 끝나는 즉시 표시
+    answer_area = st.empty()
+    with st.spinner("🔍 Searching emails..."):
+        # 필터 추출이 LLM까지 가면 그동안 필터 없는 넓은 벡터 검색을 미리 실행
+        query_embedding, filters, speculative = analyze_query(prompt, resources, trace)
+        # 비슷한 질문의 답변이 캐시에 있으면 검색과 생성을 건너뜀
+        _, _, hit = lookup_answer(prompt, resources, trace, query_embedding, filters)
+        if hit is None:
+            # 스마트 검색 한 번 (메타데이터 필터링 + 의미 검색, 추측 검색 후보 재사용) → 프롬프트와 출처 표시에 함께 사용
+            docs, context = retrieve_context(prompt, resources, trace, query_embedding, filters, speculative)
+        else:
+            if speculative is not None:
+                speculative.cancel()
+            docs = hit["docs"]
+
+    # 출처 문서 표시 (답변 생성 중에도 볼 수 있음)
+    with st.expander("📎 View Source Emails"):
+        render_source_docs(docs)
+
+    if hit is None:
+        # 답변을 토큰 단위로 스트리밍한 뒤 캐시에 저장
+        with answer_area.container():
+            answer = st.write_stream(stream_answer(rag_chain, prompt, context, trace))
+        save_answer(resources, prompt, query_embedding, filters, answer, docs, trace.elapsed())
+    else:
+        answer = hit["answer"]
+        answer_area.markdown(answer)
+        st.caption(f"⚡ Cached answer (similarity {hit['similarity']:.3f}, "
+                   f"saved ~{hit['latency']:.1f}s) for: “{hit['query']}”")
+
+    # 단계별 실행 횟수/시간 (발신자 폴백처럼 의도적으로 다시 실행한 단계는 ×2 이상으로 표시)
+    timings = trace.timings
+    st.caption(
+        f"⏱️ first token {timings.get('first_token', 0) * 1000:.0f}ms · "
+        f"total {trace.elapsed() * 1000:.0f}ms — {trace.summary()}"
+    )
+    if trace.metrics:
+        st.caption(f"📝 {context_summary(trace.metrics)}")
+    return answer, docs
 
 # 채팅 입력창 (화면 하단 고정)
 if prompt := st.chat_input("💬 Ask about ITER emails... (e.g., What are VV transportation challenges?)"):
@@ -299,42 +222,18 @@ if prompt := st.chat_input("💬 Ask about ITER emails... (e.g., What are VV tra
     
     # Assistant 응답 생성
     with st.chat_message("assistant"):
-        with st.spinner("🔍 Searching emails and generating answer..."):
-            # 스마트 검색 (쿼리 분석 + 메타데이터 필터링 + 의미 검색)
-            docs = smart_retrieve(prompt)
-            
-            # 답변 생성
-            answer = rag_chain.invoke(prompt)
-            
-            # 답변 표시
-            st.markdown(answer)
-            
-            # 현재 assistant 메시지 인덱스
-            assistant_idx = len(st.session_state.messages)
-            
-            # 출처 문서 표시
-            with st.expander("📎 View Source Emails"):
-                for i, doc in enumerate(docs, 1):
-                    meta = doc.metadata
-                    title = meta.get("subject_preview", "(No Subject)")
-                    sender = meta.get("sender", "(Unknown Sender)")
-                    recipients = meta.get("recipients", "(Unknown Recipients)")
-                    date = meta.get("date", "(Unknown Date)")
-                    content = doc.page_content
-                    
-                    st.markdown(f"**📧 Email {i}**")
-                    st.markdown(f"**From:** `{sender}`")
-                    st.markdown(f"**To:** `{recipients}`")
-                    st.markdown(f"**Date:** `{date}`")
-                    st.markdown(f"**Subject:** {title}")
-                    
-                    # 내용 미리보기
-                    with st.expander(f"📄 View Email Content"):
-                        st.text(content[:800] + ('...' if len(content) > 800 else ''))
-                    
-                    if i < len(docs):
-                        st.markdown("---")
-            
-            # Assistant 메시지와 출처 문서 저장
-            st.session_state.messages.append({"role": "assistant", "content": answer})
-            st.session_state.source_docs[assistant_idx] = docs
\ No newline at end of file
+        trace = RequestTrace(prompt)
+        try:
+            with resources.in_use():
+                answer, docs = answer_turn(prompt, trace)
+        except Exception as e:
+            trace.fail(e)
+            answer, docs = f"❌ Error while answering: {e}", []
+            st.error(answer)
+        finally:
+            resources.tracer.export(trace)
+
+        # Assistant 메시지와 출처 문서 저장
+        assistant_idx = len(st.session_state.messages)
+        st.session_state.messages.append({"role": "assistant", "content": answer})
+        st.session_state.source_docs[assistant_idx] = docs
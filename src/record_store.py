@@ -0,0 +1,462 @@
+"""파이프라인 이메일/청크 데이터의 열 기반(columnar) 저장소 - 단계 사이 JSONL 대체
+
+레코드를 열별 파일로 나눠 이어 쓰고, 읽을 때는 numpy memmap으로 필요한 열과 행만 꺼낸다.
+(텍스트를 다시 파싱하지 않고, 읽지 않는 열은 디스크에서 올라오지도 않음)
+  meta.json                 스키마, 커밋된 행 수, 사전 크기 (커밋 시점에 원자적으로 교체)
+  <열>.off                  가변 길이 열의 행 끝 위치 (int64, 행마다 하나)
+  <열>.bin                  str / json 열의 UTF-8 바이트
+  <열>.ids                  사전 인코딩 열의 사전 번호 (int32, -1 = None)
+  <열>.i64, <열>.tz         int / timestamp 열 (timestamp는 UTC epoch 초 + UTC 오프셋(분))
+  dict_<사전>.bin/.off      주소, message_id처럼 반복되는 문자열 사전 (여러 열이 공유)
+  key.u64, key_hash.npy, key_row.npy
+                            키 열(message_id) 해시와 정렬된 (해시, 행) 인덱스 - get(message_id)는 이진 탐색
+
+열 종류: "str", "json", "int", "timestamp", ("dict", 사전), ("dict_list", 사전), ("ref_list", 사전)
+  - timestamp 열은 ISO 문자열로 읽고 쓰지만 column()으로 int64 epoch 초 배열을 그대로 얻을 수 있다
+    (초 단위, 파싱할 수 없는 날짜는 빈 문자열로 읽힘)
+  - ref_list 열은 "<a> <b>" 형식의 References 문자열을 message_id 사전 번호 목록으로 저장
+  - str 열의 None은 빈 문자열로 저장, 스키마에 없는 필드는 저장하지 않음
+  - "metadata.from"처럼 점이 있는 열 이름은 한 단계 중첩된 필드 (청크 레코드의 metadata)
+
+단계별 체크포인트(scripts/checkpoint.py)는 커밋된 행 수를 offset으로 기록하고, 재개할 때 그 행까지 파일을 잘라내고 이어 쓴다.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+MISSING = int(np.iinfo(np.int64).min)  # int / timestamp 열의 None
+NAIVE_TZ = -32768                      # 시간대 없는 날짜 (UTC 오프셋 대신)
+FLUSH_ROWS = 1024                      # 메모리에 모았다가 파일에 쓰는 행 수
+MESSAGE_ID = re.compile(r"<[^<>\s]+>")
+
+# 파이프라인 이메일 (outlook_raw / outlook_clean / outlook_dedup)
+# mbox_converter 레코드의 from/to/cc 표시 문자열, date_raw, date_ymd는 *_list와 date_iso로 대신하므로 저장하지 않음
+EMAIL_SCHEMA = {
+    "message_id": "str",
+    "thread_id": ("dict", "message_ids"),
+    "subject": "str",
+    "from_list": ("dict_list", "addresses"),
+    "to_list": ("dict_list", "addresses"),
+    "cc_list": ("dict_list", "addresses"),
+    "date_iso": "timestamp",
+    "in_reply_to": ("dict", "message_ids"),
+    "references": ("ref_list", "message_ids"),
+    "body": "str",
+    "attachments": "json",
+    "attachment_texts": "json",  # attachment_extractor.py 결과 [{"filename", "content_hash", "status", "text"}]
+    "name_email_map": "json",
+    "content_hash": "str",
+}
+
+# chunk_emailwise.py 출력 ({"content", "metadata"})
+CHUNK_SCHEMA = {
+    "content": "str",
+    "metadata.from": ("dict_list", "addresses"),
+    "metadata.to": ("dict_list", "addresses"),
+    "metadata.date": "timestamp",
+    "metadata.message_id": ("dict", "message_ids"),
+    "metadata.content_hash": "str",
+    "metadata.in_reply_to": ("dict", "message_ids"),
+    "metadata.references": ("ref_list", "message_ids"),
+    "metadata.thread_id": ("dict", "message_ids"),
+    "metadata.attachments": "json",
+    "metadata.name_email_map": "json",
+    "metadata.parent_id": ("dict", "message_ids"),
+    "metadata.chunk_index": "int",
+    "metadata.chunk_count": "int",
+    "metadata.body_start": "int",
+    "metadata.subject": ("dict", "subjects"),
+    "metadata.attachment": ("dict", "attachment_names"),  # 첨부파일 자식 청크의 파일명 (본문 윈도우는 None)
+}
+
+DTYPES = {".off": np.int64, ".i64": np.int64, ".tz": np.int16, ".ids": np.int32, ".u64": np.uint64}
+
+
+def column_kind(spec):
+    """열 스펙 → (종류, 사전 이름 또는 None)"""
+    return (spec, None) if isinstance(spec, str) else (spec[0], spec[1])
+
+
+def normalize_schema(schema):
+    """meta.json과 비교할 수 있는 형태 (튜플 → 리스트)"""
+    return {name: spec if isinstance(spec, str) else list(spec) for name, spec in schema.items()}
+
+
+def column_files(name, kind):
+    """열 하나가 쓰는 행 단위 파일 접미사"""
+    return {
+        "str": (".bin", ".off"), "json": (".bin", ".off"), "int": (".i64",), "timestamp": (".i64", ".tz"),
+        "dict": (".ids",), "dict_list": (".ids", ".off"), "ref_list": (".ids", ".off"),
+    }[kind]
+
+
+def meta_path(path):
+    return os.path.join(path, "meta.json")
+
+
+def read_meta(path):
+    if not os.path.exists(meta_path(path)):
+        return None
+    with open(meta_path(path), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def store_rows(path):
+    """커밋된 행 수 (저장소가 없으면 0)"""
+    meta = read_meta(path)
+    return meta["rows"] if meta else 0
+
+
+def key_hash(value):
+    return int.from_bytes(hashlib.blake2b((value or "").encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def encode_timestamp(value):
+    """ISO 날짜 문자열 → (UTC epoch 초, UTC 오프셋 분) (파싱 실패 시 MISSING)"""
+    if not value:
+        return MISSING, 0
+    try:
+        dt = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return MISSING, 0
+    if dt.tzinfo is None:
+        return int(dt.replace(tzinfo=timezone.utc).timestamp()), NAIVE_TZ
+    return int(dt.timestamp()), int(dt.utcoffset().total_seconds() // 60)
+
+
+def decode_timestamp(seconds, tz_minutes):
+    if seconds == MISSING:
+        return ""
+    try:
+        if tz_minutes == NAIVE_TZ:
+            return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None).isoformat()
+        return datetime.fromtimestamp(seconds, timezone(timedelta(minutes=tz_minutes))).isoformat()
+    except (OverflowError, OSError, ValueError):
+        return ""
+
+
+def get_field(record, name):
+    outer, _, inner = name.partition(".")
+    value = record.get(outer)
+    return (value or {}).get(inner) if inner else value
+
+
+def set_field(record, name, value):
+    outer, _, inner = name.partition(".")
+    if inner:
+        record.setdefault(outer, {})[inner] = value
+    else:
+        record[outer] = value
+
+
+def read_array(path, dtype, count):
+    """파일 앞부분 count개 원소를 읽기 전용 memmap으로 (빈 파일은 memmap이 안 되므로 빈 배열)"""
+    if count <= 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+
+def last_end(path, rows):
+    """.off 파일에서 rows번째 행의 끝 위치 (rows가 0이면 0)"""
+    return int(read_array(path, np.int64, rows)[-1]) if rows else 0
+
+
+class RecordStoreWriter:
+    """레코드를 열별 파일에 이어 쓰기 (commit()까지는 읽는 쪽에 보이지 않음)
+
+    rows: 이어 쓸 위치 (이전 manifest의 output_offset). 그 뒤에 남은 미커밋/미확정 행은 잘라냄
+    key: get(key 값)으로 찾을 수 있게 해시 인덱스를 만들 열 (close()에서 정렬)
+    """
+
+    def __init__(self, path, schema, rows=0, full_rebuild=False, key=None):
+        self.path = path
+        self.schema = normalize_schema(schema)
+        self.columns = {name: column_kind(spec) for name, spec in schema.items()}
+        self.key = key
+        meta = None if full_rebuild else read_meta(path)
+        if meta is None:
+            if rows:
+                raise ValueError(f"'{path}' 저장소가 없는데 {rows}행부터 이어 쓰려고 함")
+            shutil.rmtree(path, ignore_errors=True)
+            os.makedirs(path)
+            meta = {"schema": self.schema, "key": key, "rows": 0, "dicts": {}, "indexed_rows": 0}
+        elif meta["schema"] != self.schema or meta.get("key") != key:
+            raise ValueError(f"'{path}' 저장소 스키마가 다름 - FULL_REBUILD=1로 다시 만드세요")
+        elif rows > meta["rows"]:
+            raise ValueError(f"'{path}' 저장소는 {meta['rows']}행인데 {rows}행부터 이어 쓰려고 함")
+        self.meta = meta
+        self.rows = rows
+
+        dict_names = {dict_name for _, dict_name in self.columns.values() if dict_name}
+        sizes, self.ends = {}, {}
+        for name, (kind, _) in self.columns.items():
+            for suffix in column_files(name, kind):
+                sizes[name + suffix] = rows * np.dtype(DTYPES[suffix]).itemsize if suffix in DTYPES else None
+            if ".off" in column_files(name, kind):
+                # .bin은 바이트, .ids는 원소 단위의 끝 위치
+                self.ends[name] = last_end(self.file(name + ".off"), rows)
+                data_suffix = ".bin" if kind in ("str", "json") else ".ids"
+                sizes[name + data_suffix] = self.ends[name] * (1 if data_suffix == ".bin" else 4)
+        if key:
+            sizes["key.u64"] = rows * 8
+        # 사전은 커밋된 항목까지만 유지 (뒤쪽 행이 잘려 쓰이지 않는 항목이 남는 것은 무방)
+        self.dicts = {}
+        for dict_name in dict_names:
+            count = meta["dicts"].get(dict_name, 0)
+            off_path, bin_path = self.file(f"dict_{dict_name}.off"), self.file(f"dict_{dict_name}.bin")
+            end = last_end(off_path, count)
+            sizes[f"dict_{dict_name}.off"], sizes[f"dict_{dict_name}.bin"] = count * 8, end
+            values = {}
+            if count:
+                ends = np.asarray(read_array(off_path, np.int64, count))
+                blob = read_array(bin_path, np.uint8, end).tobytes()
+                start = 0
+                for i, stop in enumerate(ends.tolist()):
+                    values[blob[start:stop].decode("utf-8")] = i
+                    start = stop
+            self.dicts[dict_name] = values
+            self.ends[f"dict_{dict_name}"] = end
+
+        # 파일을 자르기 전에 meta.json부터 잘린 크기로 바꿈 (커밋 없이 중단돼도 meta가 파일보다 길지 않음)
+        # 잘라낸 행을 가리킬 수 있는 키 인덱스는 close()에서 다시 만듦
+        self.meta.update(rows=rows, indexed_rows=0, dicts={name: meta["dicts"].get(name, 0) for name in dict_names})
+        self.save_meta()
+
+        self.handles, self.buffers = {}, {}
+        for filename, size in sizes.items():
+            file_path = self.file(filename)
+            handle = open(file_path, 'ab')
+            handle.truncate(size)
+            self.handles[filename] = handle
+            self.buffers[filename] = []
+        self.pending = 0
+
+    def file(self, filename):
+        return os.path.join(self.path, filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # 마지막 커밋 이후 부분은 다음 실행에서 잘라냄
+            for handle in self.handles.values():
+                handle.close()
+        return False
+
+    def intern(self, dict_name, value):
+        values = self.dicts[dict_name]
+        index = values.get(value)
+        if index is None:
+            index = values[value] = len(values)
+            data = value.encode("utf-8")
+            self.ends[f"dict_{dict_name}"] += len(data)
+            self.buffers[f"dict_{dict_name}.bin"].append(data)
+            self.buffers[f"dict_{dict_name}.off"].append(self.ends[f"dict_{dict_name}"])
+        return index
+
+    def append(self, record):
+        for name, (kind, dict_name) in self.columns.items():
+            value = get_field(record, name)
+            if kind in ("str", "json"):
+                text = json.dumps(value, ensure_ascii=False) if kind == "json" else (value or "")
+                data = text.encode("utf-8")
+                self.ends[name] += len(data)
+                self.buffers[name + ".bin"].append(data)
+                self.buffers[name + ".off"].append(self.ends[name])
+            elif kind == "int":
+                self.buffers[name + ".i64"].append(MISSING if value is None else int(value))
+            elif kind == "timestamp":
+                seconds, tz_minutes = encode_timestamp(value)
+                self.buffers[name + ".i64"].append(seconds)
+                self.buffers[name + ".tz"].append(tz_minutes)
+            elif kind == "dict":
+                self.buffers[name + ".ids"].append(-1 if value is None else self.intern(dict_name, value))
+            else:
+                items = MESSAGE_ID.findall(value or "") if kind == "ref_list" else (value or [])
+                self.buffers[name + ".ids"].extend(self.intern(dict_name, item) for item in items)
+                self.ends[name] += len(items)
+                self.buffers[name + ".off"].append(self.ends[name])
+        if self.key:
+            self.buffers["key.u64"].append(key_hash(get_field(record, self.key)))
+        self.rows += 1
+        self.pending += 1
+        if self.pending >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        for filename, buffer in self.buffers.items():
+            if not buffer:
+                continue
+            suffix = os.path.splitext(filename)[1]
+            if suffix in DTYPES:
+                self.handles[filename].write(np.asarray(buffer, dtype=DTYPES[suffix]).tobytes())
+            else:
+                self.handles[filename].write(b"".join(buffer))
+            buffer.clear()
+        self.pending = 0
+
+    def commit(self):
+        """열 파일을 디스크에 확정한 뒤 meta.json 교체. 커밋된 행 수 반환"""
+        self.flush()
+        for handle in self.handles.values():
+            handle.flush()
+            os.fsync(handle.fileno())
+        self.meta["rows"] = self.rows
+        self.meta["dicts"] = {dict_name: len(values) for dict_name, values in self.dicts.items()}
+        self.save_meta()
+        return self.rows
+
+    def save_meta(self):
+        tmp_path = meta_path(self.path) + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, meta_path(self.path))
+
+    def close(self):
+        """커밋 후 키 해시를 정렬해 인덱스 저장 (같은 키는 행 순서 유지 → 마지막 행이 최신)"""
+        self.commit()
+        for handle in self.handles.values():
+            handle.close()
+        if self.key:
+            hashes = np.fromfile(self.file("key.u64"), dtype=np.uint64, count=self.rows)
+            order = np.argsort(hashes, kind="stable")
+            for filename, array in (("key_hash.npy", hashes[order]), ("key_row.npy", order.astype(np.int64))):
+                tmp_path = self.file(filename + ".tmp.npy")
+                np.save(tmp_path, array)
+                os.replace(tmp_path, self.file(filename))
+            self.meta["indexed_rows"] = self.rows
+            self.save_meta()
+
+
+class RecordStore:
+    """열 기반 저장소 읽기 (열 파일은 memmap, 값은 접근할 때만 디코딩, 여러 스레드에서 동시에 읽기 가능)
+
+    열 때의 커밋된 행까지만 보이므로, 위 단계가 이어 쓰는 중에도 일관된 스냅샷을 읽는다.
+    """
+
+    def __init__(self, path):
+        meta = read_meta(path)
+        if meta is None:
+            raise FileNotFoundError(meta_path(path))
+        self.path = path
+        self.rows = meta["rows"]
+        self.columns = {name: column_kind(spec) for name, spec in meta["schema"].items()}
+        self.key = meta.get("key")
+        self.dict_sizes = meta["dicts"]
+        self.indexed_rows = meta.get("indexed_rows", 0)
+        self.arrays = {}
+        self.dict_values = {dict_name: {} for dict_name in self.dict_sizes}
+
+    @classmethod
+    def load(cls, path):
+        """저장소가 없으면 None"""
+        return cls(path) if read_meta(path) is not None else None
+
+    def __len__(self):
+        return self.rows
+
+    def array(self, filename, dtype, count):
+        cached = self.arrays.get(filename)
+        if cached is None or len(cached) != count:
+            cached = self.arrays[filename] = read_array(os.path.join(self.path, filename), dtype, count)
+        return cached
+
+    def span(self, filename, row, count):
+        """가변 길이 열/사전의 row번째 [start, end)"""
+        ends = self.array(filename, np.int64, count)
+        return (int(ends[row - 1]) if row else 0), int(ends[row])
+
+    def text(self, prefix, row, count):
+        start, end = self.span(prefix + ".off", row, count)
+        blob = self.array(prefix + ".bin", np.uint8, int(self.array(prefix + ".off", np.int64, count)[-1]))
+        return blob[start:end].tobytes().decode("utf-8")
+
+    def dict_value(self, dict_name, index):
+        values = self.dict_values[dict_name]
+        value = values.get(index)
+        if value is None:
+            value = values[index] = self.text(f"dict_{dict_name}", index, self.dict_sizes[dict_name])
+        return value
+
+    def value(self, name, row):
+        kind, dict_name = self.columns[name]
+        if kind == "str":
+            return self.text(name, row, self.rows)
+        if kind == "json":
+            return json.loads(self.text(name, row, self.rows))
+        if kind == "int":
+            value = int(self.array(name + ".i64", np.int64, self.rows)[row])
+            return None if value == MISSING else value
+        if kind == "timestamp":
+            return decode_timestamp(int(self.array(name + ".i64", np.int64, self.rows)[row]),
+                                    int(self.array(name + ".tz", np.int16, self.rows)[row]))
+        if kind == "dict":
+            index = int(self.array(name + ".ids", np.int32, self.rows)[row])
+            return None if index < 0 else self.dict_value(dict_name, index)
+        start, end = self.span(name + ".off", row, self.rows)
+        ids = self.array(name + ".ids", np.int32, int(self.array(name + ".off", np.int64, self.rows)[-1]))
+        items = [self.dict_value(dict_name, int(index)) for index in ids[start:end]]
+        return " ".join(items) if kind == "ref_list" else items
+
+    def record(self, row, columns=None):
+        """row번째 레코드 (columns를 주면 그 열만 디코딩)"""
+        record = {}
+        for name in columns or self.columns:
+            set_field(record, name, self.value(name, row))
+        return record
+
+    def iter_records(self, start=0, columns=None):
+        """start행부터 (다음 행 번호, 레코드) - checkpoint의 input_offset은 행 번호"""
+        for row in range(start, self.rows):
+            yield row + 1, self.record(row, columns)
+
+    def column(self, name):
+        """고정 길이 열의 원본 배열 (int/timestamp → int64 epoch 초, dict → 사전 번호), 복사 없음"""
+        kind, _ = self.columns[name]
+        if kind in ("int", "timestamp"):
+            return self.array(name + ".i64", np.int64, self.rows)
+        if kind == "dict":
+            return self.array(name + ".ids", np.int32, self.rows)
+        raise ValueError(f"'{name}'은 가변 길이 열 ({kind})")
+
+    def key_index(self):
+        if "key_index" not in self.arrays:
+            self.arrays["key_index"] = tuple(
+                np.load(os.path.join(self.path, filename), mmap_mode="r") for filename in ("key_hash.npy", "key_row.npy"))
+        return self.arrays["key_index"]
+
+    def find(self, key):
+        """키 열 값이 key인 마지막(최신) 행 번호 (없으면 None)"""
+        if not self.key or not self.rows:
+            return None
+        target = np.uint64(key_hash(key))
+        candidates = []
+        if self.indexed_rows:
+            hashes, rows = self.key_index()
+            left, right = np.searchsorted(hashes, target, "left"), np.searchsorted(hashes, target, "right")
+            candidates = rows[left:right].tolist()
+        # 인덱스를 만든 뒤 이어 쓴 행 (close() 전에 중단된 경우)은 해시 열을 직접 비교
+        if self.indexed_rows < self.rows:
+            tail = self.array("key.u64", np.uint64, self.rows)[self.indexed_rows:]
+            candidates += (np.flatnonzero(tail == target) + self.indexed_rows).tolist()
+        for row in sorted(candidates, reverse=True):
+            if self.value(self.key, row) == key:
+                return row
+        return None
+
+    def get(self, key, columns=None):
+        row = self.find(key)
+        return None if row is None else self.record(row, columns)
+
+    def nbytes(self):
+        return sum(os.path.getsize(os.path.join(self.path, name)) for name in os.listdir(self.path))
@@ -0,0 +1,109 @@
+"""하이브리드 검색 후보를 로컬 cross-encoder로 다시 정렬 (배치 처리 + 점수 캐시 + 지연 예산)
+
+벡터/BM25는 질문과 문서를 따로 임베딩하므로 넓은 후보(RERANK_CANDIDATES개)를 싸게 가져오는 데 쓰고,
+그중 실제로 질문에 답하는 청크는 질문과 문서를 함께 읽는 cross-encoder가 고른다.
+  - 후보를 batch_size개씩 묶어 CPU에서도 돌아가는 크기로 점수 계산 (model.predict 한 번에 한 배치)
+  - (질문, 청크 내용) 점수는 LRU 캐시에 보관해 같은 질문/후보는 다시 계산하지 않음
+  - 예산(budget초) 안에 끝나지 않을 것 같으면 남은 후보는 점수 없이 원래(RRF) 순서로 뒤에 붙임
+    (예산이 0이거나 모델이 바쁘면 원래 순서 그대로 - 답변 지연이 예산 이상 늘지 않음)
+
+RagResources.reranker로 Streamlit 앱, rag_chat.py, rag_api.py가 함께 사용한다.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_key(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+
+
+class CrossEncoderReranker:
+    def __init__(self, model, batch_size, budget, cache_size=0):
+        self.model = model  # sentence_transformers.CrossEncoder (predict(pairs) → 점수 배열)
+        self.batch_size = batch_size
+        self.budget = budget  # 한 번의 rerank에 쓸 최대 시간 (초)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # (질문, 청크 내용 해시) → 점수 (LRU)
+        self.lock = threading.Lock()  # 캐시/통계
+        self.model_lock = threading.Lock()  # 모델 호출은 한 번에 하나 (CPU 스레드 과다 사용 방지)
+        self.pair_seconds = None  # 쌍 하나당 추론 시간 이동 평균 (다음 배치가 예산 안에 끝날지 추정)
+        self.stats = {"requests": 0, "complete": 0, "pairs": 0, "cache_hits": 0, "scored": 0, "batches": 0,
+                      "skipped": 0, "predict_seconds": 0.0}
+
+    def score(self, query, docs, budget=None):
+        """docs 각각의 점수 리스트 (예산 안에 계산하지 못한 문서는 None)"""
+        budget = self.budget if budget is None else budget
+        started = time.perf_counter()
+        keys = [(query, content_key(doc.page_content)) for doc in docs]
+        with self.lock:
+            scores = []
+            for key in keys:
+                value = self.cache.get(key)
+                if value is not None:
+                    self.cache.move_to_end(key)
+                scores.append(value)
+        hits = sum(value is not None for value in scores)
+
+        # 캐시에 없는 후보를 원래 순서대로 (순위가 높은 후보부터) 배치로 계산
+        pending = [i for i, value in enumerate(scores) if value is None]
+        computed = batches = 0
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            remaining = budget - (time.perf_counter() - started)
+            if remaining <= (self.pair_seconds or 0.0) * len(batch):
+                break
+            if not self.model_lock.acquire(timeout=remaining):
+                break
+            try:
+                batch_started = time.perf_counter()
+                values = self.model.predict([(query, docs[i].page_content) for i in batch],
+                                            batch_size=len(batch), show_progress_bar=False)
+                seconds = time.perf_counter() - batch_started
+            finally:
+                self.model_lock.release()
+            per_pair = seconds / len(batch)
+            self.pair_seconds = per_pair if self.pair_seconds is None else 0.8 * self.pair_seconds + 0.2 * per_pair
+            for i, value in zip(batch, values):
+                scores[i] = float(value)
+            computed += len(batch)
+            batches += 1
+            with self.lock:
+                self.stats["predict_seconds"] += seconds
+                if self.cache_size:
+                    for i in batch:
+                        self.cache[keys[i]] = scores[i]
+                        self.cache.move_to_end(keys[i])
+                    while len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["complete"] += computed == len(pending)
+            self.stats["pairs"] += len(docs)
+            self.stats["cache_hits"] += hits
+            self.stats["scored"] += computed
+            self.stats["batches"] += batches
+            self.stats["skipped"] += len(pending) - computed
+        return scores
+
+    def rerank(self, query, docs, budget=None):
+        """점수 순으로 정렬한 docs와 모든 후보에 점수를 매겼는지 여부 → (docs, complete)
+
+        점수를 매긴 문서에는 metadata["rerank_score"]를 붙이고, 점수가 없는 문서는 원래 순서로 뒤에 둔다.
+        """
+        scores = self.score(query, docs, budget)
+        for doc, value in zip(docs, scores):
+            if value is not None:
+                doc.metadata["rerank_score"] = value
+        scored = sorted((i for i, value in enumerate(scores) if value is not None), key=lambda i: -scores[i])
+        unscored = [i for i, value in enumerate(scores) if value is None]
+        return [docs[i] for i in scored + unscored], not unscored
+
+    def cache_hit_rate(self):
+        return self.stats["cache_hits"] / self.stats["pairs"] if self.stats["pairs"] else 0.0
+
+    def complete_rate(self):
+        """예산 안에 모든 후보를 정렬한 요청 비율"""
+        return self.stats["complete"] / self.stats["requests"] if self.stats["requests"] else 0.0
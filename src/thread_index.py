@@ -0,0 +1,30 @@
+"""scripts/thread_builder.py가 만든 스레드 인덱스 (검색 결과를 대화 전체로 확장할 때 사용)"""
+import json
+import os
+
+
+class ThreadIndex:
+    def __init__(self, message_root, threads):
+        self.message_root = message_root
+        self.threads = threads
+
+    @classmethod
+    def load(cls, path):
+        """인덱스가 없으면 None (스레드 확장 없이 검색)"""
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data["message_root"], data["threads"])
+
+    def root(self, message_id):
+        """message_id의 현재 스레드 루트 ID (인덱스에 없으면 None)"""
+        return self.message_root.get(message_id)
+
+    def members(self, message_id):
+        """message_id가 속한 스레드의 [(message_id, date_iso)] (시간순, 없으면 빈 리스트)"""
+        root = self.message_root.get(message_id)
+        return [tuple(member) for member in self.threads.get(root, [])] if root else []
+
+    def __len__(self):
+        return len(self.threads)
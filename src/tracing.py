@@ -0,0 +1,232 @@
+"""요청 단위 트레이싱 (중첩 span, OpenTelemetry 호환 JSONL 내보내기, 최근 요청 지연 백분위)
+
+RequestTrace 하나가 채팅 한 턴이다. stage()로 연 구간은 같은 스레드에서 열려 있는 span 아래에 중첩되고,
+스레드 풀에서 실행하는 단계는 parent를 직접 넘긴다. span에는 토큰 수/후보 수 같은 속성을 붙이며,
+예외가 나면 ERROR 상태와 메시지를 남긴 뒤 예외를 그대로 전달한다.
+
+TraceExporter는 끝난 trace를 OTLP/JSON 형식(한 줄에 resourceSpans 하나)으로 파일에 추가한다.
+OpenTelemetry Collector의 otlpjsonfile receiver 등으로 그대로 읽을 수 있다.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+SERVICE_NAME = "outlook-rag"
+STATUS_CODES = {"OK": 1, "ERROR": 2}  # OTLP Status.code
+SPAN_KIND_INTERNAL = 1
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "status", "error")
+
+    def __init__(self, name, parent_id=None, start_ns=None):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = {}
+        self.status = "OK"
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def fail(self, error):
+        self.status = "ERROR"
+        self.error = f"{type(error).__name__}: {error}"
+
+    @property
+    def seconds(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+
+class NullSpan:
+    """trace가 없을 때 속성 기록을 무시하는 span"""
+
+    def set(self, **attributes):
+        return self
+
+    def fail(self, error):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class RequestTrace:
+    """요청 하나의 span 트리와 단계별 실행 횟수/소요 시간 합계"""
+
+    def __init__(self, query, name="chat_turn"):
+        self.query = query
+        self.trace_id = uuid.uuid4().hex
+        self.counts = Counter()
+        self.timings = {}
+        self.metrics = {}  # 토큰 수 등 시간 외 수치 (루트 span 속성으로도 기록)
+        self.started = time.perf_counter()
+        self.root = Span(name).set(query=query)
+        self.spans = [self.root]
+        self.lock = threading.Lock()
+        self._local = threading.local()
+
+    def current(self):
+        """현재 스레드에서 열려 있는 가장 안쪽 span (없으면 루트)"""
+        stack = getattr(self._local, "stack", None)
+        return stack[-1] if stack else self.root
+
+    def start(self, name, parent=None, start_ns=None, **attributes):
+        """with 블록으로 감쌀 수 없는 구간(스트리밍 생성 등)을 여는 span - end()로 닫음"""
+        return Span(name, (parent or self.current()).span_id, start_ns).set(**attributes)
+
+    def end(self, span):
+        span.end_ns = time.time_ns()
+        with self.lock:
+            self.spans.append(span)
+            self.counts[span.name] += 1
+            self.timings[span.name] = self.timings.get(span.name, 0.0) + span.seconds
+
+    @contextmanager
+    def stage(self, name, parent=None, **attributes):
+        span = self.start(name, parent, **attributes)
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(span)
+        try:
+            yield span
+        except Exception as e:
+            span.fail(e)
+            raise
+        finally:
+            stack.pop()
+            self.end(span)
+
+    def record(self, name, seconds, parent=None, **attributes):
+        """이미 끝난 구간(예: 첫 토큰까지 시간)을 직접 기록"""
+        span = self.start(name, parent, time.time_ns() - int(seconds * 1e9), **attributes)
+        self.end(span)
+        return span
+
+    def note(self, name, value):
+        self.metrics[name] = value
+        self.root.set(**{name: value})
+
+    def fail(self, error):
+        """요청 전체 실패 (루트 span을 ERROR로)"""
+        self.root.fail(error)
+
+    def elapsed(self):
+        """요청 시작부터 지금까지 걸린 시간 (초)"""
+        return time.perf_counter() - self.started
+
+    def summary(self):
+        return " · ".join(
+            f"{name} {self.timings[name] * 1000:.0f}ms ×{count}" for name, count in self.counts.items()
+        )
+
+    def errors(self):
+        return [span for span in self.spans if span.status == "ERROR"]
+
+    def to_otlp(self):
+        """OTLP/JSON resourceSpans 한 건"""
+        if self.root.end_ns is None:
+            self.root.end_ns = time.time_ns()
+        return {"resourceSpans": [{
+            "resource": {"attributes": otlp_attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{
+                "scope": {"name": "rag_pipeline"},
+                "spans": [otlp_span(self.trace_id, span) for span in self.spans],
+            }],
+        }]}
+
+
+@contextmanager
+def traced(trace, name, parent=None, **attributes):
+    """trace가 없으면 아무것도 기록하지 않는 stage (NULL_SPAN을 넘김)"""
+    if trace is None:
+        yield NULL_SPAN
+    else:
+        with trace.stage(name, parent, **attributes) as span:
+            yield span
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [otlp_value(v) for v in value]}}
+    return {"stringValue": str(value)}
+
+
+def otlp_attributes(attributes):
+    return [{"key": key, "value": otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def otlp_span(trace_id, span):
+    record = {
+        "traceId": trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": SPAN_KIND_INTERNAL,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns or span.start_ns),
+        "attributes": otlp_attributes(span.attributes),
+        "status": {"code": STATUS_CODES[span.status]},
+    }
+    if span.parent_id:
+        record["parentSpanId"] = span.parent_id
+    if span.error:
+        record["status"]["message"] = span.error
+    return record
+
+
+class TraceExporter:
+    """끝난 trace를 JSONL 파일에 추가하고, 최근 window개 요청의 span별 소요 시간을 보관"""
+
+    def __init__(self, path, window, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.recent = deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.stats = {"exported": 0, "errors": 0, "write_failures": 0}
+
+    def export(self, trace):
+        line = json.dumps(trace.to_otlp(), ensure_ascii=False) + "\n"
+        durations = dict(trace.timings, total=trace.root.seconds)
+        with self.lock:
+            self.recent.append(durations)
+            self.stats["exported"] += 1
+            self.stats["errors"] += bool(trace.errors())
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                # 파일이 max_bytes를 넘으면 .1로 넘기고 새로 시작 (이전 .1은 덮어씀)
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+            except OSError as e:
+                self.stats["write_failures"] += 1
+                print(f"[WARN] trace 기록 실패: {e}")
+
+    def percentiles(self):
+        """span 이름 → {"n", "p50", "p95", "p99"} (ms, 최근 요청 기준, 전체 시간은 "total")"""
+        with self.lock:
+            recent = list(self.recent)
+        values = {}
+        for durations in recent:
+            for name, seconds in durations.items():
+                values.setdefault(name, []).append(seconds * 1000)
+        result = {}
+        for name, samples in values.items():
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            result[name] = {"n": len(samples), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+        return result